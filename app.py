@@ -1,15 +1,46 @@
 import os
+import io
+import random
+import csv
+import gzip
 import json
+import heapq
+import hashlib
+import time
+import hmac
+import logging
+import socket
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import Flask, jsonify, request, send_file, g
+from contextlib import contextmanager
+from itertools import islice
+import click
+from flask import Flask, jsonify, request, send_file, g, Response, stream_with_context, has_request_context, has_app_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func, and_, inspect, text
-from sqlalchemy.exc import OperationalError, IntegrityError
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import func, and_, or_, tuple_, inspect, text, event, case, select, bindparam, true, create_engine, Select, CompoundSelect
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError, IntegrityError, SQLAlchemyError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.util import find_tables
 from dotenv import load_dotenv
 from itsdangerous import URLSafeTimedSerializer
 from werkzeug.security import generate_password_hash, check_password_hash
+from cache import TTLCache, TenantCache, make_backend
+from ids import is_ulid, new_id
+from metrics import PoolStats, RouteStats, RequestProfiler, render_prometheus
+
+try: import orjson  # optional: much faster encoding of large list responses
+except ImportError: orjson = None
+try: import fcntl  # migration lock file for SQLite; not on Windows
+except ImportError: fcntl = None
+try: import brotli  # optional: smaller than gzip for browsers that accept br
+except ImportError: brotli = None
 
 # --- CONFIGURATION ---
 load_dotenv('data.env') 
@@ -19,19 +50,118 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'change-this-to-a-secure-random-key-in-production')
 CORS(app) 
 
+class OrjsonProvider(DefaultJSONProvider):
+    # Same documents as the default provider (sorted keys; dates, decimals etc.
+    # through Flask's `default`), encoded by orjson. Non-ASCII text is written
+    # as UTF-8 instead of \u escapes.
+    def options(self, extra=0):
+        return orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | extra
+
+    def dumps(self, obj, **kwargs):
+        if kwargs: return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.options()).decode()
+
+    def loads(self, s, **kwargs):
+        return super().loads(s, **kwargs) if kwargs else orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if self.compact is False or (self.compact is None and self._app.debug): return super().response(*args, **kwargs)
+        body = orjson.dumps(self._prepare_response_obj(args, kwargs), default=self.default, option=self.options(orjson.OPT_APPEND_NEWLINE))
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+# JSON_PROVIDER=stdlib forces the built-in encoder
+if orjson and os.environ.get('JSON_PROVIDER', 'orjson') != 'stdlib': app.json = OrjsonProvider(app)
+
 # --- DATABASE SETUP ---
 database_url = os.environ.get('DATABASE_URL')
 
 if not database_url:
     print("WARNING: DATABASE_URL not set. App may fail to connect.")
     
-if database_url and database_url.startswith("postgres://"):
-    database_url = database_url.replace("postgres://", "postgresql://", 1)
+def pg_url(url): return url.replace("postgres://", "postgresql://", 1) if url and url.startswith("postgres://") else url
+
+database_url = pg_url(database_url)
 
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-db = SQLAlchemy(app)
+# Optional read replicas (comma-separated URLs) and tenants moved to their own
+# database ("HYD01=postgresql://...,BLR02=..."). Both become Flask-SQLAlchemy
+# binds with the same pool settings; RoutingSession picks one per statement.
+REPLICA_URLS = [pg_url(u.strip()) for u in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if u.strip()]
+REPLICA_BINDS = [f'replica{i}' for i in range(len(REPLICA_URLS))]
+TENANT_DATABASE_URLS = {tid.strip(): pg_url(url.strip()) for tid, url in (pair.split('=', 1) for pair in os.environ.get('TENANT_DATABASE_URLS', '').split(',') if pair.strip())}
+app.config['SQLALCHEMY_BINDS'] = {**dict(zip(REPLICA_BINDS, REPLICA_URLS)), **{f'tenant:{tid}': url for tid, url in TENANT_DATABASE_URLS.items()}}
+
+# Pool settings (data.env). Size the pool per gunicorn worker: workers x
+# (DB_POOL_SIZE + DB_MAX_OVERFLOW) must stay under the server's connection limit.
+DB_POOL = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+    'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),  # under the host's idle-connection cutoff
+    'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1').lower() in ('1', 'true', 'yes'),
+}
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))  # PostgreSQL only; 0 = no limit
+pool_stats = PoolStats()
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that records how long each checkout waited for a free connection
+    def _do_get(self):
+        started = time.perf_counter()
+        try: conn = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_stats.record_wait(time.perf_counter() - started)
+        return conn
+
+POSTGRES_DRIVERS = ('psycopg2', 'psycopg', 'pg8000')
+
+@event.listens_for(TimedQueuePool, 'connect')
+def set_statement_timeout(dbapi_conn, connection_record):
+    # A session-level SET, so it also works through session-mode poolers. The
+    # pool serves the primary, replicas and tenant databases, so it goes by the
+    # driver of this connection rather than DATABASE_URL.
+    if DB_STATEMENT_TIMEOUT_MS and type(dbapi_conn).__module__.split('.')[0] in POSTGRES_DRIVERS:
+        cursor = dbapi_conn.cursor()
+        cursor.execute(f"SET statement_timeout = {DB_STATEMENT_TIMEOUT_MS}")
+        cursor.close()
+        dbapi_conn.commit()
+
+# In-memory SQLite keeps Flask-SQLAlchemy's single-connection pool
+if database_url and database_url not in ('sqlite://', 'sqlite:///:memory:'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'poolclass': TimedQueuePool, **DB_POOL}
+
+# Read before a tenant is known (login, token checks, the job queue) or shared
+# by every tenant, so always on the primary
+GLOBAL_TABLES = {'dairy_tenant', 'dairy_user', 'job', 'schema_version', 'replica_heartbeat'}
+
+class RoutingSession(FlaskSession):
+    # Per statement: the engine pinned by pinned_bind() (migrations, tenant-copy),
+    # else the tenant's own database for tenant tables, else a replica for plain
+    # SELECTs on @replica_reads routes, else the primary
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            if 'pinned_bind' in g: return g.pinned_bind
+            if REPLICA_BINDS or TENANT_DATABASE_URLS:
+                key = self.route(mapper, clause)
+                if key: return self._db.engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def route(self, mapper, clause):
+        tables = [inspect(mapper).local_table] if mapper is not None else find_tables(clause, include_crud=True) if clause is not None else []
+        tid = g.get('tenant_id')
+        # Raw SQL names no tables; treat it as tenant data
+        if tid in TENANT_DATABASE_URLS and (not tables or any(t.name not in GLOBAL_TABLES for t in tables)): return f'tenant:{tid}'
+        replica = g.get('read_replica')
+        if not replica or self.info.get('wrote'): return None
+        if self._flushing or not isinstance(clause, (Select, CompoundSelect)):
+            self.info['wrote'] = True  # the rest of the request reads its own writes from the primary
+            return None
+        return replica
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
 
 # --- DEFAULT PRODUCTS LIST ---
@@ -77,15 +207,19 @@ class DairyUser(db.Model):
     password = db.Column(db.String(255), nullable=False) 
     role = db.Column(db.String(20), default='admin')
     tenant_id = db.Column(db.String(50), db.ForeignKey('dairy_tenant.id'), nullable=False)
+    # Bumped whenever role or password changes; tokens carrying an older value are rejected
+    token_version = db.Column(db.Integer, default=0)
 
 class Employee(db.Model):
-    id = db.Column(db.String(50), primary_key=True)
+    __table_args__ = (db.Index('ix_employee_tenant_updated', 'tenant_id', 'updated_at'),)
+    id = db.Column(db.String(50), primary_key=True, default=lambda: new_id('E'))
     tenant_id = db.Column(db.String(50), db.ForeignKey('dairy_tenant.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     phone = db.Column(db.String(20))
     role = db.Column(db.String(50))
     designation = db.Column(db.String(100))
     username = db.Column(db.String(50)) 
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def to_dict(self): 
         return {
@@ -98,30 +232,43 @@ class Employee(db.Model):
         }
 
 class Product(db.Model):
-    id = db.Column(db.String(50), primary_key=True)
+    __table_args__ = (db.Index('ix_product_tenant_updated', 'tenant_id', 'updated_at'),)
+    id = db.Column(db.String(50), primary_key=True, default=lambda: new_id('P'))
     tenant_id = db.Column(db.String(50), db.ForeignKey('dairy_tenant.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     price = db.Column(db.Float, nullable=False)
     unit = db.Column(db.String(20))
     is_active = db.Column(db.Boolean, default=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def to_dict(self): return {"id": self.id, "name": self.name, "price": self.price, "unit": self.unit, "isActive": self.is_active}
 
 class Customer(db.Model):
-    id = db.Column(db.String(50), primary_key=True)
+    __table_args__ = (
+        db.Index('ix_customer_tenant_updated', 'tenant_id', 'updated_at'),
+        db.Index('ix_customer_tenant_phone', 'tenant_id', 'phone'),
+        # Partial: only customers with something to collect or refund, in worklist order
+        db.Index('ix_customer_tenant_dues_open', 'tenant_id', 'dues', 'id', postgresql_where=text('dues <> 0'), sqlite_where=text('dues <> 0')),
+    )
+    id = db.Column(db.String(50), primary_key=True, default=lambda: new_id('C'))
     tenant_id = db.Column(db.String(50), db.ForeignKey('dairy_tenant.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     phone = db.Column(db.String(20))
     address = db.Column(db.String(200))
     dues = db.Column(db.Float, default=0.0)
     status = db.Column(db.String(20), default='Active')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     rates = db.relationship('CustomerRate', backref='customer', cascade="all, delete-orphan")
 
-    def to_dict(self):
-        custom_rates = {r.product_id: r.rate for r in self.rates}
+    def to_dict(self, custom_rates=None):
+        if custom_rates is None: custom_rates = {r.product_id: r.rate for r in self.rates}
         return {"id": self.id, "name": self.name, "phone": self.phone, "address": self.address, "dues": self.dues, "status": self.status, "customRates": custom_rates}
 
 class CustomerRate(db.Model):
+    __table_args__ = (
+        db.Index('ix_customer_rate_customer_tenant', 'customer_id', 'tenant_id'),
+        db.Index('ix_customer_rate_tenant_product', 'tenant_id', 'product_id'),  # price_matrix() join
+    )
     id = db.Column(db.Integer, primary_key=True)
     tenant_id = db.Column(db.String(50), db.ForeignKey('dairy_tenant.id'), nullable=False)
     customer_id = db.Column(db.String(50), db.ForeignKey('customer.id'), nullable=False)
@@ -129,54 +276,348 @@ class CustomerRate(db.Model):
     rate = db.Column(db.Float, nullable=False)
 
 class Order(db.Model):
-    id = db.Column(db.String(50), primary_key=True)
+    __table_args__ = (
+        db.Index('ix_order_tenant_updated', 'tenant_id', 'updated_at'),
+        db.Index('ix_order_tenant_date', 'tenant_id', 'date'),
+        db.Index('uq_order_tenant_customer_date', 'tenant_id', 'customer_id', 'date', unique=True),
+    )
+    id = db.Column(db.String(50), primary_key=True, default=lambda: new_id('O'))
     tenant_id = db.Column(db.String(50), db.ForeignKey('dairy_tenant.id'), nullable=False)
     customer_id = db.Column(db.String(50), db.ForeignKey('customer.id'))
     customer_name = db.Column(db.String(100)) 
     date = db.Column(db.String(20), nullable=False) 
     status = db.Column(db.String(20)) 
     total = db.Column(db.Float, default=0.0)
-    items_json = db.Column(db.Text, default='[]') 
+    # Legacy line-item blob, kept only until migrate_order_items() moves it into order_item
+    items_json = db.Column(db.Text, default=None) 
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    items = db.relationship('OrderItem', order_by='OrderItem.position', lazy='selectin', cascade="all, delete-orphan", passive_deletes=True)
 
     def to_dict(self):
-        items_list = []
-        if self.items_json:
-            try: items_list = json.loads(self.items_json)
-            except: items_list = []
-        formatted_items = []
-        for i in items_list:
-            formatted_items.append({
-                "id": i.get('productId') or i.get('id'),
-                "name": i.get('name'),
-                "quantity": i.get('quantity'),
-                "price": i.get('price')
-            })
+        if self.items: formatted_items = [i.to_dict() for i in self.items]
+        else: formatted_items = [i.to_dict() for i in legacy_order_items(self)]
         return {"id": self.id, "customerId": self.customer_id, "customerName": self.customer_name, "date": self.date, "status": self.status, "total": self.total, "items": formatted_items}
 
+class OrderItem(db.Model):
+    __table_args__ = (db.Index('ix_order_item_tenant_date_product', 'tenant_id', 'date', 'product_id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.String(50), db.ForeignKey('dairy_tenant.id'), nullable=False)
+    order_id = db.Column(db.String(50), db.ForeignKey('order.id', ondelete='CASCADE'), nullable=False, index=True)
+    # Copied from the order so product reports don't need the join
+    date = db.Column(db.String(20), nullable=False)
+    product_id = db.Column(db.String(50), nullable=False)
+    name = db.Column(db.String(100))
+    quantity = db.Column(db.Float, default=0.0)
+    price = db.Column(db.Float, default=0.0)
+    position = db.Column(db.Integer, default=0)
+
+    def to_dict(self): return {"id": self.product_id, "name": self.name, "quantity": plain_number(self.quantity), "price": plain_number(self.price)}
+
+def plain_number(value):
+    # 2.0 -> 2 so item payloads look the same as the JSON the client posted
+    return int(value) if isinstance(value, float) and value.is_integer() else value
+
+def order_item_rows(tid, order_id, date_str, items):
+    return [{
+        'tenant_id': tid,
+        'order_id': order_id,
+        'date': date_str,
+        'product_id': i.get('productId') or i.get('id') or '',
+        'name': i.get('name'),
+        'quantity': float(i.get('quantity') or 0),
+        'price': float(i.get('price') or 0),
+        'position': pos,
+    } for pos, i in enumerate(items)]
+
+def legacy_order_items(order):
+    # Unsaved OrderItem objects for a row that still carries items_json
+    if not order.items_json: return []
+    try: items_list = json.loads(order.items_json)
+    except: items_list = []
+    return [OrderItem(**row) for row in order_item_rows(order.tenant_id, order.id, order.date, items_list)]
+
 class Payment(db.Model):
-    id = db.Column(db.String(50), primary_key=True)
+    __table_args__ = (
+        db.Index('ix_payment_tenant_updated', 'tenant_id', 'updated_at'),
+        db.Index('ix_payment_tenant_date', 'tenant_id', 'date'),
+    )
+    id = db.Column(db.String(50), primary_key=True, default=lambda: new_id('PM'))
     tenant_id = db.Column(db.String(50), db.ForeignKey('dairy_tenant.id'), nullable=False)
     customer_id = db.Column(db.String(50), db.ForeignKey('customer.id'))
     amount = db.Column(db.Float, nullable=False)
     date = db.Column(db.String(20))
     collected_by = db.Column(db.String(100))
     note = db.Column(db.String(200))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def to_dict(self): return {"id": self.id, "customerId": self.customer_id, "amount": self.amount, "date": self.date, "collectedBy": self.collected_by, "note": self.note}
 
 class Expense(db.Model):
-    id = db.Column(db.String(50), primary_key=True)
+    __table_args__ = (
+        db.Index('ix_expense_tenant_updated', 'tenant_id', 'updated_at'),
+        db.Index('ix_expense_tenant_date', 'tenant_id', 'date'),
+    )
+    id = db.Column(db.String(50), primary_key=True, default=lambda: new_id('EX'))
     tenant_id = db.Column(db.String(50), db.ForeignKey('dairy_tenant.id'), nullable=False)
     title = db.Column(db.String(200))
     amount = db.Column(db.Float)
     category = db.Column(db.String(50))
     date = db.Column(db.String(20))
     employee_id = db.Column(db.String(50)) 
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def to_dict(self): return {"id": self.id, "title": self.title, "amount": self.amount, "category": self.category, "date": self.date, "employeeId": self.employee_id}
 
+class SyncTombstone(db.Model):
+    # One row per deleted record so delta syncs can tell clients what to drop
+    __table_args__ = (db.Index('ix_sync_tombstone_tenant_deleted', 'tenant_id', 'deleted_at'),)
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.String(50), db.ForeignKey('dairy_tenant.id'), nullable=False)
+    entity = db.Column(db.String(20), nullable=False)
+    record_id = db.Column(db.String(50), nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class DailyLedger(db.Model):
+    # Per-tenant, per-day rollup of what moved total dues, kept current by
+    # ledger_apply(). closing_balance is the tenant's total dues at end of day.
+    __table_args__ = (db.Index('uq_daily_ledger_tenant_date', 'tenant_id', 'date', unique=True),)
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.String(50), db.ForeignKey('dairy_tenant.id'), nullable=False)
+    date = db.Column(db.String(20), nullable=False)
+    sales = db.Column(db.Float, default=0.0)  # finalized order totals
+    collections = db.Column(db.Float, default=0.0)
+    adjustments = db.Column(db.Float, default=0.0)  # direct dues edits, added/removed customers
+    closing_balance = db.Column(db.Float, default=0.0)
+
+    @property
+    def opening_balance(self): return self.closing_balance - self.sales + self.collections - self.adjustments
+
+    def to_dict(self): return {"date": self.date, "sales": self.sales, "collections": self.collections, "adjustments": self.adjustments, "openingBalance": round(self.opening_balance, 2), "closingBalance": round(self.closing_balance, 2)}
+
+class MutationKey(db.Model):
+    # Client idempotency keys of applied /api/batch operations, with the result
+    # to hand back when the same operation is replayed
+    __table_args__ = (db.Index('ix_mutation_key_tenant_created', 'tenant_id', 'created_at'),)
+    tenant_id = db.Column(db.String(50), db.ForeignKey('dairy_tenant.id'), primary_key=True)
+    key = db.Column(db.String(100), primary_key=True)
+    op = db.Column(db.String(40), nullable=False)
+    status = db.Column(db.Integer, nullable=False)
+    result = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ReplicaHeartbeat(db.Model):
+    # A single row the primary touches every REPLICA_CHECK_SECONDS; how old a
+    # replica's copy is tells how far behind that replica is
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.DateTime, nullable=False)
+
+class ImportJob(db.Model):
+    # Progress of one bulk import. `position` counts records already committed,
+    # so a failed import resumes by re-sending the same file with ?job=<id>.
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.String(50), db.ForeignKey('dairy_tenant.id'), nullable=False)
+    entity = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.String(20), default='running')  # running, done, failed
+    position = db.Column(db.Integer, default=0)
+    inserted = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    errors = db.Column(db.Text)  # JSON list of {"line", "error"}, first IMPORT_MAX_ERRORS only
+    message = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self): return {"id": self.id, "entity": self.entity, "status": self.status, "processed": self.position, "inserted": self.inserted, "failed": self.failed, "errors": json.loads(self.errors or '[]'), "message": self.message}
+
+class Job(db.Model):
+    # A background job (see BACKGROUND JOBS). The table is the queue: workers
+    # claim 'queued' rows whose run_after has passed, so jobs survive restarts.
+    __table_args__ = (db.Index('ix_job_status_run_after', 'status', 'run_after'), db.Index('ix_job_tenant_created', 'tenant_id', 'created_at'))
+    id = db.Column(db.String(50), primary_key=True, default=lambda: new_id('J'))
+    tenant_id = db.Column(db.String(50), db.ForeignKey('dairy_tenant.id'), nullable=False)
+    kind = db.Column(db.String(30), nullable=False)
+    params = db.Column(db.Text)  # JSON
+    status = db.Column(db.String(20), default='queued')  # queued, running, done, failed
+    progress = db.Column(db.Float, default=0.0)  # 0..1
+    message = db.Column(db.String(500))
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=3)
+    run_after = db.Column(db.DateTime)  # retry backoff
+    worker = db.Column(db.String(100))
+    result = db.Column(db.Text)  # JSON; {"file": ...} when the output is a file
+    created_by = db.Column(db.Integer)  # DairyUser.id
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        iso = lambda d: d.isoformat() if d else None
+        return {"id": self.id, "kind": self.kind, "params": json.loads(self.params or '{}'), "status": self.status, "progress": round(self.progress or 0.0, 3), "message": self.message,
+                "attempts": self.attempts, "maxAttempts": self.max_attempts, "createdAt": iso(self.created_at), "startedAt": iso(self.started_at), "finishedAt": iso(self.finished_at),
+                "resultUrl": f"/api/jobs/{self.id}/result" if self.status == 'done' else None}
+
+class ArchivedPeriod(db.Model):
+    # One tenant-month of orders and payments moved out of the hot tables into
+    # a gzip NDJSON file under ARCHIVE_DIR (see COLD ARCHIVE).
+    __table_args__ = (db.Index('uq_archived_period_tenant_month', 'tenant_id', 'month', unique=True),)
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.String(50), db.ForeignKey('dairy_tenant.id'), nullable=False)
+    month = db.Column(db.String(7), nullable=False)  # YYYY-MM
+    path = db.Column(db.String(300), nullable=False)  # relative to ARCHIVE_DIR
+    sha256 = db.Column(db.String(64))
+    orders = db.Column(db.Integer, default=0)
+    payments = db.Column(db.Integer, default=0)
+    sales = db.Column(db.Float, default=0.0)  # finalized order totals
+    collections = db.Column(db.Float, default=0.0)
+    daily = db.Column(db.Text)  # JSON {date: [sales, collections]}, for ledger rebuilds
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self): return {"month": self.month, "path": self.path, "orders": self.orders, "payments": self.payments, "sales": self.sales, "collections": self.collections, "archivedAt": self.archived_at.isoformat() if self.archived_at else None}
+
+# --- SYNC TRACKING ---
+# Keys match the collections returned by /api/sync
+SYNC_MODELS = {
+    'customers': Customer,
+    'products': Product,
+    'employees': Employee,
+    'orders': Order,
+    'payments': Payment,
+    'expenses': Expense,
+}
+SYNC_ENTITY_BY_MODEL = {model: key for key, model in SYNC_MODELS.items()}
+
+# Rows committed while a sync is running can carry an updated_at slightly older
+# than the cursor we hand out, so every delta re-reads this much history.
+SYNC_CURSOR_OVERLAP = timedelta(seconds=int(os.environ.get('SYNC_CURSOR_OVERLAP_SECONDS', 5)))
+
+@event.listens_for(db.session, 'before_flush')
+def record_tombstones(session, flush_context, instances):
+    for obj in list(session.deleted):
+        entity = SYNC_ENTITY_BY_MODEL.get(type(obj))
+        if entity:
+            session.add(SyncTombstone(tenant_id=obj.tenant_id, entity=entity, record_id=obj.id))
+
 # --- HELPERS ---
 
+def upsert_rows(model, rows, conflict_cols, update_cols, match_cols=()):
+    # Multi-row INSERT ... ON CONFLICT DO UPDATE on PostgreSQL and SQLite; other
+    # backends get one INSERT for new keys and one executemany UPDATE for the rest.
+    # A conflicting row is only updated when it also agrees on match_cols.
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql': from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else: from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(model).values(rows)
+        stmt = stmt.on_conflict_do_update(index_elements=conflict_cols, set_={c: stmt.excluded[c] for c in update_cols},
+                                          where=and_(*[model.__table__.c[c] == stmt.excluded[c] for c in match_cols]) if match_cols else None)
+        db.session.execute(stmt)
+        return
+
+    table = model.__table__
+    keys = {tuple(r[c] for c in conflict_cols) for r in rows}
+    cond = [table.c[c].in_({k[i] for k in keys}) for i, c in enumerate(conflict_cols)]
+    found = {tuple(r) for r in db.session.execute(select(*[table.c[c] for c in conflict_cols]).where(and_(*cond)))}
+    inserts = [r for r in rows if tuple(r[c] for c in conflict_cols) not in found]
+    updates = [{**{f'b_{c}': r[c] for c in (*conflict_cols, *match_cols)}, **{f'v_{c}': r[c] for c in update_cols}} for r in rows if tuple(r[c] for c in conflict_cols) in found]
+    if inserts: db.session.execute(table.insert(), inserts)
+    if updates:
+        stmt = table.update().where(and_(*[table.c[c] == bindparam(f'b_{c}') for c in (*conflict_cols, *match_cols)])).values({c: bindparam(f'v_{c}') for c in update_cols})
+        db.session.execute(stmt, updates)
+
+def apply_dues_deltas(tid, deltas):
+    # One UPDATE for every customer touched, as an in-database increment
+    deltas = {cid: d for cid, d in deltas.items() if d}
+    if not deltas: return
+    Customer.query.filter(and_(Customer.tenant_id == tid, Customer.id.in_(deltas))).update(
+        {Customer.dues: func.coalesce(Customer.dues, 0) + case(deltas, value=Customer.id, else_=0)}, synchronize_session=False)
+
+# user_id -> (role, token_version), or None for a deleted user. Other workers
+# see a change once their entry expires, so keep the TTL short.
+auth_cache = TTLCache(maxsize=int(os.environ.get('AUTH_CACHE_SIZE', 2048)), ttl=float(os.environ.get('AUTH_CACHE_TTL', 30)))
+_AUTH_MISS = object()
+
+def issue_token(user):
+    return serializer.dumps({'user_id': user.id, 'tenant_id': user.tenant_id, 'role': user.role, 'tv': user.token_version or 0})
+
+def auth_state(user_id):
+    state = auth_cache.get(user_id, _AUTH_MISS)
+    if state is _AUTH_MISS:
+        row = db.session.query(DairyUser.role, DairyUser.token_version).filter_by(id=user_id).first()
+        state = (row.role, row.token_version or 0) if row else None
+        auth_cache.set(user_id, state)
+    return state
+
+def revoke_user_tokens(user):
+    # Call whenever a user's role or password changes, or before deleting them.
+    # The cache entry is dropped once the change is committed.
+    user.token_version = (user.token_version or 0) + 1
+    db.session.info.setdefault('revoked_users', set()).add(user.id)
+
+@event.listens_for(db.session, 'after_commit')
+def evict_revoked_users(session):
+    for user_id in session.info.pop('revoked_users', ()): auth_cache.delete(user_id)
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_revoked_users(session):
+    session.info.pop('revoked_users', None)
+
+# --- TENANT READ CACHE ---
+# The product catalog and price matrix change rarely but are read on every
+# sync and sheet save. Dues move constantly, so customer rows are always read live. The
+# default memory:// backend is per process; with more than one worker set
+# CACHE_URL to a Redis server so invalidations reach every worker.
+tenant_cache = TenantCache(make_backend(os.environ.get('CACHE_URL', 'memory://'), maxsize=int(os.environ.get('CACHE_MAX_ENTRIES', 1024)),
+                                        ttl=float(os.environ.get('CACHE_TTL', 60))), ttl=float(os.environ.get('CACHE_TTL', 60)))
+CACHE_NAMESPACES = {'Product': ('catalog', 'prices'), 'CustomerRate': ('prices',), 'Customer': ('prices',), 'ArchivedPeriod': ('archive',)}
+
+def invalidate_tenant_cache(tid, *namespaces):
+    # Versions are bumped after commit so a concurrent reader can't re-cache old rows
+    db.session.info.setdefault('cache_invalidations', set()).update((tid, ns) for ns in namespaces)
+
+def cached(tid, namespace, name, load):
+    # Read through the tenant cache, filled from the primary. A transaction with
+    # uncommitted changes to the namespace reads live and caches nothing: its
+    # rows may still roll back, and invalidation only runs on commit.
+    db.session.flush()
+    if (tid, namespace) in db.session.info.get('cache_invalidations', ()): return from_primary(load)()
+    return tenant_cache.get_or_load(tid, namespace, name, from_primary(load))
+
+def product_catalog(tid):
+    return cached(tid, 'catalog', 'products', lambda: [p.to_dict() for p in Product.query.filter_by(tenant_id=tid).all()])
+
+def price_matrix(tid):
+    # Every customer's effective price per product, from one Product LEFT JOIN
+    # CustomerRate query: {"products": {pid: list price}, "rates": {cid: {pid: rate}}}.
+    # Customers without a negotiated rate pay the list price (see effective_price).
+    def load():
+        prices, rates = {}, {}
+        rows = db.session.query(Product.id, Product.price, CustomerRate.customer_id, CustomerRate.rate).outerjoin(
+            CustomerRate, and_(CustomerRate.tenant_id == Product.tenant_id, CustomerRate.product_id == Product.id)).filter(Product.tenant_id == tid)
+        for pid, price, cid, rate in rows:
+            prices[pid] = price
+            if cid is not None: rates.setdefault(cid, {})[pid] = rate
+        return {"products": prices, "rates": rates}
+    return cached(tid, 'prices', 'matrix', load)
+
+def effective_price(matrix, cid, pid):
+    rate = matrix['rates'].get(cid, {}).get(pid)
+    return rate if rate is not None else matrix['products'].get(pid)
+
+@event.listens_for(db.session, 'before_flush')
+def track_cache_invalidations(session, flush_context, instances):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        namespaces = CACHE_NAMESPACES.get(type(obj).__name__)
+        if isinstance(obj, Customer) and obj not in session.deleted: continue  # only a delete drops its rates
+        if namespaces and obj.tenant_id: session.info.setdefault('cache_invalidations', set()).update((obj.tenant_id, ns) for ns in namespaces)
+
+@event.listens_for(db.session, 'after_commit')
+def apply_cache_invalidations(session):
+    for tid, ns in session.info.pop('cache_invalidations', ()): tenant_cache.invalidate(tid, ns)
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_cache_invalidations(session):
+    session.info.pop('cache_invalidations', None)
+
 def require_auth(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -188,9 +629,14 @@ def require_auth(f):
             g.tenant_id = data['tenant_id']
             g.user_id = data['user_id']
             
-            # Load Role
-            user = DairyUser.query.get(g.user_id)
-            g.role = user.role if user else 'admin'
+            # Role comes from the token; the cache only confirms it hasn't been revoked
+            state = auth_state(g.user_id)
+            if state is None: raise LookupError('user deleted')
+            if 'tv' in data:
+                if data['tv'] != state[1]: raise LookupError('token revoked')
+                g.role = data['role']
+            else:
+                g.role = state[0]  # token issued before roles were signed in
             
         except Exception: return jsonify({'error': 'Invalid or expired token'}), 401
         return f(*args, **kwargs)
@@ -206,14 +652,637 @@ def require_role(roles):
         return decorated
     return wrapper
 
+# --- READ REPLICAS & TENANT DATABASES ---
+# Routes decorated with @replica_reads send their SELECTs to a random replica
+# that is at most REPLICA_MAX_LAG_SECONDS behind, or to the primary when none
+# is. Lag is the age of the replica's copy of the ReplicaHeartbeat row relative
+# to the primary's, checked at most every REPLICA_CHECK_SECONDS per process. A
+# tenant listed in TENANT_DATABASE_URLS keeps all its tenant tables (reads and
+# writes) in its own database and does not use the replicas; users, tenants and
+# jobs stay on the primary.
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 10))
+REPLICA_CHECK_SECONDS = float(os.environ.get('REPLICA_CHECK_SECONDS', 2))
+replica_checks = {}  # bind key -> (checked at, lag seconds or None if unusable, replica's heartbeat)
+replica_lock = threading.Lock()
+replica_log = logging.getLogger('dairy.replicas')
+
+def read_heartbeat(engine):
+    with engine.connect() as conn: return conn.execute(select(ReplicaHeartbeat.beat_at).where(ReplicaHeartbeat.id == 1)).scalar()
+
+def write_heartbeat():
+    now = datetime.utcnow()
+    table = ReplicaHeartbeat.__table__
+    try:
+        with db.engines[None].begin() as conn:
+            if not conn.execute(table.update().where(table.c.id == 1).values(beat_at=now)).rowcount: conn.execute(table.insert().values(id=1, beat_at=now))
+    except IntegrityError: pass  # another worker inserted it first
+
+def replica_status(key):
+    """(lag in seconds or None when the replica can't be used, its heartbeat time)."""
+    checked_at, lag, beat = replica_checks.get(key, (None, None, None))
+    if checked_at is not None and time.monotonic() - checked_at < REPLICA_CHECK_SECONDS: return lag, beat
+    with replica_lock:
+        checked_at, lag, beat = replica_checks.get(key, (None, None, None))
+        if checked_at is not None and time.monotonic() - checked_at < REPLICA_CHECK_SECONDS: return lag, beat
+        try:
+            # Lag is measured against the beat the replica could already have, not a fresh one
+            primary_beat = read_heartbeat(db.engines[None])
+            if not primary_beat or (datetime.utcnow() - primary_beat).total_seconds() >= REPLICA_CHECK_SECONDS: write_heartbeat()
+            beat = read_heartbeat(db.engines[key])
+            lag = max(0.0, (primary_beat - beat).total_seconds()) if primary_beat and beat else None
+        except SQLAlchemyError as e:
+            replica_log.warning("Replica %s is unavailable, reading from the primary: %s", key, getattr(e, 'orig', e))
+            lag, beat = None, None
+        replica_checks[key] = (time.monotonic(), lag, beat)
+    return lag, beat
+
+def choose_replica():
+    fresh = []
+    for key in REPLICA_BINDS:
+        lag, beat = replica_status(key)
+        if lag is not None and lag <= REPLICA_MAX_LAG_SECONDS: fresh.append((key, beat))
+    return random.choice(fresh) if fresh else (None, None)
+
+def replica_reads(f):
+    # For GET routes that only read; place below @require_auth so the token check uses the primary
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if REPLICA_BINDS and g.get('tenant_id') not in TENANT_DATABASE_URLS: g.read_replica, g.replica_beat = choose_replica()
+        return f(*args, **kwargs)
+    return decorated
+
+def read_horizon():
+    # Every commit before this instant is visible to the request's reads. A
+    # replica has everything committed before its copy of the heartbeat.
+    now = datetime.utcnow()
+    return min(now, g.replica_beat) if g.get('read_replica') else now
+
+def from_primary(load):
+    # Cached values outlive the request, so they are never filled from a lagging replica
+    def wrapped():
+        replica, g.read_replica = g.get('read_replica'), None
+        try: return load()
+        finally: g.read_replica = replica
+    return wrapped
+
+@contextmanager
+def pinned_bind(engine):
+    # Every statement in the block goes to `engine`. The session is cleared on
+    # both sides since databases can hold rows with the same primary keys.
+    db.session.close()
+    g.pinned_bind = engine
+    try: yield
+    finally:
+        g.pop('pinned_bind', None)
+        db.session.close()
+
+def database_engines():
+    """(name, engine) of every writable database: the primary, then each tenant database."""
+    return [('primary', db.engines[None])] + [(tid, db.engines[f'tenant:{tid}']) for tid in TENANT_DATABASE_URLS]
+
+def tenant_tables():
+    return [t for t in db.metadata.sorted_tables if 'tenant_id' in t.c and t.name not in GLOBAL_TABLES]
+
+@app.cli.command('tenant-copy')
+@click.argument('tenant_id')
+@click.argument('url')
+@click.option('--batch-size', default=5000, show_default=True)
+def tenant_copy_command(tenant_id, url, batch_size):
+    """Copy one tenant's rows into its own database at URL.
+
+    Stop writes for the tenant first. Afterwards add TENANT_ID=URL to
+    TENANT_DATABASE_URLS and restart; the primary's copy is then unused.
+    """
+    target = create_engine(pg_url(url))
+    with pinned_bind(target): upgrade_database()
+    tenant = db.session.get(DairyTenant, tenant_id)
+    if not tenant: raise click.ClickException(f'Unknown tenant {tenant_id}')
+    with target.begin() as dst:
+        if dst.execute(select(func.count()).select_from(Customer.__table__).where(Customer.__table__.c.tenant_id == tenant_id)).scalar():
+            raise click.ClickException(f'{url} already has data for {tenant_id}')
+        table = DairyTenant.__table__
+        if not dst.execute(select(table.c.id).where(table.c.id == tenant_id)).first(): dst.execute(table.insert(), [dict(db.session.execute(select(table).where(table.c.id == tenant_id)).mappings().one())])
+        for table in tenant_tables():
+            copied = 0
+            rows = db.session.execute(select(table).where(table.c.tenant_id == tenant_id).execution_options(yield_per=batch_size)).mappings()
+            for batch in iter(lambda: [dict(r) for r in islice(rows, batch_size)], []):
+                dst.execute(table.insert(), batch)
+                copied += len(batch)
+            if dst.execute(select(func.count()).select_from(table).where(table.c.tenant_id == tenant_id)).scalar() != copied:
+                raise click.ClickException(f'{table.name}: row count mismatch after copy')
+            print(f"{table.name}: {copied}")
+    target.dispose()
+    print(f"Copied {tenant_id}. Add {tenant_id}={url} to TENANT_DATABASE_URLS and restart.")
+
+# --- DAILY LEDGER ---
+
+def ledger_apply(tid, date_str, sales=0.0, collections=0.0, adjustments=0.0):
+    # Record a change to total dues on date_str: bump that day's row and shift
+    # the closing balance of it and every later day (normally none or one row).
+    if not (sales or collections or adjustments): return
+    if not db.session.query(DailyLedger.id).filter_by(tenant_id=tid).first():
+        # First write for this tenant: build it from history, which already
+        # includes the change being recorded.
+        db.session.flush()
+        rebuild_ledger(tid)
+        return
+
+    if not db.session.query(DailyLedger.id).filter_by(tenant_id=tid, date=date_str).first():
+        prev = DailyLedger.query.filter(and_(DailyLedger.tenant_id == tid, DailyLedger.date < date_str)).order_by(DailyLedger.date.desc()).first()
+        if prev: closing = prev.closing_balance
+        else:
+            nxt = DailyLedger.query.filter(and_(DailyLedger.tenant_id == tid, DailyLedger.date > date_str)).order_by(DailyLedger.date).first()
+            closing = nxt.opening_balance if nxt else 0.0
+        try:
+            with db.session.begin_nested(): db.session.add(DailyLedger(tenant_id=tid, date=date_str, closing_balance=closing))
+        except IntegrityError: pass  # a concurrent request created the row first
+
+    net = sales - collections + adjustments
+    DailyLedger.query.filter_by(tenant_id=tid, date=date_str).update({
+        DailyLedger.sales: DailyLedger.sales + sales,
+        DailyLedger.collections: DailyLedger.collections + collections,
+        DailyLedger.adjustments: DailyLedger.adjustments + adjustments,
+    }, synchronize_session=False)
+    DailyLedger.query.filter(and_(DailyLedger.tenant_id == tid, DailyLedger.date >= date_str)).update(
+        {DailyLedger.closing_balance: DailyLedger.closing_balance + net}, synchronize_session=False)
+
+def rebuild_ledger(tid):
+    # Backfill from finalized orders and payments, anchored on live Customer.dues
+    # the same way the dashboard used to: walking back from today, each day's
+    # closing balance is the next day's minus its sales plus its collections.
+    sales = dict(db.session.query(Order.date, func.sum(Order.total)).filter(and_(Order.tenant_id == tid, Order.status == 'finalized')).group_by(Order.date).all())
+    collections = dict(db.session.query(Payment.date, func.sum(Payment.amount)).filter(Payment.tenant_id == tid).group_by(Payment.date).all())
+    for period in ArchivedPeriod.query.filter_by(tenant_id=tid):
+        for date_str, (day_sales, day_collections) in json.loads(period.daily or '{}').items():
+            sales[date_str] = (sales.get(date_str) or 0.0) + day_sales
+            collections[date_str] = (collections.get(date_str) or 0.0) + day_collections
+    closing = db.session.query(func.sum(Customer.dues)).filter_by(tenant_id=tid).scalar() or 0.0
+
+    rows = []
+    for date_str in sorted(set(sales) | set(collections), reverse=True):
+        day_sales, day_collections = sales.get(date_str) or 0.0, collections.get(date_str) or 0.0
+        rows.append({'tenant_id': tid, 'date': date_str, 'sales': day_sales, 'collections': day_collections, 'adjustments': 0.0, 'closing_balance': closing})
+        closing = closing - day_sales + day_collections
+    DailyLedger.query.filter_by(tenant_id=tid).delete(synchronize_session=False)
+    if rows: db.session.execute(DailyLedger.__table__.insert(), rows)
+    return len(rows)
+
+def ledger_day(tid, date_str):
+    # The rollup row for date_str, or a synthetic empty one carrying the closing
+    # balance of the last day with activity. None if the ledger can't answer.
+    row = DailyLedger.query.filter(and_(DailyLedger.tenant_id == tid, DailyLedger.date <= date_str)).order_by(DailyLedger.date.desc()).first()
+    if not row: return None
+    if row.date == date_str: return row
+    return DailyLedger(tenant_id=tid, date=date_str, sales=0.0, collections=0.0, adjustments=0.0, closing_balance=row.closing_balance)
+
+@app.cli.command('ledger-rebuild')
+@click.option('--tenant', 'tenant_id', default=None, help='Only rebuild this tenant (default: all tenants).')
+def ledger_rebuild_command(tenant_id):
+    """Backfill the daily ledger rollups from order and payment history."""
+    tenants = [tenant_id] if tenant_id else [t.id for t in DairyTenant.query.all()]
+    for tid in tenants:
+        g.tenant_id = tid  # routes to the tenant's own database, if it has one
+        print(f"{tid}: {rebuild_ledger(tid)} days")
+        db.session.commit()
+
+# --- SERIALIZERS ---
+# Large list responses are built from column tuples (Query.with_entities style)
+# instead of hydrated ORM objects and to_dict(). Keep these in step with the
+# models' to_dict().
+CUSTOMER_FIELDS = {"id": Customer.id, "name": Customer.name, "phone": Customer.phone, "address": Customer.address, "dues": Customer.dues, "status": Customer.status}
+EMPLOYEE_FIELDS = {"id": Employee.id, "name": Employee.name, "phone": Employee.phone, "role": Employee.role, "designation": Employee.designation, "username": Employee.username}
+PAYMENT_FIELDS = {"id": Payment.id, "customerId": Payment.customer_id, "amount": Payment.amount, "date": Payment.date, "collectedBy": Payment.collected_by, "note": Payment.note}
+EXPENSE_FIELDS = {"id": Expense.id, "title": Expense.title, "amount": Expense.amount, "category": Expense.category, "date": Expense.date, "employeeId": Expense.employee_id}
+ORDER_FIELDS = {"id": Order.id, "customerId": Order.customer_id, "customerName": Order.customer_name, "date": Order.date, "status": Order.status, "total": Order.total}
+PROJECTIONS = {Customer: CUSTOMER_FIELDS, Employee: EMPLOYEE_FIELDS, Payment: PAYMENT_FIELDS, Expense: EXPENSE_FIELDS}
+
+def projected(query, fields):
+    keys = list(fields)
+    return [dict(zip(keys, row)) for row in query.with_entities(*fields.values())]
+
+def row_dicts(model, *criteria, order_by=None, limit=None):
+    query = db.session.query(model).filter(*criteria)
+    if order_by is not None: query = query.order_by(*order_by)
+    if limit is not None: query = query.limit(limit)
+    return projected(query, PROJECTIONS[model])
+
+def order_dicts(tid, start=None, end=None, after=None, limit=None):
+    # Orders dated within [start, end] plus their items: one query for each.
+    # Paged calls (limit) order by (date, id) and fetch items by order id;
+    # range calls fetch items by the same tenant/date range.
+    criteria, item_criteria = [Order.tenant_id == tid], [OrderItem.tenant_id == tid]
+    if start: criteria, item_criteria = criteria + [Order.date >= start], item_criteria + [OrderItem.date >= start]
+    if end: criteria, item_criteria = criteria + [Order.date <= end], item_criteria + [OrderItem.date <= end]
+    query = db.session.query(Order).filter(*criteria)
+    if after:
+        after_date, _, after_id = after.partition('|')
+        query = query.filter(or_(Order.date > after_date, and_(Order.date == after_date, Order.id > after_id)))
+    if limit is not None: query = query.order_by(Order.date, Order.id).limit(limit)
+    keys = list(ORDER_FIELDS)
+    orders, legacy = [], {}
+    for row in query.with_entities(*ORDER_FIELDS.values(), Order.items_json):
+        order = dict(zip(keys, row[:-1]))
+        order["items"] = []
+        orders.append(order)
+        if row[-1]: legacy[order["id"]] = row[-1]
+    if not orders: return orders
+
+    items = db.session.query(OrderItem.order_id, OrderItem.product_id, OrderItem.name, OrderItem.quantity, OrderItem.price)
+    if limit is not None: items = items.filter(and_(OrderItem.tenant_id == tid, OrderItem.order_id.in_([o["id"] for o in orders])))
+    else: items = items.filter(and_(*item_criteria))
+    by_order = {o["id"]: o["items"] for o in orders}
+    for order_id, product_id, name, quantity, price in items.order_by(OrderItem.position):
+        if order_id in by_order: by_order[order_id].append({"id": product_id, "name": name, "quantity": plain_number(quantity), "price": plain_number(price)})
+    # Rows not yet moved out of items_json
+    for order in orders:
+        if not order["items"] and order["id"] in legacy:
+            try: items_list = json.loads(legacy[order["id"]])
+            except: items_list = []
+            order["items"] = [{"id": r['product_id'], "name": r['name'], "quantity": plain_number(r['quantity']), "price": plain_number(r['price'])}
+                              for r in order_item_rows(tid, order["id"], order["date"], items_list)]
+    return orders
+
+# --- COLD ARCHIVE ---
+# `flask archive` moves closed months of orders (with items) and payments out
+# of the hot tables into one gzip NDJSON file per tenant-month, in the same
+# line format as /api/reports/export, and records them in archived_period.
+# Report reads merge archived rows back in, so old ranges still answer.
+# Native PostgreSQL range partitioning would need `date` in the primary key
+# of order/payment, which the upserts on `id` rule out, so this is the
+# supported way to keep the hot tables small on every backend.
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR') or os.path.join(app.root_path, 'archive')
+ARCHIVE_MIN_AGE_DAYS = int(os.environ.get('ARCHIVE_MIN_AGE_DAYS', 400))  # keep above the 365-day sync window
+ARCHIVE_ENTITIES = ('orders', 'payments')
+ARCHIVE_PAGE_SIZE = 5000
+
+def row_key(row): return (row['date'], row['id'])
+
+def archived_months(tid, start, end):
+    # Archived tenant-months overlapping [start, end]; cached, so hot-only ranges cost no query
+    months = cached(tid, 'archive', 'months', lambda: [p.month for p in ArchivedPeriod.query.filter_by(tenant_id=tid).order_by(ArchivedPeriod.month)])
+    return [m for m in months if start[:7] <= m <= end[:7]]
+
+def archive_rows(tid, entity, start, end):
+    # Archived rows of one entity dated within [start, end], in (date, id) order
+    for month in archived_months(tid, start, end):
+        with gzip.open(os.path.join(ARCHIVE_DIR, tid, f'{month}.ndjson.gz'), 'rt', encoding='utf-8') as f:
+            for line in f:
+                row = json.loads(line)
+                if row.pop('entity') == entity and start <= row['date'] <= end: yield row
+
+def with_archive(tid, entity, start, end, rows):
+    # Archived months always predate the hot rows around them
+    return list(archive_rows(tid, entity, start, end)) + rows if archived_months(tid, start, end) else rows
+
+def archive_cutoff():
+    # First month that is still open; everything before it may be archived
+    return (datetime.now() - timedelta(days=ARCHIVE_MIN_AGE_DAYS)).strftime('%Y-%m')
+
+def archivable_months(tid, before):
+    done = {m for (m,) in db.session.query(ArchivedPeriod.month).filter_by(tenant_id=tid)}
+    months = set()
+    for model in (Order, Payment):
+        month = func.substr(model.date, 1, 7)
+        months.update(m for (m,) in db.session.query(month).filter(and_(model.tenant_id == tid, model.date < f'{before}-01')).distinct())
+    return sorted(months - done)
+
+def iter_month_rows(tid, entity, month):
+    # Pages of a month's rows in (date, id) order
+    start, end, after = f'{month}-01', f'{month}-31', None
+    while True:
+        if entity == 'orders': rows = order_dicts(tid, start, end, after, ARCHIVE_PAGE_SIZE)
+        else: rows, _ = report_page(Payment, tid, start, end, ARCHIVE_PAGE_SIZE, after)
+        if not rows: return
+        yield rows
+        after = '|'.join(row_key(rows[-1]))
+
+def archive_month(tid, month):
+    """Write one closed month to ARCHIVE_DIR, verify the file, then delete the rows."""
+    if month >= archive_cutoff(): raise ValueError(f"{month} is newer than ARCHIVE_MIN_AGE_DAYS")
+    if ArchivedPeriod.query.filter_by(tenant_id=tid, month=month).first(): raise ValueError(f"{month} is already archived")
+    start, end = f'{month}-01', f'{month}-31'
+    if db.session.query(Order.id).filter(and_(Order.tenant_id == tid, Order.date >= start, Order.date <= end, or_(Order.status.is_(None), Order.status != 'finalized'))).first():
+        raise ValueError(f"{month} has orders that are not finalized")
+
+    rel = os.path.join(tid, f'{month}.ndjson.gz')
+    path = os.path.join(ARCHIVE_DIR, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    ids, daily = {entity: [] for entity in ARCHIVE_ENTITIES}, {}
+    with gzip.open(path + '.part', 'wt', encoding='utf-8') as f:
+        for entity in ARCHIVE_ENTITIES:
+            for rows in iter_month_rows(tid, entity, month):
+                f.write(''.join(app.json.dumps({"entity": entity, **row}) + '\n' for row in rows))
+                for row in rows:
+                    ids[entity].append(row['id'])
+                    day = daily.setdefault(row['date'], [0.0, 0.0])
+                    if entity == 'orders': day[0] += row['total'] or 0.0
+                    else: day[1] += row['amount'] or 0.0
+
+    # Read it back before anything is deleted
+    written = {entity: 0 for entity in ARCHIVE_ENTITIES}
+    digest = hashlib.sha256()
+    with gzip.open(path + '.part', 'rt', encoding='utf-8') as f:
+        for line in f: written[json.loads(line)['entity']] += 1
+    with open(path + '.part', 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''): digest.update(block)
+    if any(written[e] != len(ids[e]) for e in ARCHIVE_ENTITIES): raise RuntimeError(f"Archive check failed for {tid} {month}")
+    os.replace(path + '.part', path)
+
+    try:
+        for n in range(0, len(ids['orders']), 500):
+            chunk = ids['orders'][n:n + 500]
+            OrderItem.query.filter(and_(OrderItem.tenant_id == tid, OrderItem.order_id.in_(chunk))).delete(synchronize_session=False)
+            Order.query.filter(and_(Order.tenant_id == tid, Order.id.in_(chunk))).delete(synchronize_session=False)
+        for n in range(0, len(ids['payments']), 500):
+            Payment.query.filter(and_(Payment.tenant_id == tid, Payment.id.in_(ids['payments'][n:n + 500]))).delete(synchronize_session=False)
+        period = ArchivedPeriod(tenant_id=tid, month=month, path=rel, sha256=digest.hexdigest(), orders=len(ids['orders']), payments=len(ids['payments']),
+                                sales=round(sum(d[0] for d in daily.values()), 2), collections=round(sum(d[1] for d in daily.values()), 2), daily=json.dumps(daily))
+        db.session.add(period)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        os.remove(path)
+        raise
+    return period
+
+def week_start(date_str):
+    day = datetime.strptime(date_str, '%Y-%m-%d')
+    return (day - timedelta(days=day.weekday())).strftime('%Y-%m-%d')
+
+def archive_summary(tid, start, end, group, include_products=False):
+    # report_summary's order and payment groupings over archived rows, shaped like its SQL rows
+    period = {'day': lambda d: d, 'month': lambda d: d[:7], 'week': week_start}[group]
+    revenue, sales, agents, products = {}, {}, {}, {}
+    for o in archive_rows(tid, 'orders', start, end):
+        key, total = period(o['date']), o['total'] or 0.0
+        n, amount, finalized = revenue.get(key, (0, 0.0, 0.0))
+        revenue[key] = (n + 1, amount + total, finalized + (total if o['status'] == 'finalized' else 0.0))
+        name, amount = sales.get(o['customerId'], (None, 0.0))
+        sales[o['customerId']] = (o['customerName'] or name, amount + total)
+        if include_products:
+            for item in o['items']:
+                name, qty = products.get((key, item['id']), (None, 0))
+                products[(key, item['id'])] = (item['name'] or name, qty + (item['quantity'] or 0))
+    for pay in archive_rows(tid, 'payments', start, end):
+        n, amount = agents.get(pay['collectedBy'], (0, 0.0))
+        agents[pay['collectedBy']] = (n + 1, amount + (pay['amount'] or 0.0))
+    return {"revenue": [(k,) + v for k, v in revenue.items()], "byAgent": [(k,) + v for k, v in agents.items()],
+            "topSales": [(k,) + v for k, v in sales.items()], "products": [k + v for k, v in products.items()]}
+
+def merge_grouped(rows, extra, keys=1):
+    # Two grouped result sets as one: numeric columns summed per key, others kept
+    def add(a, b): return (a or 0) + (b or 0) if isinstance(a, (int, float)) or isinstance(b, (int, float)) else a or b
+    merged = {}
+    for row in list(rows) + list(extra):
+        key = tuple(row[:keys])
+        merged[key] = key + tuple(add(a, b) for a, b in zip(merged[key][keys:], row[keys:])) if key in merged else tuple(row)
+    return list(merged.values())
+
+@app.cli.command('archive')
+@click.option('--tenant', 'tenant_id', default=None, help='Only archive this tenant (default: all tenants).')
+@click.option('--before', default=None, help='Archive months before YYYY-MM (never later than ARCHIVE_MIN_AGE_DAYS allows).')
+@click.option('--dry-run', is_flag=True, help='List the months that would be archived.')
+def archive_command(tenant_id, before, dry_run):
+    """Move closed months of orders and payments to gzip NDJSON cold storage."""
+    cutoff = min(before or archive_cutoff(), archive_cutoff())
+    tenants = [tenant_id] if tenant_id else [t.id for t in DairyTenant.query.all()]
+    for tid in tenants:
+        g.tenant_id = tid
+        for month in archivable_months(tid, cutoff):
+            if dry_run:
+                print(f"{tid} {month}: would archive")
+                continue
+            try: period = archive_month(tid, month)
+            except ValueError as e:
+                print(f"{tid} {month}: skipped ({e})")
+                continue
+            print(f"{tid} {month}: {period.orders} orders, {period.payments} payments -> {os.path.join(ARCHIVE_DIR, period.path)}")
+
+# --- HTTP CACHING & COMPRESSION ---
+# The SPA pages and the big read endpoints carry ETags. A browser revalidates
+# with If-None-Match and gets an empty 304 when nothing changed. Bodies of
+# COMPRESS_MIN_SIZE bytes or more are sent gzip (or brotli) encoded; encoded
+# ETags become weak, as nginx does, since the bytes differ per encoding.
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))  # gzip 1-9
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))  # 0-11; above ~6 costs more CPU than it saves on the wire
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/x-ndjson', 'application/javascript')
+compressed_bodies = TTLCache(maxsize=64, ttl=3600)  # (body hash, encoding) -> bytes, so unchanged pages are compressed once
+static_pages = {}  # filename -> (mtime, body, etag)
+
+def static_page(filename):
+    path = os.path.join(app.root_path, filename)
+    mtime = os.path.getmtime(path)
+    if static_pages.get(filename, (None,))[0] != mtime:
+        with open(path, 'rb') as f: body = f.read()
+        static_pages[filename] = (mtime, body, hashlib.sha256(body).hexdigest()[:32])
+    _, body, etag = static_pages[filename]
+    resp = app.response_class(body, mimetype='text/html')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'  # always revalidate, usually a 304
+    return resp.make_conditional(request)
+
+def conditional_json(payload, volatile=()):
+    # JSON with a content-hash ETag over everything but the `volatile` keys
+    # (the sync cursor changes on every call). A matching If-None-Match gets an
+    # empty 304 before the volatile part is even encoded.
+    stable = {k: v for k, v in payload.items() if k not in volatile} if volatile else payload
+    body = app.json.dumps(stable)
+    etag = hashlib.sha256(body.encode()).hexdigest()[:32]
+    if request.if_none_match.contains_weak(etag): resp = app.response_class(status=304)
+    else:
+        if volatile: body = app.json.dumps({k: payload[k] for k in volatile})[:-1] + (', ' + body[1:] if stable else '}')
+        resp = app.response_class(body, mimetype='application/json')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    resp.vary.add('Authorization')
+    return resp
+
+@app.after_request
+def compress_response(resp):
+    if resp.status_code != 200 or resp.direct_passthrough or resp.is_streamed or 'Content-Encoding' in resp.headers: return resp
+    if not (resp.mimetype or '').startswith(COMPRESSIBLE_TYPES): return resp
+    resp.vary.add('Accept-Encoding')
+    accept = request.accept_encodings
+    encoding = 'br' if brotli and accept['br'] else 'gzip' if accept['gzip'] else None
+    if not encoding or resp.content_length is None or resp.content_length < COMPRESS_MIN_SIZE: return resp
+    etag, weak = resp.get_etag()
+    # Keyed on the bytes sent, not the ETag: a sync's ETag leaves out its cursor
+    data = resp.get_data()
+    key = (hashlib.sha256(data).digest(), encoding) if etag else None
+    body = compressed_bodies.get(key) if key else None
+    if body is None:
+        body = brotli.compress(data, quality=BROTLI_QUALITY) if encoding == 'br' else gzip.compress(data, COMPRESS_LEVEL, mtime=0)
+        if key: compressed_bodies.set(key, body)
+    resp.set_data(body)
+    resp.headers['Content-Encoding'] = encoding
+    if etag: resp.set_etag(etag, weak=True)
+    return resp
+
+# --- WRITE SERVICES ---
+# The customer, rate, payment and expense writes, shared by their REST routes
+# and /api/batch. Each returns (body, status) and leaves the commit to the
+# caller; nothing is written when the status is an error.
+
+def commit_mutation(body, status):
+    if status < 400: db.session.commit()
+    else: db.session.rollback()
+    return jsonify(body), status
+
+def create_customer(tid, data, client_id=None):
+    if Customer.query.filter_by(tenant_id=tid, phone=data['phone']).first(): return {"error": "Phone exists"}, 400
+    # A batched offline create may carry the id the client minted, so later queued
+    # operations can refer to it; anything malformed or already taken gets a new one
+    if client_id and not (is_ulid(client_id, 'C') and db.session.get(Customer, client_id) is None): client_id = None
+    c = Customer(id=client_id or new_id('C'), tenant_id=tid, name=data['name'], phone=data['phone'], address=data.get('address'), dues=float(data.get('dues', 0)))
+    db.session.add(c)
+    db.session.flush()  # applies the status default for to_dict()
+    ledger_apply(tid, datetime.now().strftime('%Y-%m-%d'), adjustments=c.dues)
+    return c.to_dict({}), 200
+
+def update_customer(tid, cid, data):
+    c = Customer.query.filter_by(id=cid, tenant_id=tid).first()
+    if not c: return {"error": "Not found"}, 404
+    old_dues = c.dues or 0.0
+    c.name, c.phone, c.address = data['name'], data['phone'], data.get('address')
+    if 'dues' in data: c.dues = float(data['dues'])
+    ledger_apply(tid, datetime.now().strftime('%Y-%m-%d'), adjustments=(c.dues or 0.0) - old_dues)
+    return c.to_dict(), 200
+
+def delete_customer(tid, cid):
+    c = Customer.query.filter_by(id=cid, tenant_id=tid).first()
+    if not c: return {"error": "Not found"}, 404
+    dues = c.dues or 0.0
+    db.session.delete(c)
+    db.session.flush()  # a first ledger write rebuilds from history, which must not include c
+    ledger_apply(tid, datetime.now().strftime('%Y-%m-%d'), adjustments=-dues)
+    return {"message": "Deleted"}, 200
+
+def set_customer_rates(tid, cid, data):
+    if not db.session.query(Customer.id).filter_by(id=cid, tenant_id=tid).first(): return {"error": "Customer not found"}, 404
+    CustomerRate.query.filter_by(customer_id=cid, tenant_id=tid).delete()
+    invalidate_tenant_cache(tid, 'prices')
+    for pid, rate in data.get('rates', {}).items():
+        db.session.add(CustomerRate(tenant_id=tid, customer_id=cid, product_id=pid, rate=rate))
+    # customRates ship inside the customer record, so bump it for delta syncs
+    Customer.query.filter_by(id=cid, tenant_id=tid).update({Customer.updated_at: datetime.utcnow()}, synchronize_session=False)
+
+    if data.get('scope') == 'today':
+        today = datetime.now().strftime('%Y-%m-%d')
+        draft_order = Order.query.filter_by(customer_id=cid, date=today, status='draft', tenant_id=tid).first()
+        if draft_order:
+            if not draft_order.items: draft_order.items = legacy_order_items(draft_order)
+            prices = price_matrix(tid)['products']  # list prices; the new rates override below
+            new_total = 0
+            for item in draft_order.items:
+                if item.product_id in prices:
+                    new_rate = data.get('rates', {}).get(item.product_id, prices[item.product_id])
+                    item.price = new_rate
+                    new_total += item.quantity * new_rate
+            draft_order.items_json = None
+            draft_order.total = new_total
+    return {"message": "Rates updated"}, 200
+
+def record_payment(tid, data):
+    if not db.session.query(Customer.id).filter_by(id=data['customerId'], tenant_id=tid).first(): return {"error": "Customer not found"}, 404
+    db.session.add(Payment(tenant_id=tid, customer_id=data['customerId'], amount=data['amount'], date=data['date'], collected_by=data.get('collectedBy'), note=data.get('note')))
+    apply_dues_deltas(tid, {data['customerId']: -float(data['amount'])})
+    ledger_apply(tid, data['date'], collections=float(data['amount']))
+    return {"message": "Payment recorded"}, 200
+
+def create_expense(tid, data):
+    exp = Expense(tenant_id=tid, title=data['title'], amount=data['amount'], category=data['category'], date=data['date'], employee_id=data.get('employeeId'))
+    db.session.add(exp)
+    db.session.flush()  # assigns the id for to_dict()
+    return exp.to_dict(), 200
+
+# --- BATCHED MUTATIONS ---
+# /api/batch applies an ordered list of the writes above in one request, so a
+# field client coming back online replays its queue with one round trip and a
+# commit per BATCH_CHUNK_SIZE operations instead of one each. Every operation
+# carries a client-generated idempotency key; its result is stored with the
+# chunk, so a retried batch (say, after a dropped response) returns the first
+# outcome instead of recording a payment twice. Each operation runs in a
+# savepoint: a failed one leaves the rest of its chunk in place. Failures are
+# not stored, so the client can fix and resend them under the same key.
+BATCH_MAX_OPS = int(os.environ.get('BATCH_MAX_OPS', 500))
+BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', 50))
+BATCH_KEY_TTL_DAYS = int(os.environ.get('BATCH_KEY_TTL_DAYS', 30))  # replays older than this run again
+
+BATCH_OPS = {
+    'customer.create': lambda tid, op: create_customer(tid, op['data'], op['data'].get('id')),
+    'customer.update': lambda tid, op: update_customer(tid, op['id'], op['data']),
+    'customer.delete': lambda tid, op: delete_customer(tid, op['id']),
+    'customer.rates': lambda tid, op: set_customer_rates(tid, op['id'], op['data']),
+    'payment.create': lambda tid, op: record_payment(tid, op['data']),
+    'expense.create': lambda tid, op: create_expense(tid, op['data']),
+}
+BATCH_OPS_WITH_ID = {'customer.update', 'customer.delete', 'customer.rates'}
+
+def stored_mutation(row):
+    return {"key": row.key, "status": row.status, "data": json.loads(row.result) if row.result else None}
+
+def apply_mutation(tid, op, done):
+    key = op.get('key') if isinstance(op, dict) else None
+    if not isinstance(key, str) or not key or len(key) > 100: return {"key": key, "status": 400, "error": "key is required (at most 100 characters)"}
+    if key in done: return {**done[key], "replayed": True}
+    handler = BATCH_OPS.get(op['op']) if isinstance(op.get('op'), str) else None
+    if not handler: return {"key": key, "status": 400, "error": f"Unknown op {op.get('op')!r}"}
+    if not isinstance(op.get('data', {}), dict): return {"key": key, "status": 400, "error": "data must be an object"}
+    if op['op'] in BATCH_OPS_WITH_ID and not isinstance(op.get('id'), str): return {"key": key, "status": 400, "error": "id is required"}
+    # A savepoint rollback fires after_rollback, which would forget the
+    # cache evictions queued by earlier operations in the chunk
+    pending = {k: set(db.session.info.get(k, ())) for k in ('cache_invalidations', 'revoked_users')}
+    savepoint = db.session.begin_nested()
+    try:
+        body, status = handler(tid, op)
+        if status >= 400:
+            savepoint.rollback()
+            db.session.info.update({k: v for k, v in pending.items() if v})
+            return {"key": key, "status": status, **body}
+        db.session.add(MutationKey(tenant_id=tid, key=key, op=op['op'], status=status, result=json.dumps(body)))
+        savepoint.commit()  # flushes: a concurrent replay of the same key fails here
+    except (IntegrityError, KeyError, TypeError, ValueError) as e:
+        savepoint.rollback()
+        db.session.info.update({k: v for k, v in pending.items() if v})
+        if not isinstance(e, IntegrityError): return {"key": key, "status": 400, "error": f"{e.args[0]} is required" if isinstance(e, KeyError) else str(e)}
+        row = db.session.get(MutationKey, (tid, key))
+        if not row: return {"key": key, "status": 409, "error": "Conflicts with existing data"}
+        done[key] = stored_mutation(row)
+        return {**done[key], "replayed": True}
+    done[key] = {"key": key, "status": status, "data": body}
+    return done[key]
+
+def apply_batch(tid, ops):
+    """Results in request order; one commit per BATCH_CHUNK_SIZE operations."""
+    results, done = [], {}
+    MutationKey.query.filter(and_(MutationKey.tenant_id == tid, MutationKey.created_at < datetime.utcnow() - timedelta(days=BATCH_KEY_TTL_DAYS))).delete(synchronize_session=False)
+    for start in range(0, len(ops), BATCH_CHUNK_SIZE):
+        chunk = ops[start:start + BATCH_CHUNK_SIZE]
+        keys = {op['key'] for op in chunk if isinstance(op, dict) and isinstance(op.get('key'), str)} - done.keys()
+        if keys: done.update((row.key, stored_mutation(row)) for row in MutationKey.query.filter(and_(MutationKey.tenant_id == tid, MutationKey.key.in_(keys))))
+        results.extend(apply_mutation(tid, op, done) for op in chunk)
+        db.session.commit()
+    return results
+
+@app.route('/api/batch', methods=['POST'])
+@require_auth
+def batch_mutations():
+    ops = (request.json or {}).get('ops')
+    if not isinstance(ops, list): return jsonify({"error": "ops must be a list"}), 400
+    if len(ops) > BATCH_MAX_OPS: return jsonify({"error": f"At most {BATCH_MAX_OPS} ops per batch"}), 413
+    results = apply_batch(g.tenant_id, ops)
+    return jsonify({"results": results, "applied": sum(1 for r in results if r['status'] < 400 and not r.get('replayed')),
+                    "replayed": sum(1 for r in results if r.get('replayed')), "failed": sum(1 for r in results if r['status'] >= 400)})
+
 # --- ROUTES ---
 
 @app.route('/')
 @app.route('/index.html')
-def home(): return send_file('index.html')
+def home(): return static_page('index.html')
 
 @app.route('/reports.html')
-def reports_page(): return send_file('reports.html')
+def reports_page(): return static_page('reports.html')
 
 # Note: /api/register REMOVED. Tenant creation is handled via SQL in Supabase.
 
@@ -230,6 +1299,7 @@ def login():
     # Assuming standard flow where you insert correct hashes or this app handles password setting later.
     
     if user and check_password_hash(user.password, data.get('password')):
+        g.tenant_id = user.tenant_id
         
         # --- AUTO-INSERT PRODUCTS ON FIRST LOGIN ---
         # Since registration is manual via SQL, we use this Login trigger to ensure 
@@ -256,7 +1326,7 @@ def login():
             print(f"Error checking/inserting products: {e}")
         # -------------------------------------------
 
-        token = serializer.dumps({'user_id': user.id, 'tenant_id': user.tenant_id})
+        token = issue_token(user)
         tenant = DairyTenant.query.get(user.tenant_id)
         return jsonify({
             "token": token,
@@ -294,7 +1364,6 @@ def add_staff():
         linked_username = None
 
     emp = Employee(
-        id=f"{tid}E{int(datetime.now().timestamp())}",
         tenant_id=tid,
         name=data['name'],
         phone=data['phone'],
@@ -333,6 +1402,7 @@ def update_staff(id):
             
             old_user = DairyUser.query.filter_by(username=emp.username).first()
             if old_user:
+                if password or old_user.role != emp.role: revoke_user_tokens(old_user)
                 old_user.username = username
                 old_user.role = emp.role
                 if password:
@@ -358,6 +1428,7 @@ def update_staff(id):
         else:
             existing_user = DairyUser.query.filter_by(username=username).first()
             if existing_user:
+                if password or existing_user.role != emp.role: revoke_user_tokens(existing_user)
                 existing_user.role = emp.role
                 if password: 
                     existing_user.password = generate_password_hash(password)
@@ -372,7 +1443,10 @@ def delete_employee(id):
     emp = Employee.query.filter_by(id=id, tenant_id=g.tenant_id).first()
     if emp:
         if emp.username:
-            DairyUser.query.filter_by(username=emp.username).delete()
+            user = DairyUser.query.filter_by(username=emp.username).first()
+            if user:
+                revoke_user_tokens(user)
+                db.session.delete(user)
         
         db.session.delete(emp)
         db.session.commit()
@@ -381,100 +1455,96 @@ def delete_employee(id):
 @app.route('/api/agent/dues', methods=['GET'])
 @require_auth
 @require_role(['admin', 'collection_agent'])
+@replica_reads
 def agent_dues():
-    tid = g.tenant_id
-    # Optimize: Only fetch customers with non-zero dues
-    # We filter by tenant_id. We can also filter by dues != 0 directly in SQL for speed if needed, 
-    # but iterating is fine for small-medium datasets.
-    customers = Customer.query.filter_by(tenant_id=tid).all()
-    output = []
-
-    for c in customers:
-        # We only care about the actual due balance now
-        actual_due = c.dues
-        
-        # Only show if there is money to collect (positive) or refund (negative)
-        if actual_due != 0:
-            output.append({
-                "customerId": c.id,
-                "name": c.name,
-                "phone": c.phone, # Added phone in case you want to add a 'Call' button later
-                "address": c.address,
-                "due": actual_due
-            })
-    
-    # Sort by highest due amount first
-    output.sort(key=lambda x: x['due'], reverse=True)
+    # Everyone with a non-zero balance, highest due first (see agent_worklist for pages)
+    return jsonify(projected(worklist_query(g.tenant_id), WORKLIST_FIELDS))
+
+WORKLIST_FIELDS = {"customerId": Customer.id, "name": Customer.name, "phone": Customer.phone, "address": Customer.address, "due": Customer.dues}
 
-    return jsonify(output)
+def worklist_query(tid):
+    # Matches ix_customer_tenant_dues_open, read backwards: zero-balance customers are never touched
+    return db.session.query(Customer).filter(and_(Customer.tenant_id == tid, Customer.dues != 0)).order_by(Customer.dues.desc(), Customer.id.desc())
+
+@app.route('/api/agent/worklist', methods=['GET'])
+@require_auth
+@require_role(['admin', 'collection_agent'])
+@replica_reads
+def agent_worklist():
+    # ?limit=50&after=<next>&q=<name/phone/address>&date=<day>&collected=include|hide
+    # include: adds each customer's collectedToday for `date` (default today);
+    # hide: leaves out customers who already paid that day.
+    tid, q, collected = g.tenant_id, request.args.get('q', '').strip(), request.args.get('collected')
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    query, fields = worklist_query(tid), dict(WORKLIST_FIELDS)
+    if request.args.get('after'):
+        after_due, _, after_id = request.args['after'].partition('|')
+        try: query = query.filter(tuple_(Customer.dues, Customer.id) < tuple_(float(after_due), after_id))
+        except ValueError: return jsonify({"error": "Invalid cursor"}), 400
+    if q:
+        pattern = '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        query = query.filter(or_(*(col.ilike(pattern, escape='\\') for col in (Customer.name, Customer.phone, Customer.address))))
+    if collected in ('include', 'hide'):
+        day = request.args.get('date') or datetime.now().strftime('%Y-%m-%d')
+        paid = db.session.query(Payment.customer_id, func.sum(Payment.amount).label('amount')).filter(and_(Payment.tenant_id == tid, Payment.date == day)).group_by(Payment.customer_id).subquery()
+        query = query.outerjoin(paid, paid.c.customer_id == Customer.id)
+        if collected == 'hide': query = query.filter(paid.c.customer_id.is_(None))
+        else: fields["collectedToday"] = func.coalesce(paid.c.amount, 0.0)
+    rows = projected(query.limit(limit + 1), fields)
+    next_cursor = f"{rows[limit - 1]['due']!r}|{rows[limit - 1]['customerId']}" if len(rows) > limit else None
+    return jsonify({"customers": rows[:limit], "next": next_cursor})
 
 @app.route('/api/sync', methods=['GET'])
 @require_auth
+@replica_reads
 def sync_data():
     try:
         tid = g.tenant_id
-        customers = [c.to_dict() for c in Customer.query.filter_by(tenant_id=tid).all()]
-        products = [p.to_dict() for p in Product.query.filter_by(tenant_id=tid).all()]
-        employees = [e.to_dict() for e in Employee.query.filter_by(tenant_id=tid).all()]
-        recent_payments = [p.to_dict() for p in Payment.query.filter_by(tenant_id=tid).order_by(Payment.date.desc()).limit(1000).all()]
-        expenses = [e.to_dict() for e in Expense.query.filter_by(tenant_id=tid).order_by(Expense.date.desc()).limit(1000).all()]
+        cursor = read_horizon()
+        since = request.args.get('since')
+        if since:
+            try: since_dt = datetime.fromisoformat(since) - SYNC_CURSOR_OVERLAP
+            except ValueError: return jsonify({"error": "Invalid sync cursor"}), 400
+            return conditional_json(delta_sync(tid, since_dt, cursor), volatile=('cursor',))
+
+        rates = price_matrix(tid)['rates']
+        customers = row_dicts(Customer, Customer.tenant_id == tid)
+        for c in customers: c["customRates"] = rates.get(c["id"], {})
+        products = product_catalog(tid)
+        employees = row_dicts(Employee, Employee.tenant_id == tid)
+        recent_payments = row_dicts(Payment, Payment.tenant_id == tid, order_by=[Payment.date.desc()], limit=1000)
+        expenses = row_dicts(Expense, Expense.tenant_id == tid, order_by=[Expense.date.desc()], limit=1000)
         year_ago = (datetime.now() - timedelta(days=365)).strftime('%Y-%m-%d')
-        recent_orders = [o.to_dict() for o in Order.query.filter(and_(Order.tenant_id == tid, Order.date >= year_ago)).all()]
-        return jsonify({"customers": customers, "products": products, "employees": employees, "payments": recent_payments, "expenses": expenses, "orders": recent_orders})
+        recent_orders = order_dicts(tid, start=year_ago)
+        return conditional_json({"customers": customers, "products": products, "employees": employees, "payments": recent_payments, "expenses": expenses, "orders": recent_orders, "cursor": cursor.isoformat(), "full": True},
+                                volatile=('cursor',))
     except OperationalError: return jsonify({"error": "Database error."}), 500
 
+def delta_sync(tid, since_dt, cursor):
+    # Only rows touched after since_dt, plus ids deleted since then
+    payload = {"cursor": cursor.isoformat(), "full": False, "deleted": {key: [] for key in SYNC_MODELS}}
+    rates = price_matrix(tid)['rates']
+    for key, model in SYNC_MODELS.items():
+        changed = model.query.filter(and_(model.tenant_id == tid, model.updated_at > since_dt)).all()
+        payload[key] = [row.to_dict(rates.get(row.id, {})) if model is Customer else row.to_dict() for row in changed]
+    tombstones = SyncTombstone.query.filter(and_(SyncTombstone.tenant_id == tid, SyncTombstone.deleted_at > since_dt)).all()
+    for t in tombstones:
+        if t.entity in payload['deleted']: payload['deleted'][t.entity].append(t.record_id)
+    return payload
+
 @app.route('/api/customers', methods=['POST'])
 @require_auth
-def add_customer():
-    data = request.json
-    tid = g.tenant_id
-    if Customer.query.filter_by(tenant_id=tid, phone=data['phone']).first(): return jsonify({"error": "Phone exists"}), 400
-    count = Customer.query.filter_by(tenant_id=tid).count()
-    new_id = f"{tid}C{count + 1:03d}"
-    c = Customer(id=new_id, tenant_id=tid, name=data['name'], phone=data['phone'], address=data.get('address'), dues=float(data.get('dues', 0)))
-    db.session.add(c)
-    db.session.commit()
-    return jsonify(c.to_dict())
+def add_customer(): return commit_mutation(*create_customer(g.tenant_id, request.json))
 
 @app.route('/api/customers/<id>', methods=['PUT', 'DELETE'])
 @require_auth
 def mod_customer(id):
-    c = Customer.query.filter_by(id=id, tenant_id=g.tenant_id).first()
-    if not c: return jsonify({"error": "Not found"}), 404
-    if request.method == 'DELETE': db.session.delete(c)
-    else:
-        data = request.json
-        c.name, c.phone, c.address = data['name'], data['phone'], data.get('address')
-        if 'dues' in data: c.dues = float(data['dues'])
-    db.session.commit()
-    return jsonify(c.to_dict() if request.method == 'PUT' else {"message": "Deleted"})
+    if request.method == 'DELETE': return commit_mutation(*delete_customer(g.tenant_id, id))
+    return commit_mutation(*update_customer(g.tenant_id, id, request.json))
 
 @app.route('/api/customers/<cid>/rates', methods=['POST'])
 @require_auth
-def update_rates(cid):
-    data = request.json
-    tid = g.tenant_id
-    CustomerRate.query.filter_by(customer_id=cid, tenant_id=tid).delete()
-    for pid, rate in data.get('rates', {}).items():
-        db.session.add(CustomerRate(tenant_id=tid, customer_id=cid, product_id=pid, rate=rate))
-    
-    if data.get('scope') == 'today':
-        today = datetime.now().strftime('%Y-%m-%d')
-        draft_order = Order.query.filter_by(customer_id=cid, date=today, status='draft', tenant_id=tid).first()
-        if draft_order:
-            items = json.loads(draft_order.items_json) if draft_order.items_json else []
-            new_total = 0
-            for item in items:
-                pid = item.get('productId') or item.get('id')
-                prod = Product.query.filter_by(id=pid, tenant_id=tid).first()
-                if prod:
-                    new_rate = data.get('rates', {}).get(prod.id, prod.price)
-                    item['price'] = new_rate
-                    new_total += item['quantity'] * new_rate
-            draft_order.items_json = json.dumps(items)
-            draft_order.total = new_total
-    db.session.commit()
-    return jsonify({"message": "Rates updated"})
+def update_rates(cid): return commit_mutation(*set_customer_rates(g.tenant_id, cid, request.json))
 
 @app.route('/api/sheets/finalize', methods=['POST'])
 @require_auth
@@ -482,114 +1552,436 @@ def finalize_sheet():
     data = request.json
     tid, date_str = g.tenant_id, data.get('date')
     if not date_str: return jsonify({"error": "Date required"}), 400
-    orders = Order.query.filter_by(date=date_str, tenant_id=tid).all()
-    count = 0
-    for o in orders:
-        if o.status != 'finalized':
-            cust = Customer.query.filter_by(id=o.customer_id, tenant_id=tid).first()
-            if cust: cust.dues += o.total
-            o.status = 'finalized'
-            count += 1
+    if data.get('async') or request.args.get('async') in ('1', 'true'):
+        return jsonify(submit_job(tid, 'finalize', {"date": date_str}).to_dict()), 202
+    count, added = finalize_orders(tid, date_str)
     db.session.commit()
     return jsonify({"success": True, "message": f"Finalized {count} orders"})
 
+def finalize_orders(tid, date_str):
+    # Flip the day's open orders and read back exactly the rows this transaction
+    # flipped, so concurrent finalize/save calls can't both add the same total.
+    pending = and_(Order.tenant_id == tid, Order.date == date_str, or_(Order.status.is_(None), Order.status != 'finalized'))
+    stmt = Order.__table__.update().where(pending).values(status='finalized', updated_at=datetime.utcnow())
+    if db.session.get_bind().dialect.update_returning:
+        flipped = db.session.execute(stmt.returning(Order.customer_id, Order.total)).all()
+    else:
+        flipped = db.session.query(Order.customer_id, Order.total).filter(pending).with_for_update().all()
+        db.session.execute(stmt)
+    deltas = {}
+    for cid, total in flipped: deltas[cid] = deltas.get(cid, 0.0) + (total or 0.0)
+    if deltas:
+        known = {cid for (cid,) in db.session.query(Customer.id).filter(and_(Customer.tenant_id == tid, Customer.id.in_(deltas)))}
+        deltas = {cid: d for cid, d in deltas.items() if cid in known}
+    apply_dues_deltas(tid, deltas)
+    added = sum(deltas.values())
+    ledger_apply(tid, date_str, sales=added)
+    return len(flipped), added
+
 @app.route('/api/orders', methods=['GET'])
 @require_auth
+@replica_reads
 def get_orders():
-    orders = Order.query.filter_by(date=request.args.get('date'), tenant_id=g.tenant_id).all()
-    return jsonify([o.to_dict() for o in orders])
+    date_str = request.args.get('date')
+    return conditional_json(with_archive(g.tenant_id, 'orders', date_str, date_str, order_dicts(g.tenant_id, date_str, date_str)) if date_str else [])
+
+# warn: save as sent and list mismatches in the response; reject: refuse the sheet
+ORDER_PRICE_CHECK = os.environ.get('ORDER_PRICE_CHECK', 'warn')
 
 @app.route('/api/orders/save', methods=['POST'])
 @require_auth
 def save_orders():
     data, tid = request.json, g.tenant_id
-    date_str, count = data['date'], 0
-    for ord_data in data['orders']:
-        cust = Customer.query.filter_by(id=ord_data['customerId'], tenant_id=tid).first()
-        if not cust: continue
-        existing = Order.query.filter_by(customer_id=ord_data['customerId'], date=date_str, tenant_id=tid).first()
-        if existing and existing.status == 'finalized': cust.dues -= existing.total
-        
-        items_json_str = json.dumps(ord_data['items'])
-        if existing:
-            existing.total = ord_data['total']
-            existing.status = ord_data['status']
-            existing.customer_name = ord_data['customerName']
-            existing.items_json = items_json_str
-        else:
-            db.session.add(Order(id=ord_data['id'], tenant_id=tid, customer_id=cust.id, customer_name=ord_data['customerName'], date=date_str, status=ord_data['status'], total=ord_data['total'], items_json=items_json_str))
-        
-        if ord_data['status'] == 'finalized': cust.dues += ord_data['total']
-        count += 1
+    try:
+        mismatches = price_mismatches(tid, data['orders']) if ORDER_PRICE_CHECK != 'off' else []
+        if mismatches and ORDER_PRICE_CHECK == 'reject':
+            return jsonify({"error": "Prices or totals don't match current rates; sync and try again", "mismatches": mismatches}), 400
+        count = bulk_save_orders(tid, data['date'], data['orders'])
+    except (TypeError, ValueError) as e:
+        # A non-numeric price, quantity or total; nothing has been written
+        db.session.rollback()
+        return jsonify({"error": f"Invalid order: {e}"}), 400
     db.session.commit()
+    if mismatches: return jsonify({"message": f"Processed {count} orders.", "mismatches": mismatches})
     return jsonify({"message": f"Processed {count} orders."})
 
+def price_mismatches(tid, orders):
+    # Lines not priced at the customer's effective price, and totals that
+    # don't add up to their lines. Unknown products are left to the caller.
+    matrix, mismatches = price_matrix(tid), []
+    for o in orders:
+        if not isinstance(o, dict) or not isinstance(o.get('items') or [], list): raise ValueError("each order must be an object with a list of items")
+        cid, lines_total = o.get('customerId'), 0.0
+        for item in o.get('items') or []:
+            if not isinstance(item, dict): raise ValueError("each order item must be an object")
+            pid, price = item.get('productId') or item.get('id'), float(item.get('price') or 0)
+            lines_total += float(item.get('quantity') or 0) * price
+            expected = effective_price(matrix, cid, pid)
+            if expected is not None and abs(price - expected) > 0.005: mismatches.append({"customerId": cid, "productId": pid, "price": price, "expected": expected})
+        if abs(float(o.get('total') or 0) - lines_total) > 0.01: mismatches.append({"customerId": cid, "total": o.get('total'), "expected": round(lines_total, 2)})
+    return mismatches
+
+def bulk_save_orders(tid, date_str, orders, apply_dues=True):
+    # Set-based sheet save: one SELECT for customers, one for the day's existing
+    # orders, one multi-row upsert (plus the line-item rewrite) and one
+    # aggregated dues UPDATE.
+    cust_ids = {o['customerId'] for o in orders}
+    known = {cid for (cid,) in db.session.query(Customer.id).filter(and_(Customer.tenant_id == tid, Customer.id.in_(cust_ids)))}
+    # Row locks keep a concurrent finalize from flipping these between our read and write
+    existing = {row.customer_id: row for row in db.session.query(Order.id, Order.customer_id, Order.status, Order.total).filter(and_(Order.tenant_id == tid, Order.date == date_str, Order.customer_id.in_(known))).with_for_update()}
+
+    # Client-supplied ids are kept only when no other row has them: they may
+    # belong to another tenant, customer or day
+    offered = {o['id'] for o in orders if o.get('id') and o['customerId'] in known and o['customerId'] not in existing}
+    taken = {oid for (oid,) in db.session.query(Order.id).filter(Order.id.in_(offered))} if offered else set()
+
+    now, count = datetime.utcnow(), 0
+    rows, items, dues_delta, current = {}, {}, {}, {}
+    for ord_data in orders:
+        cid = ord_data['customerId']
+        if cid not in known: continue
+        # A customer listed twice behaves like two sequential saves: the second one
+        # replaces the first, so chain the dues arithmetic through `current`.
+        if cid not in current and cid in existing: current[cid] = (existing[cid].status, existing[cid].total or 0)
+        delta = 0.0
+        if cid in current and current[cid][0] == 'finalized': delta -= current[cid][1]
+        if ord_data['status'] == 'finalized': delta += ord_data['total']
+        if delta: dues_delta[cid] = dues_delta.get(cid, 0.0) + delta
+        current[cid] = (ord_data['status'], ord_data['total'])
+
+        client_id = ord_data.get('id') if ord_data.get('id') not in taken else None
+        if client_id and any(r['id'] == client_id and r['customer_id'] != cid for r in rows.values()): client_id = None
+        order_id = existing[cid].id if cid in existing else rows.get(cid, {}).get('id') or client_id or new_id('O')
+        rows[cid] = {'id': order_id, 'tenant_id': tid, 'customer_id': cid, 'customer_name': ord_data['customerName'], 'date': date_str, 'status': ord_data['status'], 'total': ord_data['total'], 'items_json': None, 'updated_at': now}
+        items[cid] = order_item_rows(tid, order_id, date_str, ord_data['items'])
+        count += 1
+
+    if rows:
+        upsert_rows(Order, list(rows.values()), ['id'], ['customer_name', 'status', 'total', 'items_json', 'updated_at'], match_cols=['tenant_id', 'customer_id', 'date'])
+        # Line items are replaced wholesale: one DELETE and one executemany INSERT
+        OrderItem.query.filter(and_(OrderItem.tenant_id == tid, OrderItem.order_id.in_([r['id'] for r in rows.values()]))).delete(synchronize_session=False)
+        item_rows = [row for cid in rows for row in items[cid]]
+        if item_rows: db.session.execute(OrderItem.__table__.insert(), item_rows)
+    if apply_dues:
+        apply_dues_deltas(tid, dues_delta)
+        ledger_apply(tid, date_str, sales=sum(dues_delta.values()))
+    return count
+
 @app.route('/api/payments', methods=['POST'])
 @require_auth
-def add_payment():
-    data, tid = request.json, g.tenant_id
-    cust = Customer.query.filter_by(id=data['customerId'], tenant_id=tid).first()
-    if not cust: return jsonify({"error": "Customer not found"}), 404
-    db.session.add(Payment(id=str(int(datetime.now().timestamp() * 1000)), tenant_id=tid, customer_id=data['customerId'], amount=data['amount'], date=data['date'], collected_by=data.get('collectedBy'), note=data.get('note')))
-    cust.dues -= float(data['amount'])
-    db.session.commit()
-    return jsonify({"message": "Payment recorded"})
+def add_payment(): return commit_mutation(*record_payment(g.tenant_id, request.json))
 
 @app.route('/api/expenses', methods=['GET', 'POST'])
 @require_auth
 def manage_expenses():
     tid = g.tenant_id
-    if request.method == 'POST':
-        data = request.json
-        exp = Expense(id=str(int(datetime.now().timestamp())), tenant_id=tid, title=data['title'], amount=data['amount'], category=data['category'], date=data['date'], employee_id=data.get('employeeId'))
-        db.session.add(exp)
-        db.session.commit()
-        return jsonify(exp.to_dict())
+    if request.method == 'POST': return commit_mutation(*create_expense(tid, request.json))
     else:
         query = Expense.query.filter_by(tenant_id=tid)
         if request.args.get('startDate') and request.args.get('endDate'): query = query.filter(and_(Expense.date >= request.args.get('startDate'), Expense.date <= request.args.get('endDate')))
         if request.args.get('employeeId'): query = query.filter_by(employee_id=request.args.get('employeeId'))
         return jsonify([e.to_dict() for e in query.order_by(Expense.date.desc()).all()])
 
+REPORT_ENTITIES = {'orders': Order, 'payments': Payment, 'expenses': Expense}
+REPORT_CHUNK_SIZE = int(os.environ.get('REPORT_CHUNK_SIZE', 500))
+
+def report_query(model, tid, start, end):
+    return model.query.filter(and_(model.tenant_id == tid, model.date >= start, model.date <= end)).order_by(model.date, model.id)
+
 @app.route('/api/reports/data', methods=['GET'])
 @require_auth
+@replica_reads
 def get_report_data():
     tid, start, end = g.tenant_id, request.args.get('start'), request.args.get('end')
     if not start or not end: return jsonify({"error": "Dates required"}), 400
+
+    # Keyset-paginated variant: ?entity=orders&limit=500[&after=<next>]
+    entity = request.args.get('entity')
+    if entity:
+        if entity not in REPORT_ENTITIES: return jsonify({"error": "Unknown entity"}), 400
+        limit = min(request.args.get('limit', REPORT_CHUNK_SIZE, type=int), 5000)
+        rows, next_cursor = report_page(REPORT_ENTITIES[entity], tid, start, end, limit, request.args.get('after'))
+        return conditional_json({entity: rows, "next": next_cursor})
+
+    return conditional_json({
+        "orders": with_archive(tid, 'orders', start, end, order_dicts(tid, start, end)),
+        "payments": with_archive(tid, 'payments', start, end, row_dicts(Payment, Payment.tenant_id == tid, Payment.date >= start, Payment.date <= end)),
+        "expenses": row_dicts(Expense, Expense.tenant_id == tid, Expense.date >= start, Expense.date <= end)
+    })
+
+def report_page(model, tid, start, end, limit, after=None):
+    # One page ordered by (date, id); the cursor is the last row's "date|id"
+    if model is Order: rows = order_dicts(tid, start, end, after, limit + 1)
+    else:
+        query = report_query(model, tid, start, end)
+        if after:
+            after_date, _, after_id = after.partition('|')
+            query = query.filter(or_(model.date > after_date, and_(model.date == after_date, model.id > after_id)))
+        rows = projected(query.limit(limit + 1), PROJECTIONS[model])
+    entity = next(name for name, m in REPORT_ENTITIES.items() if m is model)
+    if entity in ARCHIVE_ENTITIES and archived_months(tid, start, end):
+        archived = (row for row in archive_rows(tid, entity, start, end) if not after or '|'.join(row_key(row)) > after)
+        rows = list(islice(heapq.merge(archived, rows, key=row_key), limit + 1))
+    next_cursor = f"{rows[limit - 1]['date']}|{rows[limit - 1]['id']}" if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+@app.route('/api/reports/export', methods=['GET'])
+@require_auth
+@replica_reads
+def export_report():
+    # Streams report rows straight from a server-side cursor (yield_per), so
+    # worker memory stays flat however long the range is.
+    tid, start, end = g.tenant_id, request.args.get('start'), request.args.get('end')
+    if not start or not end: return jsonify({"error": "Dates required"}), 400
+    fmt, entity = request.args.get('format', 'ndjson'), request.args.get('entity')
+    body, mimetype, filename = report_export(tid, start, end, fmt, entity)
+    if not body: return jsonify({"error": mimetype}), 400
+    if request.args.get('async') in ('1', 'true'):
+        # Written to a file by a background job; poll /api/jobs/<id>
+        job = submit_job(tid, 'report_export', {"start": start, "end": end, "format": fmt, "entity": entity})
+        return jsonify(job.to_dict()), 202
+
+    resp = Response(stream_with_context(body), mimetype=mimetype)
+    if fmt == 'csv': resp.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return resp
+
+def report_export(tid, start, end, fmt, entity=None):
+    # (body generator, mimetype, filename), or (None, error, None) for bad arguments
+    entities = [entity] if entity else list(REPORT_ENTITIES)
+    if any(e not in REPORT_ENTITIES for e in entities): return None, "Unknown entity", None
+    filename = f"{entity or 'report'}_{start}_{end}.{fmt}"
+    if fmt == 'ndjson': return report_ndjson(tid, start, end, entities), 'application/x-ndjson', filename
+    if fmt == 'json': return report_json(tid, start, end, entities), 'application/json', filename
+    if fmt == 'csv':
+        if len(entities) != 1: return None, "CSV export needs a single entity", None
+        return report_csv(tid, start, end, entities[0]), 'text/csv', filename
+    return None, "Unknown format", None
+
+def iter_report_chunks(entity, tid, start, end):
+    # Lists of at most REPORT_CHUNK_SIZE row dicts, fetched REPORT_CHUNK_SIZE at a time
+    chunk = []
+    rows = (row.to_dict() for row in report_query(REPORT_ENTITIES[entity], tid, start, end).yield_per(REPORT_CHUNK_SIZE))
+    if entity in ARCHIVE_ENTITIES and archived_months(tid, start, end): rows = heapq.merge(archive_rows(tid, entity, start, end), rows, key=row_key)
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= REPORT_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk: yield chunk
+
+def report_ndjson(tid, start, end, entities):
+    for entity in entities:
+        for chunk in iter_report_chunks(entity, tid, start, end):
+            yield ''.join(app.json.dumps({"entity": entity, **row}) + '\n' for row in chunk)
+
+def report_json(tid, start, end, entities):
+    # Same document shape as /api/reports/data, written incrementally
+    yield '{'
+    for n, entity in enumerate(entities):
+        yield f'{", " if n else ""}"{entity}": ['
+        first = True
+        for chunk in iter_report_chunks(entity, tid, start, end):
+            yield ('' if first else ', ') + ', '.join(app.json.dumps(row) for row in chunk)
+            first = False
+        yield ']'
+    yield '}'
+
+REPORT_CSV_COLUMNS = {
+    'orders': ['date', 'orderId', 'customerId', 'customerName', 'status', 'productId', 'product', 'quantity', 'price', 'amount', 'orderTotal'],
+    'payments': ['date', 'id', 'customerId', 'amount', 'collectedBy', 'note'],
+    'expenses': ['date', 'id', 'title', 'category', 'amount', 'employeeId'],
+}
+
+def report_csv(tid, start, end, entity):
+    # Orders are written one line per item so totals can be pivoted by product
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(REPORT_CSV_COLUMNS[entity])
+    for chunk in iter_report_chunks(entity, tid, start, end):
+        for d in chunk:
+            if entity == 'orders':
+                for item in d['items'] or [{}]:
+                    qty, price = item.get('quantity'), item.get('price')
+                    amount = qty * price if qty is not None and price is not None else ''
+                    writer.writerow([d['date'], d['id'], d['customerId'], d['customerName'], d['status'], item.get('id', ''), item.get('name', ''), qty, price, amount, d['total']])
+            elif entity == 'payments': writer.writerow([d['date'], d['id'], d['customerId'], d['amount'], d['collectedBy'], d['note']])
+            else: writer.writerow([d['date'], d['id'], d['title'], d['category'], d['amount'], d['employeeId']])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+@app.route('/api/reports/products', methods=['GET'])
+@require_auth
+@replica_reads
+def get_product_report():
+    tid, start, end = g.tenant_id, request.args.get('start'), request.args.get('end')
+    if not start or not end: return jsonify({"error": "Dates required"}), 400
+    return jsonify(product_sales(tid, start, end, request.args.get('status')))
+
+def product_sales(tid, start, end, status=None):
+    # Quantity and revenue per product straight from order_item
+    query = db.session.query(
+        OrderItem.product_id, func.max(OrderItem.name),
+        func.sum(OrderItem.quantity), func.sum(OrderItem.quantity * OrderItem.price)
+    ).filter(and_(OrderItem.tenant_id == tid, OrderItem.date >= start, OrderItem.date <= end))
+    if status: query = query.join(Order, Order.id == OrderItem.order_id).filter(Order.status == status)
+    rows = query.group_by(OrderItem.product_id).order_by(func.sum(OrderItem.quantity * OrderItem.price).desc()).all()
+    if archived_months(tid, start, end):
+        extra = {}
+        for o in archive_rows(tid, 'orders', start, end):
+            if status and o['status'] != status: continue
+            for item in o['items']:
+                name, qty, revenue = extra.get(item['id'], (None, 0, 0.0))
+                extra[item['id']] = (item['name'] or name, qty + (item['quantity'] or 0), revenue + (item['quantity'] or 0) * (item['price'] or 0))
+        rows = sorted(merge_grouped(rows, [(pid,) + v for pid, v in extra.items()]), key=lambda r: -(r[3] or 0))
+    return [{"productId": pid, "name": name, "quantity": plain_number(qty or 0), "revenue": round(revenue or 0, 2)} for pid, name, qty, revenue in rows]
+
+@app.route('/api/reports/summary', methods=['GET'])
+@require_auth
+@replica_reads
+def get_report_summary():
+    # Pre-aggregated report figures, all grouped in SQL: the payload size
+    # depends on the number of periods/categories, not on the rows behind them.
+    tid, start, end = g.tenant_id, request.args.get('start'), request.args.get('end')
+    if not start or not end: return jsonify({"error": "Dates required"}), 400
+    group = request.args.get('group', 'day')
+    period = report_period(Order.date, group)
+    if period is None: return jsonify({"error": "Unsupported grouping"}), 400
+    top = min(request.args.get('top', 10, type=int), 100)
+    return jsonify(report_summary(tid, start, end, group, top, 'products' in request.args.get('include', '').split(',')))
+
+def report_period(col, group):
+    # Period key for a 'YYYY-MM-DD' string column; weeks are keyed by their Monday
+    if group == 'day': return col
+    if group == 'month': return func.substr(col, 1, 7)
+    if group == 'week':
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql': return func.to_char(func.date_trunc('week', func.cast(col, db.Date)), 'YYYY-MM-DD')
+        if dialect == 'sqlite': return func.date(col, 'weekday 0', '-6 days')
+    return None
+
+def report_summary(tid, start, end, group, top=10, include_products=False):
+    in_range = lambda model: and_(model.tenant_id == tid, model.date >= start, model.date <= end)
+    period = report_period(Order.date, group).label('period')
+    finalized = case((Order.status == 'finalized', Order.total), else_=0)
+    revenue = db.session.query(period, func.count(Order.id), func.sum(Order.total), func.sum(finalized)).filter(in_range(Order)).group_by(period).order_by(period).all()
+    by_agent = db.session.query(Payment.collected_by, func.count(Payment.id), func.sum(Payment.amount)).filter(in_range(Payment)).group_by(Payment.collected_by).order_by(func.sum(Payment.amount).desc()).all()
+    by_category = db.session.query(Expense.category, func.count(Expense.id), func.sum(Expense.amount)).filter(in_range(Expense)).group_by(Expense.category).order_by(func.sum(Expense.amount).desc()).all()
+    by_employee = db.session.query(Expense.employee_id, func.count(Expense.id), func.sum(Expense.amount)).filter(in_range(Expense)).group_by(Expense.employee_id).order_by(func.sum(Expense.amount).desc()).all()
+    top_sales = db.session.query(Order.customer_id, func.max(Order.customer_name), func.sum(Order.total)).filter(in_range(Order)).group_by(Order.customer_id).order_by(func.sum(Order.total).desc())
+    archived = archived_months(tid, start, end)
+    top_sales = top_sales.all() if archived else top_sales.limit(top).all()
+    top_dues = db.session.query(Customer.id, Customer.name, Customer.dues).filter(and_(Customer.tenant_id == tid, Customer.dues > 0)).order_by(Customer.dues.desc()).limit(top).all()
+
+    if archived:
+        extra = archive_summary(tid, start, end, group, include_products)
+        revenue = sorted(merge_grouped(revenue, extra['revenue']))
+        by_agent = sorted(merge_grouped(by_agent, extra['byAgent']), key=lambda r: -(r[2] or 0))
+        top_sales = sorted(merge_grouped(top_sales, extra['topSales']), key=lambda r: -(r[2] or 0))[:top]
+
+    sales, collections, expenses = sum(r[2] or 0 for r in revenue), sum(r[2] or 0 for r in by_agent), sum(r[2] or 0 for r in by_category)
+    summary = {
+        "start": start, "end": end, "group": group,
+        "totals": {"sales": sales, "finalizedSales": sum(r[3] or 0 for r in revenue), "collections": collections, "expenses": expenses, "netCash": collections - expenses},
+        "revenue": [{"period": p, "orders": n, "sales": total or 0, "finalized": fin or 0} for p, n, total, fin in revenue],
+        "collectionsByAgent": [{"collectedBy": who, "payments": n, "amount": amount or 0} for who, n, amount in by_agent],
+        "expensesByCategory": [{"category": cat, "count": n, "amount": amount or 0} for cat, n, amount in by_category],
+        "expensesByEmployee": [{"employeeId": emp, "count": n, "amount": amount or 0} for emp, n, amount in by_employee],
+        "topCustomersBySales": [{"customerId": cid, "name": name, "sales": total or 0} for cid, name, total in top_sales],
+        "topCustomersByDues": [{"customerId": cid, "name": name, "dues": dues} for cid, name, dues in top_dues],
+    }
+    if include_products:
+        item_period = report_period(OrderItem.date, group).label('period')
+        rows = db.session.query(item_period, OrderItem.product_id, func.max(OrderItem.name), func.sum(OrderItem.quantity)).filter(in_range(OrderItem)).group_by(item_period, OrderItem.product_id).order_by(item_period).all()
+        if archived: rows = sorted(merge_grouped(rows, extra['products'], keys=2), key=lambda r: (r[0], r[1]))
+        summary["productsByPeriod"] = [{"period": p, "productId": pid, "name": name, "quantity": plain_number(qty or 0)} for p, pid, name, qty in rows]
+    return summary
+
+@app.route('/api/reports/balances', methods=['GET'])
+@require_auth
+@replica_reads
+def get_balances():
+    tid, start, end = g.tenant_id, request.args.get('start'), request.args.get('end')
+    if not start or not end: return jsonify({"error": "Dates required"}), 400
+    first, last = ledger_day(tid, start), ledger_day(tid, end)
+    days = DailyLedger.query.filter(and_(DailyLedger.tenant_id == tid, DailyLedger.date >= start, DailyLedger.date <= end)).order_by(DailyLedger.date).all()
     return jsonify({
-        "orders": [o.to_dict() for o in Order.query.filter(and_(Order.tenant_id == tid, Order.date >= start, Order.date <= end)).all()],
-        "payments": [p.to_dict() for p in Payment.query.filter(and_(Payment.tenant_id == tid, Payment.date >= start, Payment.date <= end)).all()],
-        "expenses": [e.to_dict() for e in Expense.query.filter(and_(Expense.tenant_id == tid, Expense.date >= start, Expense.date <= end)).all()]
+        "openingBalance": round(first.opening_balance, 2) if first else 0,
+        "closingBalance": round(last.closing_balance, 2) if last else 0,
+        "days": [d.to_dict() for d in days],
     })
 
 @app.route('/api/dashboard', methods=['GET'])
 @require_auth
+@replica_reads
 def dashboard_stats():
     tid, date_str = g.tenant_id, request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
-    live_total_dues = db.session.query(func.sum(Customer.dues)).filter_by(tenant_id=tid).scalar() or 0
-    active_customers = Customer.query.filter_by(tenant_id=tid, status='Active').count()
-    
-    future_sales = sum(o.total for o in Order.query.filter(and_(Order.tenant_id == tid, Order.date > date_str, Order.status == 'finalized')).all())
-    future_collections = sum(p.amount for p in Payment.query.filter(and_(Payment.tenant_id == tid, Payment.date > date_str)).all())
-    
-    today_orders = Order.query.filter_by(date=date_str, tenant_id=tid).all()
-    revenue_finalized = sum(o.total for o in today_orders if o.status == 'finalized')
-    collection_today = sum(p.amount for p in Payment.query.filter_by(date=date_str, tenant_id=tid).all())
-    
-    total_dues_on_date = live_total_dues - future_sales + future_collections
-    opening_balance = total_dues_on_date - revenue_finalized + collection_today
-
     prev_date = (datetime.strptime(date_str, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
-    prev_rev = sum(o.total for o in Order.query.filter_by(date=prev_date, tenant_id=tid).all() if o.status == 'finalized')
+    stats = dashboard_from_ledger(tid, date_str, prev_date) or dashboard_totals(tid, date_str, prev_date)
+
+    revenue_finalized, prev_rev = stats['revenue_finalized'], stats['prev_rev']
     pct = ((revenue_finalized - prev_rev) / prev_rev * 100) if prev_rev > 0 else (100 if revenue_finalized > 0 else 0)
 
-    return jsonify({"revenue_today": sum(o.total for o in today_orders), "revenue_finalized": revenue_finalized, "revenue_pct_change": round(pct, 1), "collection_today": collection_today, "total_dues": round(total_dues_on_date, 2), "opening_balance": round(opening_balance, 2), "active_customers": active_customers})
+    return jsonify({"revenue_today": stats['revenue_today'], "revenue_finalized": revenue_finalized, "revenue_pct_change": round(pct, 1), "collection_today": stats['collection_today'], "total_dues": round(stats['total_dues'], 2), "opening_balance": round(stats['opening_balance'], 2), "active_customers": stats['active_customers']})
+
+def dashboard_from_ledger(tid, date_str, prev_date):
+    # Balances from the daily ledger: the last two rollup rows up to date_str,
+    # plus one query for the figures the ledger doesn't hold. Before the
+    # tenant's first row nothing had happened yet, so the balance is that
+    # row's opening balance; None only when the tenant has no ledger at all.
+    rows = DailyLedger.query.filter(and_(DailyLedger.tenant_id == tid, DailyLedger.date <= date_str)).order_by(DailyLedger.date.desc()).limit(2).all()
+    if rows: balance = rows[0].closing_balance
+    else:
+        first = DailyLedger.query.filter(and_(DailyLedger.tenant_id == tid, DailyLedger.date > date_str)).order_by(DailyLedger.date).first()
+        if not first: return None
+        balance = first.opening_balance
+    day = rows[0] if rows and rows[0].date == date_str else None
+    prev = next((r for r in rows if r.date == prev_date), None)
+    extra = db.session.execute(select(
+        select(func.coalesce(func.sum(Order.total), 0)).where(and_(Order.tenant_id == tid, Order.date == date_str)).scalar_subquery(),
+        select(func.count(Customer.id)).where(and_(Customer.tenant_id == tid, Customer.status == 'Active')).scalar_subquery(),
+    )).one()
+    return {
+        'revenue_today': extra[0],
+        'revenue_finalized': day.sales if day else 0,
+        'prev_rev': prev.sales if prev else 0,
+        'collection_today': day.collections if day else 0,
+        'total_dues': balance,
+        'opening_balance': day.opening_balance if day else balance,
+        'active_customers': extra[1],
+    }
+
+def dashboard_totals(tid, date_str, prev_date):
+    # Fallback for a tenant with no ledger rows yet. Every
+    # dashboard figure in one round trip: three single-row aggregates
+    # (orders, payments, customers) cross-joined into one SELECT.
+    def total_if(cond, col): return func.coalesce(func.sum(case((cond, col), else_=0)), 0)
+    finalized = Order.status == 'finalized'
+    orders = select(
+        total_if(and_(Order.date > date_str, finalized), Order.total).label('future_sales'),
+        total_if(Order.date == date_str, Order.total).label('revenue_today'),
+        total_if(and_(Order.date == date_str, finalized), Order.total).label('revenue_finalized'),
+        total_if(and_(Order.date == prev_date, finalized), Order.total).label('prev_rev'),
+    ).where(and_(Order.tenant_id == tid, Order.date >= prev_date)).subquery()
+    payments = select(
+        total_if(Payment.date > date_str, Payment.amount).label('future_collections'),
+        total_if(Payment.date == date_str, Payment.amount).label('collection_today'),
+    ).where(and_(Payment.tenant_id == tid, Payment.date >= date_str)).subquery()
+    customers = select(
+        func.coalesce(func.sum(Customer.dues), 0).label('live_total_dues'),
+        func.count(case((Customer.status == 'Active', 1))).label('active_customers'),
+    ).where(Customer.tenant_id == tid).subquery()
+    stmt = select(orders, payments, customers).select_from(orders.join(payments, true()).join(customers, true()))
+    stats = dict(db.session.execute(stmt).mappings().one())
+    stats['total_dues'] = stats['live_total_dues'] - stats['future_sales'] + stats['future_collections']
+    stats['opening_balance'] = stats['total_dues'] - stats['revenue_finalized'] + stats['collection_today']
+    return stats
 
 @app.route('/api/products', methods=['POST'])
 @require_auth
 def add_product():
     data, tid = request.json, g.tenant_id
-    prod = Product(id=f"{tid}_{int(datetime.now().timestamp())}", tenant_id=tid, name=data['name'], price=data['price'], unit='Unit', is_active=True)
+    prod = Product(tenant_id=tid, name=data['name'], price=data['price'], unit='Unit', is_active=True)
     db.session.add(prod)
     db.session.commit()
     return jsonify(prod.to_dict())
@@ -605,38 +1997,742 @@ def mod_product(id):
     return jsonify({"message": "Success"})
 
 
-# --- AUTO-CREATE TABLES & MIGRATION ---
-# This block ensures tables are created when the app starts.
-# It also checks for the new 'location_name' column and adds it if missing.
-with app.app_context():
-    db.create_all()
-    
-    try:
-        inspector = inspect(db.engine)
-        
-        # Migration: Check 'employee' table
-        if 'employee' in inspector.get_table_names():
-            cols = [c['name'] for c in inspector.get_columns('employee')]
-            with db.engine.connect() as conn:
-                if 'designation' not in cols:
-                    print("Migrating: Adding designation column to employee")
-                    conn.execute(text("ALTER TABLE employee ADD COLUMN designation VARCHAR(100)"))
-                if 'username' not in cols:
-                    print("Migrating: Adding username column to employee")
-                    conn.execute(text("ALTER TABLE employee ADD COLUMN username VARCHAR(50)"))
-                conn.commit()
-        
-        # Migration: Check 'dairy_tenant' table
-        if 'dairy_tenant' in inspector.get_table_names():
-            cols = [c['name'] for c in inspector.get_columns('dairy_tenant')]
-            with db.engine.connect() as conn:
-                if 'location_name' not in cols:
-                    print("Migrating: Adding location_name column to dairy_tenant")
-                    conn.execute(text("ALTER TABLE dairy_tenant ADD COLUMN location_name VARCHAR(100)"))
-                conn.commit()
+# --- METRICS ---
+# Route counters are always on. PROFILE_REQUESTS=1 adds per-route histograms,
+# N+1 flagging and one JSON log line per request on the 'dairy.profile' logger.
+route_stats = RouteStats()
+PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS', '0').lower() in ('1', 'true', 'yes')
+PROFILE_QUERY_THRESHOLD = int(os.environ.get('PROFILE_QUERY_THRESHOLD', 25))
+request_profiler = RequestProfiler()
+profile_log = logging.getLogger('dairy.profile')
+if PROFILE_REQUESTS and not profile_log.handlers:
+    profile_log.addHandler(logging.StreamHandler())
+    profile_log.setLevel(logging.INFO)
+    profile_log.propagate = False
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def count_request_query(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context(): return
+    g.db_queries = g.get('db_queries', 0) + 1
+    g.db_time = g.get('db_time', 0.0) + time.perf_counter() - conn.info.pop('query_started', time.perf_counter())
+    if PROFILE_REQUESTS:
+        statements = g.setdefault('db_statements', {})
+        statements[statement] = statements.get(statement, 0) + 1
+
+@app.after_request
+def record_route_stats(response):
+    # Streamed bodies run their queries after this point and aren't counted
+    if not request.url_rule: return response
+    route = f"{request.method} {request.url_rule.rule}"
+    route_stats.record(route, g.get('db_queries', 0), g.get('db_time', 0.0))
+    if PROFILE_REQUESTS: profile_request(route, response)
+    return response
+
+def profile_request(route, response):
+    wall, queries, db_time = time.perf_counter() - g.get('request_started', time.perf_counter()), g.get('db_queries', 0), g.get('db_time', 0.0)
+    size = None if response.is_streamed else response.calculate_content_length()
+    entry = {"route": route, "path": request.path, "status": response.status_code, "wallMs": round(wall * 1000, 2), "dbMs": round(db_time * 1000, 2),
+             "queries": queries, "bytes": size, "tenant": g.get('tenant_id')}
+    if queries > PROFILE_QUERY_THRESHOLD:
+        # The most repeated statement is usually the loop body of an N+1
+        statement, times = max(g.get('db_statements', {}).items(), key=lambda kv: kv[1], default=('', 0))
+        if times > 1: entry["nPlusOne"] = {"repeats": times, "statement": ' '.join(statement.split())[:200]}
+    request_profiler.observe(route, wall, db_time, queries, size, flagged='nPlusOne' in entry)
+    profile_log.log(logging.WARNING if 'nPlusOne' in entry else logging.INFO, json.dumps(entry))
+
+def require_metrics_access(f):
+    # Admin users, or a scraper presenting METRICS_TOKEN as a bearer token
+    admin_only = require_auth(require_role(['admin'])(f))
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = os.environ.get('METRICS_TOKEN')
+        if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'): return f(*args, **kwargs)
+        return admin_only(*args, **kwargs)
+    return decorated
 
+@app.route('/api/admin/metrics', methods=['GET'])
+@require_metrics_access
+def admin_metrics():
+    pool = db.engine.pool
+    state = {"class": type(pool).__name__}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        if hasattr(pool, name): state[name] = getattr(pool, name)()
+    if request.args.get('format') == 'prometheus':
+        body = render_prometheus(state, pool_stats, route_stats, request_profiler if PROFILE_REQUESTS else None)
+        return Response(body, mimetype='text/plain; version=0.0.4')
+    config = {**DB_POOL, 'statement_timeout_ms': DB_STATEMENT_TIMEOUT_MS}
+    replicas = {key: {"lagSeconds": lag} for key, (_, lag, _) in replica_checks.items()}  # lag None: unreachable
+    return jsonify({"pid": os.getpid(), "pool": {**state, **pool_stats.snapshot(), "config": config}, "routes": route_stats.snapshot(), "replicas": replicas})
+
+# --- BULK IMPORT ---
+# Streams CSV or NDJSON, validates IMPORT_BATCH_SIZE records at a time with one
+# lookup query per batch, and commits each batch with multi-row inserts.
+# Without apply_dues the rows are treated as history already reflected in
+# customer dues, and the ledger is rebuilt once at the end.
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+IMPORT_MAX_ERRORS = 100
+
+def iter_import_records(lines, fmt, entity):
+    # (line_no, record) pairs; a record that failed to parse is a ValueError
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        rows = ((reader.line_num, {k: v for k, v in row.items() if v not in ('', None)}) for row in reader)
+    else:
+        def ndjson():
+            for line_no, line in enumerate(lines, 1):
+                if not line.strip(): continue
+                try: yield line_no, json.loads(line)
+                except ValueError: yield line_no, ValueError('Invalid JSON')
+        rows = ndjson()
+    return fold_order_lines(rows) if entity == 'orders' else rows
+
+def fold_order_lines(rows):
+    # Export-style order CSV has one line per item; consecutive lines of the
+    # same order become one record so a batch never splits an order.
+    current, current_key = None, None
+    for line_no, row in rows:
+        if isinstance(row, Exception) or 'items' in row:
+            if current: yield current
+            current, current_key = None, None
+            yield line_no, row
+            continue
+        key = row.get('orderId') or (row.get('customerId'), row.get('date'))
+        if current and key != current_key:
+            yield current
+            current = None
+        if not current:
+            current_key = key
+            current = (line_no, {'id': row.get('orderId'), 'customerId': row.get('customerId'), 'customerName': row.get('customerName'), 'date': row.get('date'),
+                                 'status': row.get('status'), 'total': row.get('orderTotal'), 'items': []})
+        if row.get('productId'): current[1]['items'].append({'productId': row['productId'], 'name': row.get('product'), 'quantity': row.get('quantity'), 'price': row.get('price')})
+    if current: yield current
+
+def import_date(value):
+    datetime.strptime(value, '%Y-%m-%d')
+    return value
+
+def import_customers(tid, batch, apply_dues):
+    errors, rows, phones = [], [], set()
+    wanted = [r for _, r in batch if isinstance(r, dict)]
+    taken = {p for (p,) in db.session.query(Customer.phone).filter(and_(Customer.tenant_id == tid, Customer.phone.in_({str(r.get('phone')) for r in wanted})))}
+    ids = {i for (i,) in db.session.query(Customer.id).filter(Customer.id.in_({r['id'] for r in wanted if r.get('id')}))}
+    for line_no, r in batch:
+        try:
+            if isinstance(r, Exception): raise r
+            if not r.get('name') or not r.get('phone'): raise ValueError('name and phone are required')
+            phone = str(r['phone'])
+            if phone in taken or phone in phones: raise ValueError('Phone exists')
+            if r.get('id') in ids: raise ValueError('Id exists')
+            rows.append({'id': r.get('id') or new_id('C'), 'tenant_id': tid, 'name': r['name'], 'phone': phone, 'address': r.get('address'),
+                         'dues': float(r.get('dues') or 0), 'status': r.get('status') or 'Active', 'updated_at': datetime.utcnow()})
+            phones.add(phone)
+            ids.add(rows[-1]['id'])
+        except (ValueError, TypeError) as e: errors.append((line_no, str(e)))
+    if rows:
+        db.session.execute(Customer.__table__.insert(), rows)
+        ledger_apply(tid, datetime.now().strftime('%Y-%m-%d'), adjustments=sum(r['dues'] for r in rows))
+    return len(rows), errors
+
+def import_rates(tid, batch, apply_dues):
+    errors, rows = [], {}
+    known = {c for (c,) in db.session.query(Customer.id).filter(and_(Customer.tenant_id == tid, Customer.id.in_({r.get('customerId') for _, r in batch if isinstance(r, dict)})))}
+    products = {p['id'] for p in product_catalog(tid)}
+    for line_no, r in batch:
+        try:
+            if isinstance(r, Exception): raise r
+            if r.get('customerId') not in known: raise ValueError('Unknown customer')
+            if r.get('productId') not in products: raise ValueError('Unknown product')
+            rows[(r['customerId'], r['productId'])] = {'tenant_id': tid, 'customer_id': r['customerId'], 'product_id': r['productId'], 'rate': float(r['rate'])}
+        except (ValueError, TypeError, KeyError) as e: errors.append((line_no, str(e) if not isinstance(e, KeyError) else f'{e.args[0]} is required'))
+    if rows:
+        # Replace existing rates for the same customer/product pairs
+        CustomerRate.query.filter(and_(CustomerRate.tenant_id == tid, tuple_(CustomerRate.customer_id, CustomerRate.product_id).in_(list(rows)))).delete(synchronize_session=False)
+        db.session.execute(CustomerRate.__table__.insert(), list(rows.values()))
+        Customer.query.filter(and_(Customer.tenant_id == tid, Customer.id.in_({c for c, _ in rows}))).update({Customer.updated_at: datetime.utcnow()}, synchronize_session=False)
+        invalidate_tenant_cache(tid, 'prices')
+    return len(rows), errors
+
+def import_payments(tid, batch, apply_dues):
+    errors, rows = [], []
+    wanted = [r for _, r in batch if isinstance(r, dict)]
+    known = {c for (c,) in db.session.query(Customer.id).filter(and_(Customer.tenant_id == tid, Customer.id.in_({r.get('customerId') for r in wanted})))}
+    ids = {i for (i,) in db.session.query(Payment.id).filter(Payment.id.in_({r['id'] for r in wanted if r.get('id')}))}
+    for line_no, r in batch:
+        try:
+            if isinstance(r, Exception): raise r
+            if r.get('customerId') not in known: raise ValueError('Unknown customer')
+            if r.get('id') in ids: raise ValueError('Already imported')
+            rows.append({'id': r.get('id') or new_id('PM'), 'tenant_id': tid, 'customer_id': r['customerId'], 'amount': float(r['amount']), 'date': import_date(r['date']),
+                         'collected_by': r.get('collectedBy'), 'note': r.get('note'), 'updated_at': datetime.utcnow()})
+            ids.add(rows[-1]['id'])
+        except (ValueError, TypeError, KeyError) as e: errors.append((line_no, str(e) if not isinstance(e, KeyError) else f'{e.args[0]} is required'))
+    if rows:
+        db.session.execute(Payment.__table__.insert(), rows)
+        if apply_dues:
+            deltas, by_date = {}, {}
+            for r in rows:
+                deltas[r['customer_id']] = deltas.get(r['customer_id'], 0.0) - r['amount']
+                by_date[r['date']] = by_date.get(r['date'], 0.0) + r['amount']
+            apply_dues_deltas(tid, deltas)
+            for date_str, amount in by_date.items(): ledger_apply(tid, date_str, collections=amount)
+    return len(rows), errors
+
+def import_orders(tid, batch, apply_dues):
+    errors, by_date = [], {}
+    names = dict(db.session.query(Customer.id, Customer.name).filter(and_(Customer.tenant_id == tid, Customer.id.in_({r.get('customerId') for _, r in batch if isinstance(r, dict)}))))
+    for line_no, r in batch:
+        try:
+            if isinstance(r, Exception): raise r
+            if r.get('customerId') not in names: raise ValueError('Unknown customer')
+            items = [{'productId': i.get('productId') or i.get('id'), 'name': i.get('name'), 'quantity': float(i.get('quantity') or 0), 'price': float(i.get('price') or 0)} for i in r.get('items') or []]
+            total = float(r['total']) if r.get('total') not in (None, '') else sum(i['quantity'] * i['price'] for i in items)
+            by_date.setdefault(import_date(r['date']), []).append({'id': r.get('id'), 'customerId': r['customerId'], 'customerName': r.get('customerName') or names[r['customerId']],
+                                                                'status': r.get('status') or 'finalized', 'total': total, 'items': items})
+        except (ValueError, TypeError, KeyError, AttributeError) as e: errors.append((line_no, str(e) if not isinstance(e, KeyError) else f'{e.args[0]} is required'))
+    return sum(bulk_save_orders(tid, date_str, orders, apply_dues=apply_dues) for date_str, orders in by_date.items()), errors
+
+IMPORTERS = {'customers': import_customers, 'rates': import_rates, 'orders': import_orders, 'payments': import_payments}
+
+def start_import(tid, entity, job_id=None):
+    # A new job, or the unfinished job being resumed. None if job_id doesn't match.
+    if not job_id:
+        job = ImportJob(tenant_id=tid, entity=entity, status='running', position=0, inserted=0, failed=0)
+        db.session.add(job)
+    else:
+        job = ImportJob.query.filter_by(id=int(job_id), tenant_id=tid, entity=entity).first()
+        if not job or job.status == 'done': return None
+        job.status, job.message = 'running', None
+    db.session.commit()
+    return job
+
+def run_import(job, lines, fmt, apply_dues=False, batch_size=None, on_batch=None):
+    tid, job_id = job.tenant_id, job.id
+    records = iter_import_records(lines, fmt, job.entity)
+    for _ in range(job.position): next(records, None)  # resuming: these are committed
+    batch = []
+    try:
+        for record in records:
+            batch.append(record)
+            if len(batch) >= (batch_size or IMPORT_BATCH_SIZE):
+                import_batch(job, batch, apply_dues)
+                batch = []
+                if on_batch: on_batch(job)
+        if batch: import_batch(job, batch, apply_dues)
+        if not apply_dues and job.entity in ('orders', 'payments'): rebuild_ledger(tid)
+        job.status = 'done'
+        db.session.commit()
     except Exception as e:
-        print(f"Migration warning (safe to ignore on fresh DB): {e}")
+        db.session.rollback()
+        job = db.session.get(ImportJob, job_id)
+        job.status, job.message = 'failed', f"Stopped after {job.position} records: {getattr(e, 'orig', None) or e}"[:500]
+        db.session.commit()
+    return job
+
+def import_batch(job, batch, apply_dues):
+    inserted, errors = IMPORTERS[job.entity](job.tenant_id, batch, apply_dues)
+    kept = json.loads(job.errors or '[]')
+    kept.extend({"line": line_no, "error": error} for line_no, error in errors[:IMPORT_MAX_ERRORS - len(kept)])
+    job.position, job.inserted, job.failed, job.errors = job.position + len(batch), job.inserted + inserted, job.failed + len(errors), json.dumps(kept)
+    db.session.commit()
+
+@app.route('/api/import/<entity>', methods=['POST'])
+@require_auth
+@require_role(['admin'])
+def import_data(entity):
+    # Send the raw file as the request body, e.g. curl --data-binary @orders.csv
+    if entity not in IMPORTERS: return jsonify({"error": "Unknown entity"}), 400
+    fmt = request.args.get('format') or ('csv' if 'csv' in request.mimetype else 'ndjson')
+    if fmt not in ('csv', 'ndjson'): return jsonify({"error": "Format must be csv or ndjson"}), 400
+    job = start_import(g.tenant_id, entity, request.args.get('job'))
+    if not job: return jsonify({"error": "No unfinished import job with that id"}), 404
+    apply_dues = request.args.get('apply_dues') in ('1', 'true')
+    if request.args.get('async') in ('1', 'true'):
+        # Spool the upload to disk and import it in a background job
+        upload = f"import-{job.id}-{new_id()}.{fmt}"
+        with open(job_file(upload), 'wb') as f:
+            while chunk := request.stream.read(1 << 20): f.write(chunk)
+        bg = submit_job(g.tenant_id, 'import', {"importJob": job.id, "upload": upload, "format": fmt, "applyDues": apply_dues})
+        return jsonify({**bg.to_dict(), "importJob": job.id}), 202
+    lines = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+    job = run_import(job, lines, fmt, apply_dues=apply_dues)
+    return jsonify(job.to_dict()), 200 if job.status == 'done' else 500
+
+@app.route('/api/import/jobs/<int:job_id>', methods=['GET'])
+@require_auth
+@require_role(['admin'])
+def import_status(job_id):
+    job = ImportJob.query.filter_by(id=job_id, tenant_id=g.tenant_id).first()
+    if not job: return jsonify({"error": "Not found"}), 404
+    return jsonify(job.to_dict())
+
+@app.cli.command('import')
+@click.argument('entity', type=click.Choice(list(IMPORTERS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--tenant', 'tenant_id', required=True)
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default=None, help='Default: from the file extension.')
+@click.option('--apply-dues', is_flag=True, help='Move customer dues and the ledger as if the rows were entered live.')
+@click.option('--resume', 'job_id', default=None, help='Continue a failed import job.')
+@click.option('--batch-size', type=int, default=None)
+def import_command(entity, path, tenant_id, fmt, apply_dues, job_id, batch_size):
+    """Bulk-load customers, rates, orders or payments from CSV or NDJSON."""
+    g.tenant_id = tenant_id
+    job = start_import(tenant_id, entity, job_id)
+    if not job: raise click.ClickException('No unfinished import job with that id')
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        job = run_import(job, f, fmt or ('csv' if path.lower().endswith('.csv') else 'ndjson'), apply_dues, batch_size)
+    print(json.dumps(job.to_dict(), indent=2))
+    if job.status != 'done': raise click.ClickException(f"Import job {job.id} failed; fix the file and re-run with --resume {job.id}")
+
+# --- BACKGROUND JOBS ---
+# Finalize, report exports and imports can run off the request thread:
+# submit_job() stores a Job row and hands its id to an executor; clients poll
+# GET /api/jobs/<id> and fetch GET /api/jobs/<id>/result. The job table is the
+# queue, so nothing is lost on restart and no broker is needed.
+#   JOB_EXECUTOR=thread (default): a JOB_WORKERS thread pool in each web worker.
+#   JOB_EXECUTOR=none: web workers only queue; `flask jobs-work` runs the jobs.
+# The work is mostly waiting on SQL, so threads rather than processes.
+JOB_EXECUTOR = os.environ.get('JOB_EXECUTOR', 'thread')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', 5))  # seconds, doubled per attempt
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', 600))  # running without progress this long = worker died
+JOB_SWEEP_SECONDS = float(os.environ.get('JOB_SWEEP_SECONDS', 60))  # how often the thread executor looks for left-behind jobs
+JOB_FILES_DIR = os.environ.get('JOB_FILES_DIR') or os.path.join(tempfile.gettempdir(), 'dairy-jobs')  # share it between hosts
+
+job_log = logging.getLogger('dairy.jobs')
+_job_pool, _job_pool_lock = None, threading.Lock()
+_jobs_dispatched, _jobs_dispatched_lock = set(), threading.Lock()  # ids waiting in this process's pool or on a retry timer
+
+def _reset_job_pool():
+    global _job_pool
+    _job_pool = None  # threads don't survive fork
+    _jobs_dispatched.clear()
+
+if hasattr(os, 'register_at_fork'): os.register_at_fork(after_in_child=_reset_job_pool)
+
+def job_pool():
+    # Starting the pool also starts its sweeper
+    global _job_pool
+    with _job_pool_lock:
+        if _job_pool is None:
+            _job_pool = ThreadPoolExecutor(JOB_WORKERS, thread_name_prefix='dairy-job')
+            threading.Thread(target=_sweep_jobs_forever, args=(_job_pool,), name='dairy-job-sweeper', daemon=True).start()
+        return _job_pool
+
+@app.before_request
+def start_job_executor():
+    # Each web worker starts its executor on its first request, so jobs left
+    # queued or running by a previous process resume without a new submit
+    if JOB_EXECUTOR == 'thread' and _job_pool is None:
+        ensure_schema()  # the sweeper needs the job table
+        job_pool()
+
+def sweep_jobs():
+    # Requeue jobs a dead worker left behind, then dispatch everything due:
+    # queued jobs and retries whose timer died with their process
+    recover_jobs()
+    for job_id in due_job_ids(): dispatch_job(job_id)
+
+def _sweep_jobs_forever(pool):
+    while pool is _job_pool:
+        with app.app_context():
+            try: sweep_jobs()
+            except Exception: job_log.exception("Job sweep failed")
+            finally: db.session.remove()
+        time.sleep(JOB_SWEEP_SECONDS)
+
+def job_file(name):
+    os.makedirs(JOB_FILES_DIR, exist_ok=True)
+    return os.path.join(JOB_FILES_DIR, name)
+
+def submit_job(tid, kind, params, max_attempts=None):
+    job = Job(tenant_id=tid, kind=kind, params=json.dumps(params), status='queued', progress=0.0, attempts=0, max_attempts=max_attempts or JOB_MAX_ATTEMPTS,
+              created_by=g.get('user_id') if has_request_context() else None)
+    db.session.add(job)
+    db.session.commit()
+    dispatch_job(job.id)
+    return job
+
+def dispatch_job(job_id, delay=0):
+    # At most one pending run per job in this process, however often the sweeper sees it queued
+    if JOB_EXECUTOR != 'thread': return
+    with _jobs_dispatched_lock:
+        if job_id in _jobs_dispatched: return
+        _jobs_dispatched.add(job_id)
+    if delay:
+        timer = threading.Timer(delay, lambda: job_pool().submit(run_job, job_id))
+        timer.daemon = True
+        timer.start()
+    else: job_pool().submit(run_job, job_id)
+
+def due_job_ids(limit=100):
+    due = and_(Job.status == 'queued', or_(Job.run_after.is_(None), Job.run_after <= datetime.utcnow()))
+    return [job_id for (job_id,) in db.session.query(Job.id).filter(due).order_by(Job.created_at).limit(limit)]
+
+def recover_jobs():
+    # Running jobs whose worker stopped reporting (crash, redeploy) are retried or failed
+    table, now = Job.__table__, datetime.utcnow()
+    stale = and_(table.c.status == 'running', table.c.updated_at < now - timedelta(seconds=JOB_STALE_SECONDS))
+    requeued = db.session.execute(table.update().where(stale, table.c.attempts < table.c.max_attempts).values(status='queued', run_after=None, worker=None, updated_at=now)).rowcount
+    db.session.execute(table.update().where(stale).values(status='failed', message='Worker stopped responding', finished_at=now, updated_at=now))
+    db.session.commit()
+    return requeued
+
+def claim_job(job_id):
+    # Atomic queued -> running, so a job runs once however many workers see it
+    table, now = Job.__table__, datetime.utcnow()
+    due = and_(table.c.id == job_id, table.c.status == 'queued', or_(table.c.run_after.is_(None), table.c.run_after <= now))
+    claimed = db.session.execute(table.update().where(due).values(status='running', attempts=table.c.attempts + 1, worker=f"{socket.gethostname()}:{os.getpid()}",
+                                                                  started_at=now, updated_at=now)).rowcount
+    db.session.commit()
+    return claimed == 1
+
+def set_job_progress(job_id, fraction=None, message=None):
+    # On its own connection so it is visible while the job's transaction is open.
+    # Best effort: SQLite may be locked by that very transaction.
+    values = {"updated_at": datetime.utcnow()}
+    if fraction is not None: values["progress"] = min(max(fraction, 0.0), 1.0)
+    if message: values["message"] = message[:500]
+    try:
+        with db.engine.begin() as conn: conn.execute(Job.__table__.update().where(Job.__table__.c.id == job_id).values(**values))
+    except OperationalError: pass
+
+@contextmanager
+def job_heartbeat(job_id):
+    # Keeps a running job's updated_at fresh even when its handler reports no
+    # progress (finalize is a few bulk statements), so recover_jobs() only
+    # takes jobs whose worker has really stopped
+    stop = threading.Event()
+    def beat():
+        with app.app_context():
+            while not stop.wait(JOB_STALE_SECONDS / 4): set_job_progress(job_id)
+    threading.Thread(target=beat, name=f'dairy-job-beat-{job_id}', daemon=True).start()
+    try: yield
+    finally: stop.set()
+
+def run_job(job_id):
+    with _jobs_dispatched_lock: _jobs_dispatched.discard(job_id)
+    with app.app_context():
+        try:
+            if not claim_job(job_id): return
+            job = db.session.get(Job, job_id)
+            g.tenant_id = job.tenant_id
+            handler = JOB_HANDLERS.get(job.kind)
+            try:
+                if not handler: raise ValueError(f"Unknown job kind {job.kind}")
+                with job_heartbeat(job_id):
+                    result = handler(job, json.loads(job.params or '{}'), lambda fraction, message=None: set_job_progress(job_id, fraction, message))
+                    # Committed together with the handler's own writes
+                    job.status, job.progress, job.result, job.message, job.finished_at = 'done', 1.0, json.dumps(result), None, datetime.utcnow()
+                    db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                job_log.warning("Job %s (%s) attempt failed", job_id, job.kind, exc_info=True)
+                fail_job(job_id, e, retry=not isinstance(e, (ValueError, KeyError)))
+        except Exception:
+            job_log.exception("Job %s could not be run", job_id)
+        finally:
+            db.session.remove()
+
+def fail_job(job_id, error, retry=True):
+    # Retry with exponential backoff until max_attempts; bad parameters fail at once
+    job = db.session.get(Job, job_id)
+    message = str(getattr(error, 'orig', None) or error)
+    if retry and job.attempts < job.max_attempts:
+        delay = JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        job.status, job.run_after, job.worker = 'queued', datetime.utcnow() + timedelta(seconds=delay), None
+        job.message = f"Attempt {job.attempts} failed, retrying in {delay:g}s: {message}"[:500]
+        db.session.commit()
+        dispatch_job(job_id, delay + 0.1)
+    else:
+        job.status, job.message, job.finished_at = 'failed', message[:500], datetime.utcnow()
+        db.session.commit()
+
+def job_finalize(job, params, progress):
+    count, added = finalize_orders(job.tenant_id, params['date'])
+    return {"count": count, "added": round(added, 2), "message": f"Finalized {count} orders"}
+
+def job_report_export(job, params, progress):
+    tid, start, end, fmt, entity = job.tenant_id, params['start'], params['end'], params.get('format', 'ndjson'), params.get('entity')
+    body, mimetype, filename = report_export(tid, start, end, fmt, entity)
+    if not body: raise ValueError(mimetype)
+    total = sum(db.session.query(func.count(model.id)).filter(model.tenant_id == tid, model.date >= start, model.date <= end).scalar()
+                for name, model in REPORT_ENTITIES.items() if name == entity or not entity)
+    path, chunks = job_file(f"{job.id}.{fmt}"), max(1, -(-total // REPORT_CHUNK_SIZE))
+    with open(path + '.part', 'w', encoding='utf-8', newline='') as f:
+        for n, piece in enumerate(body, 1):  # roughly one piece per chunk of rows
+            f.write(piece)
+            progress(min(n / chunks, 0.99))
+    os.replace(path + '.part', path)
+    return {"file": os.path.basename(path), "filename": filename, "mimetype": mimetype, "bytes": os.path.getsize(path), "rows": total}
+
+def job_import(job, params, progress):
+    imp = db.session.get(ImportJob, params['importJob'])
+    if imp.status != 'done':
+        imp.status, imp.message = 'running', None
+        path = job_file(params['upload'])
+        size = os.path.getsize(path) or 1
+        with open(path, 'rb') as raw:
+            lines = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+            imp = run_import(imp, lines, params['format'], params.get('applyDues', False), on_batch=lambda _: progress(min(raw.tell() / size, 0.99)))
+        if imp.status != 'done': raise RuntimeError(imp.message)
+        os.remove(path)
+    return imp.to_dict()
+
+JOB_HANDLERS = {'finalize': job_finalize, 'report_export': job_report_export, 'import': job_import}
+
+@app.route('/api/jobs', methods=['POST'])
+@require_auth
+def create_job():
+    # {"kind": "finalize", "params": {"date": ...}} or
+    # {"kind": "report_export", "params": {"start", "end", "format", "entity"}}
+    data = request.json or {}
+    kind, params = data.get('kind'), data.get('params') or {}
+    if kind == 'finalize':
+        if not params.get('date'): return jsonify({"error": "Date required"}), 400
+        params = {"date": params['date']}
+    elif kind == 'report_export':
+        if not params.get('start') or not params.get('end'): return jsonify({"error": "Dates required"}), 400
+        params = {"start": params['start'], "end": params['end'], "format": params.get('format', 'ndjson'), "entity": params.get('entity')}
+        body, error, _ = report_export(g.tenant_id, params['start'], params['end'], params['format'], params['entity'])
+        if not body: return jsonify({"error": error}), 400
+    else: return jsonify({"error": "Unknown job kind (imports start from /api/import/<entity>?async=1)"}), 400
+    return jsonify(submit_job(g.tenant_id, kind, params).to_dict()), 202
+
+@app.route('/api/jobs', methods=['GET'])
+@require_auth
+def list_jobs():
+    query = Job.query.filter_by(tenant_id=g.tenant_id)
+    if request.args.get('status'): query = query.filter_by(status=request.args['status'])
+    return jsonify([j.to_dict() for j in query.order_by(Job.created_at.desc()).limit(50)])
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@require_auth
+def job_status(job_id):
+    job = Job.query.filter_by(id=job_id, tenant_id=g.tenant_id).first()
+    if not job: return jsonify({"error": "Not found"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+@require_auth
+def job_result(job_id):
+    job = Job.query.filter_by(id=job_id, tenant_id=g.tenant_id).first()
+    if not job: return jsonify({"error": "Not found"}), 404
+    if job.status != 'done': return jsonify({**job.to_dict(), "error": f"Job is {job.status}"}), 409
+    result = json.loads(job.result or 'null')
+    if isinstance(result, dict) and result.get('file'):
+        path = os.path.join(JOB_FILES_DIR, result['file'])
+        if not os.path.exists(path): return jsonify({"error": "Result file is no longer available"}), 410
+        return send_file(path, mimetype=result['mimetype'], as_attachment=True, download_name=result['filename'])
+    return jsonify(result)
+
+@app.cli.command('jobs-work')
+@click.option('--once', is_flag=True, help='Exit when the queue is empty.')
+@click.option('--poll', type=float, default=2.0, help='Seconds between queue checks when idle.')
+def jobs_work_command(once, poll):
+    """Run queued background jobs (for JOB_EXECUTOR=none deployments)."""
+    while True:
+        recover_jobs()
+        job_ids = due_job_ids(JOB_WORKERS * 4)
+        db.session.remove()
+        if job_ids: list(job_pool().map(run_job, job_ids))
+        elif once: break
+        else: time.sleep(poll)
+
+
+def migrate_order_items(batch_size=500):
+    # One-time move of Order.items_json blobs into order_item rows. Safe to re-run.
+    moved = 0
+    legacy = and_(Order.items_json.isnot(None), Order.items_json != '')
+    while True:
+        batch = Order.query.filter(legacy).order_by(Order.id).limit(batch_size).all()
+        if not batch: break
+        item_rows = []
+        for o in batch:
+            if o.items: continue
+            try: items_list = json.loads(o.items_json)
+            except: items_list = []
+            item_rows.extend(order_item_rows(o.tenant_id, o.id, o.date, items_list))
+        if item_rows: db.session.execute(OrderItem.__table__.insert(), item_rows)
+        # Keep updated_at as-is: the API shape of these orders has not changed
+        db.session.execute(Order.__table__.update().where(Order.__table__.c.id == bindparam('b_id')).values(items_json=None, updated_at=bindparam('b_updated_at')),
+                           [{'b_id': o.id, 'b_updated_at': o.updated_at} for o in batch])
+        db.session.commit()
+        db.session.expunge_all()
+        moved += len(batch)
+    return moved
+
+@app.cli.command('migrate-order-items')
+def migrate_order_items_command():
+    """Move legacy Order.items_json line items into the order_item table."""
+    print(f"Migrated {migrate_order_items()} orders.")
+
+# --- SCHEMA MIGRATIONS ---
+# Numbered steps recorded in schema_version and applied by `flask db upgrade`
+# (the Procfile release phase) under a lock, so exactly one process migrates
+# and importing the app touches no database. Append new steps; never renumber
+# or change one that has shipped. Each step must be safe on a database that
+# already has the change, since pre-versioning databases replay them all.
+# Tenant databases (TENANT_DATABASE_URLS) carry their own schema_version and
+# are upgraded after the primary.
+MIGRATION_LOCK_KEY = 0x6461697279  # pg_advisory_lock key ("dairy")
+AUTO_MIGRATE = os.environ.get('AUTO_MIGRATE', '1').lower() in ('1', 'true', 'yes')
+
+class SchemaVersion(db.Model):
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200))
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+def schema_engine():
+    # The primary, or the database pinned by upgrade() and tenant-copy
+    return db.session.get_bind()
+
+def add_missing_columns(table, columns):
+    # columns: {name: SQL type}; tables that don't exist yet are left to create_all()
+    inspector = inspect(schema_engine())
+    if table not in inspector.get_table_names(): return
+    have = {c['name'] for c in inspector.get_columns(table)}
+    quote = schema_engine().dialect.identifier_preparer.quote
+    with schema_engine().begin() as conn:
+        for name, sql_type in columns.items():
+            if name in have: continue
+            print(f"Migrating: Adding {name} column to {table}")
+            conn.execute(text(f"ALTER TABLE {quote(table)} ADD COLUMN {name} {sql_type}"))
+
+def create_missing_indexes():
+    # create_all() only indexes new tables, so add any index declared on the
+    # models that an existing table is missing. A failure fails the migration,
+    # so it is retried on the next upgrade instead of being stamped as done.
+    failed = []
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                with schema_engine().begin() as conn: index.create(bind=conn, checkfirst=True)
+            except Exception as e:
+                # e.g. duplicate (tenant_id, customer_id, date) orders block the unique index
+                print(f"Migration error: could not create index {index.name}: {e}")
+                failed.append(index.name)
+    if failed: raise RuntimeError(f"Could not create indexes {', '.join(failed)}; fix the rows above and rerun `flask --app app db upgrade`")
+
+MIGRATIONS = [
+    (1, 'create tables', lambda: db.metadata.create_all(schema_engine())),
+    (2, 'employee designation and username', lambda: add_missing_columns('employee', {'designation': 'VARCHAR(100)', 'username': 'VARCHAR(50)'})),
+    (3, 'tenant location_name', lambda: add_missing_columns('dairy_tenant', {'location_name': 'VARCHAR(100)'})),
+    (4, 'user token_version', lambda: add_missing_columns('dairy_user', {'token_version': 'INTEGER DEFAULT 0'})),
+    (5, 'updated_at for delta sync', lambda: [add_missing_columns(model.__tablename__, {'updated_at': 'TIMESTAMP'}) for model in SYNC_MODELS.values()]),
+    (6, 'indexes declared on the models', create_missing_indexes),
+    (7, 'order items out of items_json', migrate_order_items),
+    (8, 'mutation_key for /api/batch', lambda: MutationKey.__table__.create(schema_engine(), checkfirst=True)),
+    (9, 'replica_heartbeat', lambda: ReplicaHeartbeat.__table__.create(schema_engine(), checkfirst=True)),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+@contextmanager
+def migration_lock():
+    # PostgreSQL: a session advisory lock. SQLite: an flock on a file beside the database.
+    if schema_engine().dialect.name == 'postgresql':
+        with schema_engine().connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+            try: yield
+            finally: conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_KEY})
+        return
+    path = schema_engine().url.database
+    if fcntl is None or not path or path == ':memory:':
+        yield
+        return
+    with open(path + '.migrate.lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try: yield
+        finally: fcntl.flock(f, fcntl.LOCK_UN)
+
+def current_schema_version():
+    if not inspect(schema_engine()).has_table(SchemaVersion.__tablename__): return 0
+    return db.session.query(func.max(SchemaVersion.version)).scalar() or 0
+
+def upgrade_database(target=None):
+    """Apply pending MIGRATIONS up to `target` (default all) to one database; returns the versions applied."""
+    target, applied = target or SCHEMA_VERSION, []
+    with migration_lock():
+        current = current_schema_version()  # again under the lock: another process may have just finished
+        if current == 0 and not inspect(schema_engine()).has_table(DairyTenant.__tablename__) and target == SCHEMA_VERSION:
+            # Empty database: create the current schema and stamp it
+            db.metadata.create_all(schema_engine())
+            db.session.add_all(SchemaVersion(version=version, name=name) for version, name, _ in MIGRATIONS)
+            db.session.commit()
+            print(f"Created schema at version {SCHEMA_VERSION}")
+            return [version for version, _, _ in MIGRATIONS]
+        SchemaVersion.__table__.create(schema_engine(), checkfirst=True)
+        for version, name, step in MIGRATIONS:
+            if version <= current or version > target: continue
+            print(f"Migrating: {version} {name}")
+            step()
+            db.session.add(SchemaVersion(version=version, name=name))
+            db.session.commit()
+            applied.append(version)
+    return applied
+
+def upgrade(target=None):
+    """Upgrade the primary and every tenant database; returns {name: versions applied}."""
+    applied = {}
+    for name, engine in database_engines():
+        if TENANT_DATABASE_URLS: print(f"[{name}]")
+        with pinned_bind(engine): applied[name] = upgrade_database(target)
+    return applied
+
+def schema_versions():
+    versions = {}
+    for name, engine in database_engines():
+        with pinned_bind(engine): versions[name] = current_schema_version()
+    return versions
+
+_schema_ready = [False]
+_schema_ready_lock = threading.Lock()
+
+@app.before_request
+def ensure_schema():
+    # Once per process, on the first request rather than at import: one query
+    # when the release phase has already migrated
+    if _schema_ready[0]: return
+    with _schema_ready_lock:
+        if _schema_ready[0]: return
+        if min(schema_versions().values()) < SCHEMA_VERSION:
+            if not AUTO_MIGRATE: app.logger.error("Database schema is behind; run `flask --app app db upgrade`")
+            else:
+                # A failed step stays pending for the next upgrade; don't retry it on every request
+                try: upgrade()
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Schema upgrade failed; run `flask --app app db upgrade`")
+        _schema_ready[0] = True
+
+@app.cli.group('db')
+def db_commands():
+    """Schema migrations."""
+
+@db_commands.command('upgrade')
+@click.option('--to', 'target', type=int, default=None, help='Stop at this version (default: latest).')
+def db_upgrade_command(target):
+    """Apply pending schema migrations."""
+    applied = upgrade(target)
+    for name, version in schema_versions().items():
+        print(f"{name + ': ' if TENANT_DATABASE_URLS else ''}Schema at version {version}" + ('' if applied[name] else ' (nothing to do)'))
+
+@db_commands.command('current')
+def db_current_command():
+    """Show the schema version and pending migrations."""
+    for db_name, current in schema_versions().items():
+        print(f"{db_name + ': ' if TENANT_DATABASE_URLS else ''}Schema at version {current} of {SCHEMA_VERSION}")
+        for version, name, _ in MIGRATIONS:
+            if version > current: print(f"  pending: {version} {name}")
 
 if __name__ == '__main__':
+    with app.app_context(): upgrade()
     app.run(debug=False, port=5000)
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""Offline catch-up: N queued edits as separate requests vs one /api/batch.
+
+Replays the same mix of payments, expenses, customer edits and rate changes
+both ways against fresh customers, then replays the batch a second time to
+check that nothing is applied twice. Prints wall time, requests and commits.
+
+    python -m bench.bench_batch [--ops 200] [--chunk 50]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+from sqlalchemy import event
+
+from bench.common import load_app, login
+from bench.synth import generate_tenant
+
+def queued_ops(customers, n, tag):
+    today = date.today().isoformat()
+    for i in range(n):
+        c = customers[i % len(customers)]
+        kind = i % 4
+        if kind == 0: yield 'payment.create', 'POST', '/api/payments', {'customerId': c['id'], 'amount': 10, 'date': today, 'collectedBy': 'Agent'}
+        elif kind == 1: yield 'expense.create', 'POST', '/api/expenses', {'title': f'Fuel {tag}{i}', 'amount': 20, 'category': 'Operational', 'date': today}
+        elif kind == 2: yield 'customer.update', 'PUT', f"/api/customers/{c['id']}", {'name': c['name'], 'phone': c['phone'], 'address': f'{tag} {i} Market Road'}
+        else: yield 'customer.rates', 'POST', f"/api/customers/{c['id']}/rates", {'rates': {}}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ops', type=int, default=200)
+    parser.add_argument('--chunk', type=int, default=50)
+    args = parser.parse_args()
+    os.environ['BATCH_CHUNK_SIZE'] = str(args.chunk)
+
+    appmod = load_app()
+    tid = 'BATCH1'
+    generate_tenant(appmod, tid, customers=100, years=0.1)
+    client = appmod.app.test_client()
+    headers = login(client, f'{tid.lower()}_admin', 'bench')
+    customers = client.get('/api/sync', headers=headers).json['customers']
+    commits = [0]
+    with appmod.app.app_context(): event.listen(appmod.db.engine, 'commit', lambda conn: commits.__setitem__(0, commits[0] + 1))
+
+    def run(label, fn):
+        commits[0] = 0
+        started = time.perf_counter()
+        requests = fn()
+        took = (time.perf_counter() - started) * 1000
+        print(f'{label:<24}{took:>10.1f}{requests:>10}{commits[0]:>10}')
+
+    def serial():
+        for _, method, path, body in queued_ops(customers, args.ops, 's'):
+            assert client.open(path, method=method, json=body, headers=headers).status_code == 200
+        return args.ops
+
+    ops = [{'key': f'b{i}', 'op': op, **({'id': path.split('/')[3]} if op.startswith('customer.') else {}), 'data': body}
+           for i, (op, _, path, body) in enumerate(queued_ops(customers, args.ops, 'b'))]
+    outcome = {}
+    def batch():
+        outcome.update(client.post('/api/batch', json={'ops': ops}, headers=headers).json)
+        return 1
+
+    print(f"{args.ops} queued operations, batch chunk {args.chunk}\n{'':<24}{'ms':>10}{'requests':>10}{'commits':>10}")
+    run('separate requests', serial)
+    run('/api/batch', batch)
+    applied = outcome['applied']
+    run('/api/batch (replayed)', batch)
+    if applied != args.ops or outcome['replayed'] != args.ops:
+        print(f"FAIL: applied {applied}, replayed {outcome['replayed']} of {args.ops}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
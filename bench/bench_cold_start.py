@@ -0,0 +1,49 @@
+"""Cold start: time to import app and to serve the first request.
+
+Each run is a fresh interpreter against an already migrated database, so the
+numbers are what a new gunicorn worker pays before it can answer. --app-dir
+points at another checkout (e.g. `git archive HEAD~1 | tar -x -C /tmp/prev`)
+to compare against it on the same database.
+
+    python -m bench.bench_cold_start [--runs 7] [--app-dir /tmp/prev]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROBE = r'''
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+status = app.app.test_client().get('/api/sync').status_code
+done = time.perf_counter()
+print(json.dumps({'import': imported - started, 'first': done - imported, 'status': status}))
+'''
+
+def probe(app_dir, url):
+    env = {**os.environ, 'DATABASE_URL': url, 'AUTO_MIGRATE': '1'}
+    out = subprocess.run([sys.executable, '-c', PROBE], cwd=app_dir, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--app-dir', action='append', help='Checkout to measure (repeatable; default: this one).')
+    args = parser.parse_args()
+    dirs = args.app_dir or [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+
+    url = os.environ.get('BENCH_DATABASE_URL') or f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='dairy-bench-'), 'bench.db')}"
+    print(f"{'app dir':<40}{'import ms':>11}{'first req ms':>14}{'total ms':>10}   (median of {args.runs})")
+    for app_dir in dirs:
+        probe(app_dir, url)  # migrates (or creates) the schema once, untimed
+        runs = [probe(app_dir, url) for _ in range(args.runs)]
+        imported, first = statistics.median(r['import'] for r in runs) * 1000, statistics.median(r['first'] for r in runs) * 1000
+        print(f'{app_dir[-38:]:<40}{imported:>11.1f}{first:>14.1f}{imported + first:>10.1f}')
+
+if __name__ == '__main__':
+    main()
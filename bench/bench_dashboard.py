@@ -0,0 +1,80 @@
+"""Old vs new /api/dashboard on a tenant with years of daily orders.
+
+The original implementation, which summed ORM objects in Python, is
+reproduced as `legacy_dashboard`. The endpoint is measured twice against it:
+first on the SQL aggregate path (no ledger rows yet), then after
+rebuild_ledger() on the daily-ledger path.
+
+    python -m bench.bench_dashboard [--customers 500] [--years 2] [--repeat 5]
+"""
+import argparse
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, func
+
+from bench.common import load_app, seed_tenant, seed_history, login, StatementCounter, timed
+
+def legacy_dashboard(appmod, tid, date_str):
+    Customer, Order, Payment, db = appmod.Customer, appmod.Order, appmod.Payment, appmod.db
+    live_total_dues = db.session.query(func.sum(Customer.dues)).filter_by(tenant_id=tid).scalar() or 0
+    active_customers = Customer.query.filter_by(tenant_id=tid, status='Active').count()
+    future_sales = sum(o.total for o in Order.query.filter(and_(Order.tenant_id == tid, Order.date > date_str, Order.status == 'finalized')).all())
+    future_collections = sum(p.amount for p in Payment.query.filter(and_(Payment.tenant_id == tid, Payment.date > date_str)).all())
+    today_orders = Order.query.filter_by(date=date_str, tenant_id=tid).all()
+    revenue_finalized = sum(o.total for o in today_orders if o.status == 'finalized')
+    collection_today = sum(p.amount for p in Payment.query.filter_by(date=date_str, tenant_id=tid).all())
+    total_dues_on_date = live_total_dues - future_sales + future_collections
+    opening_balance = total_dues_on_date - revenue_finalized + collection_today
+    prev_date = (datetime.strptime(date_str, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+    prev_rev = sum(o.total for o in Order.query.filter_by(date=prev_date, tenant_id=tid).all() if o.status == 'finalized')
+    pct = ((revenue_finalized - prev_rev) / prev_rev * 100) if prev_rev > 0 else (100 if revenue_finalized > 0 else 0)
+    db.session.remove()
+    return {"revenue_today": sum(o.total for o in today_orders), "revenue_finalized": revenue_finalized, "revenue_pct_change": round(pct, 1), "collection_today": collection_today, "total_dues": round(total_dues_on_date, 2), "opening_balance": round(opening_balance, 2), "active_customers": active_customers}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--customers', type=int, default=500)
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    appmod = load_app()
+    tid = 'BENCH01'
+    username, password = seed_tenant(appmod, tid, customers=args.customers)
+    print(f'Seeding {args.years * 365} days x {args.customers} customers ...')
+    seed_history(appmod, tid, days=args.years * 365, customers=args.customers)
+    client = appmod.app.test_client()
+    headers = login(client, username, password)
+    with appmod.app.app_context(): engine = appmod.db.engine
+
+    dates = [(date.today() - timedelta(days=d)).isoformat() for d in (1, 90, 365, args.years * 365 - 1)]
+    results = {d: {} for d in dates}
+    def measure(column, date_str):
+        url = f'/api/dashboard?date={date_str}'
+        with StatementCounter(engine) as counter: got = client.get(url, headers=headers).json
+        results[date_str][column] = (counter.count, timed(lambda: client.get(url, headers=headers), args.repeat))
+        return got
+
+    for date_str in dates:
+        with appmod.app.app_context():
+            expected = legacy_dashboard(appmod, tid, date_str)
+            with StatementCounter(engine) as legacy: legacy_dashboard(appmod, tid, date_str)
+            results[date_str]['legacy'] = (legacy.count, timed(lambda: legacy_dashboard(appmod, tid, date_str), args.repeat))
+        results[date_str]['expected'] = expected
+        # No ledger rows yet, so the endpoint takes the SQL aggregate path
+        if measure('aggregate', date_str) != expected: print(f'  aggregate MISMATCH on {date_str}')
+
+    with appmod.app.app_context():
+        appmod.rebuild_ledger(tid)
+        appmod.db.session.commit()
+    for date_str in dates:
+        if measure('ledger', date_str) != results[date_str]['expected']: print(f'  ledger MISMATCH on {date_str}')
+
+    # Statement counts include require_auth's user lookup for the endpoint paths
+    print(f"{'date':>12} {'legacy stmts/ms':>16} {'aggregate stmts/ms':>19} {'ledger stmts/ms':>16}")
+    for date_str in dates:
+        cells = [f'{results[date_str][k][0]:>5} / {results[date_str][k][1]:8.1f}' for k in ('legacy', 'aggregate', 'ledger')]
+        print(f'{date_str:>12} {cells[0]:>16} {cells[1]:>19} {cells[2]:>16}')
+
+if __name__ == '__main__':
+    main()
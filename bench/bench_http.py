@@ -0,0 +1,66 @@
+"""Bytes on the wire for the SPA pages and the big read endpoints.
+
+Fetches each URL uncompressed, gzip-encoded, brotli-encoded (when the brotli
+package is installed) and as a revalidation with the ETag from the first
+response. Checks that every encoding decodes to the same body and that the
+revalidation is an empty 304, then prints the transfer size of each.
+
+    python -m bench.bench_http [--customers 200] [--days 60]
+"""
+import argparse
+import gzip
+import json
+import sys
+from datetime import date, timedelta
+
+from bench.common import load_app, login
+from bench.synth import generate_tenant
+
+def same_body(a, b):
+    # The sync cursor differs on every call
+    if not a.lstrip().startswith((b'{', b'[')): return a == b
+    a, b = json.loads(a), json.loads(b)
+    if isinstance(a, dict) and isinstance(b, dict): a.pop('cursor', None), b.pop('cursor', None)
+    return a == b
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--days', type=int, default=60)
+    args = parser.parse_args()
+
+    appmod = load_app()
+    tid = 'HTTP01'
+    generate_tenant(appmod, tid, customers=args.customers, years=args.days / 365)
+    client = appmod.app.test_client()
+    headers = login(client, f'{tid.lower()}_admin', 'bench')
+    today, month_ago = date.today().isoformat(), (date.today() - timedelta(days=30)).isoformat()
+    urls = ['/', '/reports.html', '/api/sync', f'/api/orders?date={today}', f'/api/reports/data?start={month_ago}&end={today}',
+            f'/api/reports/data?start={month_ago}&end={today}&entity=orders&limit=500']
+    decoders = {'gzip': gzip.decompress}
+    if appmod.brotli: decoders['br'] = appmod.brotli.decompress
+
+    failures = 0
+    print(f"{'url':<62}{'identity':>10}" + ''.join(f'{name:>10}' for name in decoders) + f"{'304':>8}{'saved':>8}")
+    for url in urls:
+        plain = client.get(url, headers={**headers, 'Accept-Encoding': 'identity'})
+        sizes = []
+        for name, decode in decoders.items():
+            res = client.get(url, headers={**headers, 'Accept-Encoding': name})
+            encoded = res.get_data()
+            if res.headers.get('Content-Encoding') == name and not same_body(decode(encoded), plain.get_data()):
+                print(f'FAIL {url}: {name} body does not decode to the identity body')
+                failures += 1
+            sizes.append(len(encoded))
+        etag = plain.headers.get('ETag')
+        revalidated = client.get(url, headers={**headers, 'If-None-Match': etag}) if etag else None
+        if revalidated is None or revalidated.status_code != 304 or revalidated.get_data():
+            print(f'FAIL {url}: no empty 304 on revalidation')
+            failures += 1
+        not_modified = len(revalidated.get_data()) if revalidated is not None and revalidated.status_code == 304 else len(plain.get_data())
+        saved = 1 - min(sizes) / len(plain.get_data()) if plain.get_data() else 0
+        print(f'{url[:60]:<62}{len(plain.get_data()):>10}' + ''.join(f'{n:>10}' for n in sizes) + f'{not_modified:>8}{saved:>8.0%}')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
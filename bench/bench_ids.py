@@ -0,0 +1,49 @@
+"""Collision and ordering check for ids.new_id() across processes.
+
+Forks --procs workers from a parent that has already minted IDs (the case
+gunicorn's preload creates), has each mint its share, and fails if any ID is
+duplicated or a worker's IDs are not strictly increasing.
+
+    python -m bench.bench_ids [--total 100000] [--procs 8] [--kind ulid|snowflake]
+"""
+import argparse
+import multiprocessing
+import sys
+import time
+
+import bench.common  # noqa: F401  (puts the repo root on sys.path)
+import ids
+
+def mint(args):
+    kind, worker, count = args
+    # Snowflake needs a distinct worker id per process; ULID needs nothing
+    if kind == 'snowflake': ids.configure('snowflake', worker)
+    start = time.perf_counter()
+    out = [ids.new_id() for _ in range(count)]
+    return out, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--total', type=int, default=100000)
+    parser.add_argument('--procs', type=int, default=8)
+    parser.add_argument('--kind', choices=['ulid', 'snowflake'], default='ulid')
+    args = parser.parse_args()
+
+    ids.configure(args.kind, 0)
+    ids.new_id()
+    per = args.total // args.procs
+    with multiprocessing.get_context('fork').Pool(args.procs) as pool:
+        results = pool.map(mint, [(args.kind, i + 1, per) for i in range(args.procs)])
+
+    seen, unordered, elapsed = set(), 0, 0.0
+    for out, secs in results:
+        seen.update(out)
+        unordered += sum(1 for a, b in zip(out, out[1:]) if a >= b)
+        elapsed = max(elapsed, secs)
+    total = per * args.procs
+    print(f'{args.kind}: {total} ids from {args.procs} processes, {total - len(seen)} duplicates, {unordered} out of order')
+    print(f'{total / args.procs / elapsed:,.0f} ids/s per process; sample {results[0][0][0]}')
+    if len(seen) != total or unordered: sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Throughput of the bulk order import against file size.
+
+Writes an export-format order CSV (one line per item, two items per order)
+for seed_tenant() customers and loads it through run_import(), the same path
+as `flask import orders` and POST /api/import/orders.
+
+    python -m bench.bench_import [--lines 200000] [--customers 500] [--batch-size 1000]
+"""
+import argparse
+import csv
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+from bench.common import load_app, seed_tenant, StatementCounter
+
+def write_orders_csv(path, tid, lines, customers):
+    start = date(2020, 1, 1)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['date', 'orderId', 'customerId', 'customerName', 'status', 'productId', 'product', 'quantity', 'price', 'amount', 'orderTotal'])
+        for n in range(lines // 2):
+            day, i = (start + timedelta(days=n // customers)).isoformat(), n % customers
+            cid, oid = f'{tid}C{i + 1:05d}', f'{tid}-IMP-{n}'
+            writer.writerow([day, oid, cid, f'Customer {i + 1}', 'finalized', f'{tid}_p1', 'FCM 1L', 2, 70, 140, 165])
+            writer.writerow([day, oid, cid, f'Customer {i + 1}', 'finalized', f'{tid}_p10', 'Curd 500gm', 1, 25, 25, 165])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=200000)
+    parser.add_argument('--customers', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    appmod = load_app()
+    tid = 'IMPORT01'
+    seed_tenant(appmod, tid, customers=args.customers)
+    path = os.path.join(tempfile.mkdtemp(prefix='dairy-import-'), 'orders.csv')
+    write_orders_csv(path, tid, args.lines, args.customers)
+
+    with appmod.app.app_context():
+        job = appmod.start_import(tid, 'orders')
+        with StatementCounter(appmod.db.engine) as counter, open(path, newline='') as f:
+            started = time.perf_counter()
+            job = appmod.run_import(job, f, 'csv', batch_size=args.batch_size)
+            elapsed = time.perf_counter() - started
+        print(f'{args.lines} lines -> {job.inserted} orders ({job.status}, {job.failed} errors) in {elapsed:.1f}s')
+        print(f'{args.lines / elapsed:,.0f} lines/s, {counter.count} statements; 1M lines ~ {1e6 / (args.lines / elapsed) / 60:.1f} min')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""CPU cost of building and encoding large order lists, per 10k rows.
+
+Compares the ORM path (hydrated Order objects + to_dict()) with the
+column-projected order_dicts(), each encoded with the stdlib provider and,
+when installed, the orjson provider. Times are process CPU time, best of
+--repeat runs, including the query itself.
+
+    python -m bench.bench_json [--customers 200] [--days 60] [--repeat 5]
+"""
+import argparse
+import time
+from datetime import date, timedelta
+
+from flask.json.provider import DefaultJSONProvider
+
+from bench.common import load_app
+from bench.synth import generate_tenant
+
+def cpu_ms(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        fn()
+        took = (time.process_time() - start) * 1000
+        best = took if best is None else min(best, took)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    appmod = load_app()
+    tid = 'JSON01'
+    generate_tenant(appmod, tid, customers=args.customers, years=args.days / 365)
+    start = (date.today() - timedelta(days=args.days)).isoformat()
+    Order, db = appmod.Order, appmod.db
+    providers = {'stdlib': DefaultJSONProvider(appmod.app)}
+    if appmod.orjson: providers['orjson'] = appmod.OrjsonProvider(appmod.app)
+
+    with appmod.app.app_context():
+        def orm_rows():
+            db.session.expunge_all()
+            return [o.to_dict() for o in Order.query.filter(Order.tenant_id == tid, Order.date >= start).all()]
+        def projected_rows(): return appmod.order_dicts(tid, start=start)
+        rows = len(projected_rows())
+        per = 10000 / rows
+        print(f'{rows} orders (with items) per response; CPU ms per 10k rows, best of {args.repeat}\n')
+        print(f"{'build':<12}{'encode':<10}{'build ms':>10}{'encode ms':>11}{'total ms':>10}")
+        baseline = None
+        for build_name, build in (('orm', orm_rows), ('projected', projected_rows)):
+            data = build()
+            build_ms = cpu_ms(build, args.repeat) * per
+            for enc_name, provider in providers.items():
+                encode_ms = cpu_ms(lambda: provider.dumps(data).encode(), args.repeat) * per
+                total = build_ms + encode_ms
+                baseline = baseline or total
+                print(f'{build_name:<12}{enc_name:<10}{build_ms:>10.1f}{encode_ms:>11.1f}{total:>10.1f}  ({baseline / total:.1f}x)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Peak Python memory of /api/reports/data vs the streaming export by range length.
+
+Peak allocations are measured with tracemalloc while the response body is
+consumed and discarded chunk by chunk, so only what the server holds counts.
+
+    python -m bench.bench_report_export [--customers 200] [--days 730]
+"""
+import argparse
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from bench.common import load_app, seed_tenant, seed_history, login
+
+def measure(client, url, headers):
+    tracemalloc.start()
+    start, size = time.perf_counter(), 0
+    resp = client.get(url, headers=headers, buffered=False)
+    for chunk in resp.response: size += len(chunk)
+    resp.close()
+    elapsed = (time.perf_counter() - start) * 1000
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024 / 1024, elapsed, size / 1024 / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--days', type=int, default=730)
+    args = parser.parse_args()
+
+    appmod = load_app()
+    tid = 'BENCH01'
+    username, password = seed_tenant(appmod, tid, customers=args.customers)
+    print(f'Seeding {args.days} days x {args.customers} customers ...')
+    seed_history(appmod, tid, days=args.days, customers=args.customers)
+    client = appmod.app.test_client()
+    headers = login(client, username, password)
+
+    end = date.today().isoformat()
+    print(f"{'range':>7} {'body MB':>8} {'data peak MB':>13} {'data ms':>8} {'ndjson peak MB':>15} {'ndjson ms':>10} {'csv peak MB':>12}")
+    for days in (30, 90, 365, args.days):
+        start = (date.today() - timedelta(days=days)).isoformat()
+        full_peak, full_ms, size = measure(client, f'/api/reports/data?start={start}&end={end}', headers)
+        nd_peak, nd_ms, _ = measure(client, f'/api/reports/export?start={start}&end={end}&format=ndjson', headers)
+        csv_peak, _, _ = measure(client, f'/api/reports/export?start={start}&end={end}&format=csv&entity=orders', headers)
+        print(f'{days:>6}d {size:>8.1f} {full_peak:>13.1f} {full_ms:>8.0f} {nd_peak:>15.1f} {nd_ms:>10.0f} {csv_peak:>12.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Round trips and latency of /api/orders/save against sheet size.
+
+Compares the set-based bulk save with the previous row-by-row loop, which is
+reproduced here as `legacy_save_orders`.
+
+    python -m bench.bench_save_orders [--sizes 50,100,200,400] [--repeat 5]
+"""
+import argparse
+import json
+
+from bench.common import load_app, seed_tenant, login, StatementCounter, timed
+
+def legacy_save_orders(appmod, tid, date_str, orders):
+    Customer, Order, db = appmod.Customer, appmod.Order, appmod.db
+    count = 0
+    for ord_data in orders:
+        cust = Customer.query.filter_by(id=ord_data['customerId'], tenant_id=tid).first()
+        if not cust: continue
+        existing = Order.query.filter_by(customer_id=ord_data['customerId'], date=date_str, tenant_id=tid).first()
+        if existing and existing.status == 'finalized': cust.dues -= existing.total
+        items_json_str = json.dumps(ord_data['items'])
+        if existing:
+            existing.total = ord_data['total']
+            existing.status = ord_data['status']
+            existing.customer_name = ord_data['customerName']
+            existing.items_json = items_json_str
+        else:
+            db.session.add(Order(id=ord_data['id'], tenant_id=tid, customer_id=cust.id, customer_name=ord_data['customerName'], date=date_str, status=ord_data['status'], total=ord_data['total'], items_json=items_json_str))
+        if ord_data['status'] == 'finalized': cust.dues += ord_data['total']
+        count += 1
+    db.session.commit()
+    return count
+
+def make_sheet(tid, size, date_str):
+    orders = []
+    for i in range(size):
+        cid = f'{tid}C{i + 1:05d}'
+        items = [{'productId': f'{tid}_p1', 'name': 'FCM 1L', 'quantity': 2, 'price': 70}, {'productId': f'{tid}_p10', 'name': 'Curd 500gm', 'quantity': 1, 'price': 25}]
+        orders.append({'id': f'ORD-{date_str}-{cid}', 'customerId': cid, 'customerName': f'Customer {i + 1}', 'items': items, 'total': 165, 'status': 'draft'})
+    return {'date': date_str, 'orders': orders}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='50,100,200,400')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',')]
+
+    appmod = load_app()
+    tid = 'BENCH01'
+    username, password = seed_tenant(appmod, tid, customers=max(sizes))
+    client = appmod.app.test_client()
+    headers = login(client, username, password)
+    with appmod.app.app_context(): engine = appmod.db.engine
+
+    print(f"{'size':>6} {'legacy stmts':>13} {'legacy ms':>10} {'bulk stmts':>11} {'bulk ms':>8}")
+    for n, size in enumerate(sizes):
+        legacy_sheet, bulk_sheet = make_sheet(tid, size, f'2024-01-{2 * n + 1:02d}'), make_sheet(tid, size, f'2024-01-{2 * n + 2:02d}')
+        # First pass inserts, the counted passes update the existing rows
+        with appmod.app.app_context():
+            legacy_save_orders(appmod, tid, legacy_sheet['date'], legacy_sheet['orders'])
+            with StatementCounter(engine) as legacy:
+                legacy_save_orders(appmod, tid, legacy_sheet['date'], legacy_sheet['orders'])
+            legacy_ms = timed(lambda: legacy_save_orders(appmod, tid, legacy_sheet['date'], legacy_sheet['orders']), args.repeat)
+        client.post('/api/orders/save', json=bulk_sheet, headers=headers)
+        with StatementCounter(engine) as bulk:
+            client.post('/api/orders/save', json=bulk_sheet, headers=headers)
+        bulk_ms = timed(lambda: client.post('/api/orders/save', json=bulk_sheet, headers=headers), args.repeat)
+        print(f'{size:>6} {legacy.count:>13} {legacy_ms:>10.1f} {bulk.count:>11} {bulk_ms:>8.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Query-plan regression check for every tenant-scoped route.
+
+Seeds two tenants, calls each API route through the test client, captures the
+SQL it issues and runs EXPLAIN on every SELECT/UPDATE/DELETE. Exits non-zero
+if any statement falls back to a sequential scan of a table.
+
+On SQLite a plan line like `SCAN customer` is a full table scan (`SEARCH ...
+USING INDEX` is fine). On PostgreSQL the check runs with enable_seqscan off,
+so a remaining `Seq Scan` means no usable index exists.
+
+    python -m bench.check_query_plans [-v]
+"""
+import argparse
+import re
+import sys
+from datetime import date, timedelta
+
+from sqlalchemy import event, text
+
+from bench.common import load_app, seed_tenant, seed_history, login
+
+# Statements that legitimately read a whole (tiny) table
+ALLOWED_SCANS = set()
+
+def route_calls(tid):
+    today = date.today().isoformat()
+    month_ago = (date.today() - timedelta(days=30)).isoformat()
+    cid = f'{tid}C00001'
+    sheet = {'date': today, 'orders': [{'id': f'ORD-{today}-{cid}', 'customerId': cid, 'customerName': 'Customer 1', 'items': [{'productId': f'{tid}_p1', 'name': 'FCM 1L', 'quantity': 1, 'price': 70}], 'total': 70, 'status': 'draft'}]}
+    return [
+        ('sync_data', 'GET', '/api/sync', None),
+        ('sync_data (delta)', 'GET', f'/api/sync?since={today}T00:00:00', None),
+        ('agent_dues', 'GET', '/api/agent/dues', None),
+        ('agent_worklist', 'GET', '/api/agent/worklist?limit=20&q=Customer&collected=include', None),
+        ('agent_worklist (page)', 'GET', '/api/agent/worklist?limit=20&after=100.0|x&collected=hide', None),
+        ('add_customer', 'POST', '/api/customers', {'name': 'New', 'phone': '8000000000', 'address': 'x'}),
+        ('mod_customer', 'PUT', f'/api/customers/{cid}', {'name': 'Customer 1', 'phone': '9000000000', 'address': 'y'}),
+        ('update_rates', 'POST', f'/api/customers/{cid}/rates', {'rates': {f'{tid}_p1': 68}, 'scope': 'today'}),
+        ('save_orders', 'POST', '/api/orders/save', sheet),
+        ('get_orders', 'GET', f'/api/orders?date={today}', None),
+        ('finalize_sheet', 'POST', '/api/sheets/finalize', {'date': today}),
+        ('add_payment', 'POST', '/api/payments', {'customerId': cid, 'amount': 100, 'date': today, 'collectedBy': 'Agent'}),
+        ('manage_expenses', 'GET', f'/api/expenses?startDate={month_ago}&endDate={today}', None),
+        ('manage_expenses', 'POST', '/api/expenses', {'title': 'Fuel', 'amount': 10, 'category': 'Operational', 'date': today}),
+        ('get_report_data', 'GET', f'/api/reports/data?start={month_ago}&end={today}', None),
+        ('get_product_report', 'GET', f'/api/reports/products?start={month_ago}&end={today}&status=finalized', None),
+        ('dashboard_stats', 'GET', f'/api/dashboard?date={today}', None),
+        ('add_product', 'POST', '/api/products', {'name': 'Lassi', 'price': 20}),
+        ('mod_product', 'PUT', f'/api/products/{tid}_p1', {'price': 72}),
+    ]
+
+def explain(conn, dialect, statement, params):
+    if dialect == 'postgresql':
+        rows = conn.exec_driver_sql('EXPLAIN ' + statement, params).fetchall()
+        return [r[0] for r in rows]
+    rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, params).fetchall()
+    return [r[-1] for r in rows]
+
+def seq_scans(dialect, plan, tables):
+    found = []
+    for line in plan:
+        if dialect == 'postgresql':
+            m = re.search(r'Seq Scan on "?(\w+)"?', line)
+        else:
+            m = re.match(r'SCAN (?:TABLE )?"?(\w+)"?', line.strip())
+        if m and m.group(1) in tables: found.append(m.group(1))
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-v', '--verbose', action='store_true', help='print every plan')
+    args = parser.parse_args()
+
+    appmod = load_app()
+    tid = 'PLAN01'
+    username, password = seed_tenant(appmod, tid, customers=50)
+    seed_tenant(appmod, 'PLAN02', customers=50)
+    seed_history(appmod, tid, days=30, customers=50)
+    seed_history(appmod, 'PLAN02', days=30, customers=50)
+    client = appmod.app.test_client()
+    headers = login(client, username, password)
+
+    with appmod.app.app_context():
+        engine = appmod.db.engine
+        tables = set(appmod.db.metadata.tables)
+
+    captured = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if executemany: parameters = parameters[0] if parameters else ()
+        captured.append((statement, parameters))
+
+    failures = 0
+    with engine.connect() as conn:
+        dialect = engine.dialect.name
+        if dialect == 'postgresql': conn.execute(text('SET enable_seqscan = off'))
+        for name, method, url, body in route_calls(tid):
+            captured.clear()
+            event.listen(engine, 'before_cursor_execute', capture)
+            try: res = client.open(url, method=method, json=body, headers=headers)
+            finally: event.remove(engine, 'before_cursor_execute', capture)
+            if res.status_code >= 400:
+                print(f'FAIL {name}: {method} {url} returned {res.status_code}')
+                failures += 1
+                continue
+            for statement, params in captured:
+                if not re.match(r'\s*(SELECT|UPDATE|DELETE|WITH)\b', statement, re.I): continue
+                plan = explain(conn, dialect, statement, params)
+                scans = [t for t in seq_scans(dialect, plan, tables) if (name, t) not in ALLOWED_SCANS]
+                if scans:
+                    failures += 1
+                    print(f'FAIL {name}: sequential scan on {", ".join(scans)}\n    {" ".join(statement.split())}')
+                    for line in plan: print(f'      {line}')
+                elif args.verbose:
+                    print(f'ok   {name}: {" ".join(statement.split())[:100]}')
+                    for line in plan: print(f'      {line}')
+    print(f'{failures} query plan regression(s)' if failures else 'All route queries use indexes')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Read-replica routing and per-tenant databases, end to end on SQLite files.
+
+A primary, two replicas ("replicated" with sqlite3's backup API) and one
+tenant database stand in for the real servers. Each replica's copy of the
+customer names is tagged, so a response shows which database served it.
+Checks that:
+
+- read routes use a fresh replica, and writes go to the primary;
+- a lagging or missing replica is skipped, and reads fall back to the primary
+  when no replica is fresh;
+- the sync cursor never runs ahead of the replica that served the sync;
+- cached values (the product catalog) are filled from the primary;
+- a tenant copied with `flask tenant-copy` and listed in TENANT_DATABASE_URLS
+  reads and writes only its own database.
+
+    python -m bench.check_replicas
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+TMP = tempfile.mkdtemp(prefix='dairy-replicas-')
+PRIMARY, REPLICAS, TENANT_DB = os.path.join(TMP, 'primary.db'), [os.path.join(TMP, f'replica{i}.db') for i in range(2)], os.path.join(TMP, 'big01.db')
+os.environ['BENCH_DATABASE_URL'] = f'sqlite:///{PRIMARY}'
+os.environ['DATABASE_REPLICA_URLS'] = ','.join(f'sqlite:///{path}' for path in REPLICAS)
+os.environ['TENANT_DATABASE_URLS'] = f'BIG01=sqlite:///{TENANT_DB}'
+os.environ['REPLICA_CHECK_SECONDS'] = '0'  # re-check lag on every request
+os.environ['REPLICA_MAX_LAG_SECONDS'] = '5'
+
+from bench.common import load_app, login
+from bench.synth import generate_tenant
+
+def sql(path, statement, *params):
+    with sqlite3.connect(path) as conn: return conn.execute(statement, params).fetchall()
+
+def replicate(path, tag):
+    with sqlite3.connect(PRIMARY) as src, sqlite3.connect(path) as dst: src.backup(dst)
+    sql(path, "UPDATE customer SET name = name || ?", f' @{tag}')
+    sql(path, "UPDATE product SET price = price + 1000")
+
+def served_by(client, headers, tenant='SMALL1'):
+    names = {c['name'].rsplit(' @', 1)[1] if ' @' in c['name'] else 'primary' for c in client.get('/api/sync', headers=headers).json['customers']}
+    return names.pop() if len(names) == 1 else f'mixed {sorted(names)}'
+
+def main():
+    appmod = load_app()
+    for tid in ('SMALL1', 'BIG01'): generate_tenant(appmod, tid, customers=20, years=0.05)
+    failures = []
+    def check(label, ok, detail=''):
+        print(f"{'ok  ' if ok else 'FAIL'} {label}{f' ({detail})' if detail else ''}")
+        if not ok: failures.append(label)
+
+    # BIG01 moves to its own database; its rows left on the primary are then renamed so a stray read shows
+    result = appmod.app.test_cli_runner().invoke(args=['tenant-copy', 'BIG01', f'sqlite:///{TENANT_DB}'])
+    check('tenant-copy', result.exit_code == 0, result.output.strip().splitlines()[-1] if result.output else result.exception)
+    sql(PRIMARY, "UPDATE customer SET name = name || ' @stale-primary-copy' WHERE tenant_id = 'BIG01'")
+
+    client = appmod.app.test_client()
+    small, big = login(client, 'small1_admin', 'bench'), login(client, 'big01_admin', 'bench')
+
+    check('no replica has the schema yet: primary', served_by(client, small) == 'primary')
+    for i, path in enumerate(REPLICAS): replicate(path, f'replica{i}')
+    client.get('/api/sync', headers=small)  # the primary's heartbeat moves on; the replicas hold the previous one
+    seen = {served_by(client, small) for _ in range(20)}
+    check('fresh replicas serve reads', seen == {'replica0', 'replica1'}, seen)
+
+    sync = client.get('/api/sync', headers=small).json
+    catalog = {p['id']: p['price'] for p in sync['products']}
+    primary_prices = dict(sql(PRIMARY, "SELECT id, price FROM product WHERE tenant_id = 'SMALL1'"))
+    check('cached catalog filled from the primary', catalog == primary_prices)
+    replica_beat = min(datetime.fromisoformat(sql(path, "SELECT beat_at FROM replica_heartbeat")[0][0]) for path in REPLICAS)
+    check('sync cursor not ahead of the replica', datetime.fromisoformat(sync['cursor']) <= replica_beat + timedelta(seconds=1), sync['cursor'])
+    for path in ('/api/dashboard', '/api/orders?date=' + datetime.now().strftime('%Y-%m-%d'), '/api/reports/summary?start=2000-01-01&end=2100-01-01', '/api/agent/worklist'):
+        check(f'{path.split("?")[0]} on a replica', client.get(path, headers=small).status_code == 200)
+
+    customer = sync['customers'][0]['id']
+    before = [sql(p, "SELECT count(*) FROM payment")[0][0] for p in [PRIMARY] + REPLICAS]
+    res = client.post('/api/payments', json={'customerId': customer, 'amount': 10, 'date': '2026-01-01'}, headers=small)
+    after = [sql(p, "SELECT count(*) FROM payment")[0][0] for p in [PRIMARY] + REPLICAS]
+    check('writes go to the primary', res.status_code == 200 and after[0] == before[0] + 1 and after[1:] == before[1:], after)
+
+    stale = (datetime.utcnow() - timedelta(seconds=60)).isoformat(sep=' ')
+    sql(REPLICAS[0], "UPDATE replica_heartbeat SET beat_at = ?", stale)
+    seen = {served_by(client, small) for _ in range(10)}
+    check('lagging replica skipped', seen == {'replica1'}, seen)
+    sql(REPLICAS[1], "UPDATE replica_heartbeat SET beat_at = ?", stale)
+    check('all replicas lagging: primary', served_by(client, small) == 'primary')
+    os.remove(REPLICAS[1])
+    replicate(REPLICAS[0], 'replica0')
+    client.get('/api/sync', headers=small)
+    seen = {served_by(client, small) for _ in range(10)}
+    check('missing replica skipped', seen == {'replica0'}, seen)
+
+    check('tenant database serves its reads', served_by(client, big) == 'primary' and sql(TENANT_DB, "SELECT count(*) FROM customer WHERE name LIKE '%@%'")[0][0] == 0)
+    customer = client.get('/api/sync', headers=big).json['customers'][0]['id']
+    before = (sql(PRIMARY, "SELECT count(*) FROM payment WHERE tenant_id = 'BIG01'")[0][0], sql(TENANT_DB, "SELECT count(*) FROM payment")[0][0])
+    res = client.post('/api/payments', json={'customerId': customer, 'amount': 10, 'date': '2026-01-01'}, headers=big)
+    after = (sql(PRIMARY, "SELECT count(*) FROM payment WHERE tenant_id = 'BIG01'")[0][0], sql(TENANT_DB, "SELECT count(*) FROM payment")[0][0])
+    check('tenant writes go to its database', res.status_code == 200 and after == (before[0], before[1] + 1), after)
+    check('tenant dashboard', client.get('/api/dashboard', headers=big).status_code == 200)
+
+    print(f"\n{'FAIL' if failures else 'PASS'}: {len(failures)} of the checks failed" if failures else '\nPASS')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
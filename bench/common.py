@@ -0,0 +1,88 @@
+"""Shared helpers for the benchmark scripts.
+
+Benchmarks drive the real Flask app against a throwaway database. Set
+BENCH_DATABASE_URL to use PostgreSQL; otherwise a temporary SQLite file is
+created. load_app() must run before anything else imports app.py.
+"""
+import os
+import sys
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import event
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path: sys.path.insert(0, ROOT)
+
+def load_app():
+    url = os.environ.get('BENCH_DATABASE_URL') or 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='dairy-bench-'), 'bench.db')
+    # Must be set before app.py runs load_dotenv(), which never overrides it
+    os.environ['DATABASE_URL'] = url
+    import app as appmod
+    with appmod.app.app_context(): appmod.upgrade()
+    return appmod
+
+def seed_tenant(appmod, tid='BENCH01', customers=100, username=None, password='bench'):
+    from werkzeug.security import generate_password_hash
+    username = username or f'{tid.lower()}_admin'
+    db = appmod.db
+    with appmod.app.app_context():
+        db.session.add(appmod.DairyTenant(id=tid, name=f'Bench {tid}', location_code='BEN', location_seq=1))
+        db.session.add(appmod.DairyUser(username=username, password=generate_password_hash(password), role='admin', tenant_id=tid))
+        for p in appmod.DEFAULT_PRODUCTS:
+            db.session.add(appmod.Product(id=f"{tid}_{p['code']}", tenant_id=tid, name=p['name'], price=p['price'], unit=p['unit'], is_active=True))
+        for i in range(customers):
+            db.session.add(appmod.Customer(id=f'{tid}C{i + 1:05d}', tenant_id=tid, name=f'Customer {i + 1}', phone=f'9{i:09d}', address='Bench Street', dues=0.0))
+        db.session.commit()
+    return username, password
+
+def seed_history(appmod, tid='BENCH01', days=30, customers=100):
+    """Adds `days` of finalized orders, payments and expenses for seed_tenant() customers."""
+    from datetime import date, timedelta
+    db, Order, OrderItem = appmod.db, appmod.Order, appmod.OrderItem
+    start = date.today() - timedelta(days=days)
+    with appmod.app.app_context():
+        for d in range(days):
+            day = (start + timedelta(days=d)).isoformat()
+            orders, items, payments = [], [], []
+            for i in range(customers):
+                cid, oid = f'{tid}C{i + 1:05d}', f'{tid}-O{d}-{i}'
+                orders.append({'id': oid, 'tenant_id': tid, 'customer_id': cid, 'customer_name': f'Customer {i + 1}', 'date': day, 'status': 'finalized', 'total': 140.0})
+                items.append({'tenant_id': tid, 'order_id': oid, 'date': day, 'product_id': f'{tid}_p1', 'name': 'FCM 1L', 'quantity': 2.0, 'price': 70.0, 'position': 0})
+                if i % 7 == d % 7:
+                    payments.append({'id': f'{tid}-P{d}-{i}', 'tenant_id': tid, 'customer_id': cid, 'amount': 500.0, 'date': day, 'collected_by': 'Agent'})
+            db.session.execute(Order.__table__.insert(), orders)
+            db.session.execute(OrderItem.__table__.insert(), items)
+            if payments: db.session.execute(appmod.Payment.__table__.insert(), payments)
+            db.session.execute(appmod.Expense.__table__.insert(), [{'id': f'{tid}-E{d}', 'tenant_id': tid, 'title': 'Fuel', 'amount': 300.0, 'category': 'Operational', 'date': day}])
+        db.session.commit()
+
+def login(client, username, password):
+    res = client.post('/api/login', json={'username': username, 'password': password})
+    return {'Authorization': f"Bearer {res.json['token']}"}
+
+class StatementCounter:
+    """Counts cursor executions (database round trips) on an engine."""
+    def __init__(self, engine):
+        self.engine, self.count = engine, 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+def timed(fn, repeat=5):
+    """Runs fn `repeat` times and returns the median wall time in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
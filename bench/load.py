@@ -0,0 +1,200 @@
+"""Latency percentiles and throughput for the hot endpoints.
+
+In-process (default): seeds a synthetic tenant (bench/synth.py) in a fresh
+database and drives the app through the Flask test client, one request at a
+time, so numbers reflect server work only.
+
+Over HTTP: --url points at a running server (seed its database with
+bench.synth first). --procs processes each send --requests requests per
+scenario over a keep-alive connection.
+
+    python -m bench.load [--customers 200] [--years 0.5] [--requests 50]
+    python -m bench.load --url http://127.0.0.1:8000 --tenant SYN01 --procs 4
+    python -m bench.load --save-baseline bench/baseline.json
+    python -m bench.load --baseline bench/baseline.json [--tolerance 0.25]   # exit 1 on regression
+
+Scenarios: sync, save (re-save today's sheet), finalize (save a fresh draft
+sheet, untimed, then time the finalize), dashboard and reports (one 500-row
+keyset page of the last 30 days of orders).
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import sys
+import time
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+
+SCENARIOS = ('sync', 'save', 'finalize', 'dashboard', 'reports')
+
+def sheet(customers, date_str, status='draft'):
+    orders = []
+    for c in customers:
+        items = [{'productId': c['productId'], 'name': 'Milk', 'quantity': 2, 'price': c['price']}]
+        orders.append({'id': f"ORD-{date_str}-{c['id']}", 'customerId': c['id'], 'customerName': c['name'], 'items': items, 'total': 2 * c['price'], 'status': status})
+    return {'date': date_str, 'orders': orders}
+
+def scenario_requests(name, customers, n, worker=0):
+    """(setup, timed) request pairs, each (method, path, body); setup may be None."""
+    today = date.today()
+    for i in range(n):
+        if name == 'sync': yield None, ('GET', '/api/sync', None)
+        elif name == 'save': yield None, ('POST', '/api/orders/save', sheet(customers, today.isoformat()))
+        elif name == 'finalize':
+            # Each iteration finalizes a fresh future day so there is always work to do
+            ds = (today + timedelta(days=1 + worker * 1000 + i)).isoformat()
+            yield ('POST', '/api/orders/save', sheet(customers, ds)), ('POST', '/api/sheets/finalize', {'date': ds})
+        elif name == 'dashboard': yield None, ('GET', f'/api/dashboard?date={today.isoformat()}', None)
+        elif name == 'reports': yield None, ('GET', f'/api/reports/data?start={(today - timedelta(days=30)).isoformat()}&end={today.isoformat()}&entity=orders&limit=500', None)
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+def summarize(latencies, errors, elapsed):
+    if not latencies: return {'n': 0, 'errors': errors}
+    return {'n': len(latencies), 'errors': errors, 'p50': round(percentile(latencies, 50), 2), 'p95': round(percentile(latencies, 95), 2),
+            'p99': round(percentile(latencies, 99), 2), 'mean': round(sum(latencies) / len(latencies), 2), 'rps': round(len(latencies) / elapsed, 1)}
+
+# --- In-process ---
+
+def run_in_process(args):
+    from bench.common import load_app, login
+    from bench.synth import generate_tenant
+    appmod = load_app()
+    tid = 'LOAD01'
+    counts = generate_tenant(appmod, tid, customers=args.customers, years=args.years, seed=args.seed)
+    print(f"Seeded {tid}: " + ', '.join(f'{v} {k}' for k, v in counts.items()))
+    client = appmod.app.test_client()
+    headers = login(client, f'{tid.lower()}_admin', 'bench')
+    customers = sheet_customers(client.get('/api/sync', headers=headers).json, args.sheet_size)
+
+    def send(req):
+        method, path, body = req
+        return client.open(path, method=method, json=body, headers=headers).status_code
+
+    results = {}
+    for name in args.scenarios:
+        for setup, req in scenario_requests(name, customers, args.warmup, worker=50):
+            if setup: send(setup)
+            send(req)
+        latencies, errors, busy = [], 0, 0.0
+        for setup, req in scenario_requests(name, customers, args.requests):
+            if setup: send(setup)
+            started = time.perf_counter()
+            status = send(req)
+            took = time.perf_counter() - started
+            busy += took
+            if status == 200: latencies.append(took * 1000)
+            else: errors += 1
+        results[name] = summarize(latencies, errors, busy)
+    return results
+
+def sheet_customers(sync, size):
+    prices = {p['id']: p['price'] for p in sync['products']}
+    pid = next(iter(prices))
+    return [{'id': c['id'], 'name': c['name'], 'productId': pid, 'price': c['customRates'].get(pid, prices[pid])} for c in sync['customers'][:size]]
+
+# --- Over HTTP ---
+
+class HttpClient:
+    def __init__(self, url):
+        parts = urlsplit(url)
+        conn_cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.conn, self.headers = conn_cls(parts.netloc, timeout=60), {'Content-Type': 'application/json'}
+
+    def send(self, req):
+        method, path, body = req
+        self.conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=self.headers)
+        res = self.conn.getresponse()
+        data = res.read()
+        return res.status, data
+
+def http_login(client, username, password):
+    status, data = client.send(('POST', '/api/login', {'username': username, 'password': password}))
+    if status != 200: raise SystemExit(f'Login failed ({status}): {data[:200]!r}')
+    client.headers['Authorization'] = f"Bearer {json.loads(data)['token']}"
+
+def http_worker(job):
+    url, username, password, name, customers, n, worker = job
+    client = HttpClient(url)
+    http_login(client, username, password)
+    latencies, errors = [], 0
+    for setup, req in scenario_requests(name, customers, n, worker=worker):
+        if setup: client.send(setup)
+        started = time.perf_counter()
+        status, _ = client.send(req)
+        if status == 200: latencies.append((time.perf_counter() - started) * 1000)
+        else: errors += 1
+    return latencies, errors
+
+def run_http(args):
+    username = args.username or f'{args.tenant.lower()}_admin'
+    client = HttpClient(args.url)
+    http_login(client, username, args.password)
+    customers = sheet_customers(json.loads(client.send(('GET', '/api/sync', None))[1]), args.sheet_size)
+    results = {}
+    with multiprocessing.Pool(args.procs) as pool:
+        for name in args.scenarios:
+            pool.map(http_worker, [(args.url, username, args.password, name, customers, args.warmup, 50 + w) for w in range(args.procs)])
+            started = time.perf_counter()
+            parts = pool.map(http_worker, [(args.url, username, args.password, name, customers, args.requests, w) for w in range(args.procs)])
+            elapsed = time.perf_counter() - started
+            results[name] = summarize([l for lat, _ in parts for l in lat], sum(e for _, e in parts), elapsed)
+    return results
+
+# --- Baselines ---
+
+def compare(results, baseline, tolerance, min_delta):
+    """Scenarios whose p95 (or p50) grew by more than `tolerance` and `min_delta` ms."""
+    regressions = []
+    for name, now in results.items():
+        before = baseline.get('results', {}).get(name)
+        if not before or not now.get('n'): continue
+        for key in ('p50', 'p95'):
+            if now[key] > before[key] * (1 + tolerance) and now[key] - before[key] > min_delta:
+                regressions.append(f"{name} {key}: {before[key]}ms -> {now[key]}ms (+{(now[key] / before[key] - 1) * 100:.0f}%)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=50, help='Timed requests per scenario (per process over HTTP).')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--sheet-size', type=int, default=100, help='Customers per saved/finalized sheet.')
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--years', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help='Load a running server instead of the in-process app.')
+    parser.add_argument('--procs', type=int, default=4)
+    parser.add_argument('--tenant', default='SYN01')
+    parser.add_argument('--username')
+    parser.add_argument('--password', default='bench')
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--baseline', metavar='PATH')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative slowdown before failing (default 25%%).')
+    parser.add_argument('--min-delta', type=float, default=2.0, help='Ignore slowdowns smaller than this many ms.')
+    args = parser.parse_args()
+    args.scenarios = [s for s in args.scenarios.split(',') if s]
+    if any(s not in SCENARIOS for s in args.scenarios): parser.error(f'scenarios must be among {",".join(SCENARIOS)}')
+
+    results = run_http(args) if args.url else run_in_process(args)
+    mode = f'http x{args.procs}' if args.url else 'in-process'
+    print(f"\n{'scenario':<10} {'n':>5} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8}   ({mode})")
+    for name, r in results.items():
+        if r['n']: print(f"{name:<10} {r['n']:>5} {r['errors']:>4} {r['p50']:>8} {r['p95']:>8} {r['p99']:>8} {r['rps']:>8}")
+        else: print(f"{name:<10} {0:>5} {r['errors']:>4}   (no successful requests)")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f: json.dump({'mode': mode, 'customers': args.customers, 'years': args.years, 'sheetSize': args.sheet_size, 'results': results}, f, indent=2)
+        print(f'Baseline written to {args.save_baseline}')
+    failed = [f'{name}: {r["errors"]} errors' for name, r in results.items() if r['errors']]
+    if args.baseline:
+        with open(args.baseline) as f: failed += compare(results, json.load(f), args.tolerance, args.min_delta)
+    if failed:
+        print('FAIL\n  ' + '\n  '.join(failed))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
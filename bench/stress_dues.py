@@ -0,0 +1,83 @@
+"""Concurrent sheet saves, finalizes and payments against the same customers.
+
+Every worker thread owns its own dates, so orders never collide, but all of
+them move the same customers' dues. At the end each customer's dues must equal
+the finalized totals minus the payments that returned 200, and the ledger's
+latest closing balance must equal the sum of dues.
+
+    python -m bench.stress_dues [--threads 8] [--rounds 10] [--customers 20]
+
+SQLite serialises writers, so use BENCH_DATABASE_URL=postgresql://... to see
+real row-level contention.
+"""
+import argparse
+import random
+import sys
+import threading
+from datetime import date, timedelta
+
+from bench.common import load_app, seed_tenant, login
+
+def make_sheet(tid, customers, date_str, rng, status):
+    orders, totals = [], {}
+    for i in range(customers):
+        cid, qty = f'{tid}C{i + 1:05d}', rng.randint(1, 4)
+        totals[cid] = qty * 70.0
+        items = [{'productId': f'{tid}_p1', 'name': 'FCM 1L', 'quantity': qty, 'price': 70}]
+        orders.append({'id': f'ORD-{date_str}-{cid}', 'customerId': cid, 'customerName': f'Customer {i + 1}', 'items': items, 'total': totals[cid], 'status': status})
+    return {'date': date_str, 'orders': orders}, totals
+
+def worker(appmod, headers, tid, customers, rounds, index, expected, failures, lock):
+    client, rng = appmod.app.test_client(), random.Random(index)
+    start = date(2024, 1, 1) + timedelta(days=index * rounds)
+    for r in range(rounds):
+        date_str = (start + timedelta(days=r)).isoformat()
+        # Half the days are saved as drafts and finalized, half saved finalized
+        direct = r % 2 == 1
+        sheet, totals = make_sheet(tid, customers, date_str, rng, 'finalized' if direct else 'draft')
+        ok = client.post('/api/orders/save', json=sheet, headers=headers).status_code == 200
+        if ok and not direct: ok = client.post('/api/sheets/finalize', json={'date': date_str}, headers=headers).status_code == 200
+        with lock:
+            if ok:
+                for cid, total in totals.items(): expected[cid] = expected.get(cid, 0.0) + total
+            else: failures.append(('sheet', date_str))
+        for _ in range(3):
+            cid, amount = f'{tid}C{rng.randint(1, customers):05d}', float(rng.randint(1, 20) * 10)
+            res = client.post('/api/payments', json={'customerId': cid, 'amount': amount, 'date': date_str, 'collectedBy': 'Agent'}, headers=headers)
+            with lock:
+                if res.status_code == 200: expected[cid] = expected.get(cid, 0.0) - amount
+                else: failures.append(('payment', date_str))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--customers', type=int, default=20)
+    args = parser.parse_args()
+
+    appmod = load_app()
+    tid = 'STRESS01'
+    username, password = seed_tenant(appmod, tid, customers=args.customers)
+    headers = login(appmod.app.test_client(), username, password)
+
+    expected, failures, lock = {}, [], threading.Lock()
+    threads = [threading.Thread(target=worker, args=(appmod, headers, tid, args.customers, args.rounds, i, expected, failures, lock)) for i in range(args.threads)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    with appmod.app.app_context():
+        dues = dict(appmod.db.session.query(appmod.Customer.id, appmod.Customer.dues).filter_by(tenant_id=tid).all())
+        last = appmod.DailyLedger.query.filter_by(tenant_id=tid).order_by(appmod.DailyLedger.date.desc()).first()
+    wrong = {cid: (dues.get(cid, 0.0), total) for cid, total in expected.items() if abs(dues.get(cid, 0.0) - total) > 1e-6}
+    ledger_gap = abs((last.closing_balance if last else 0.0) - sum(dues.values()))
+
+    print(f'{args.threads} threads x {args.rounds} rounds, {args.customers} customers: {len(failures)} failed requests (rolled back)')
+    print(f'dues total {sum(dues.values()):.2f} expected {sum(expected.values()):.2f}; ledger gap {ledger_gap:.2f}')
+    for cid, (got, want) in sorted(wrong.items())[:10]: print(f'  {cid}: dues {got:.2f} expected {want:.2f}')
+    if wrong or ledger_gap > 1e-6:
+        print(f'FAIL: {len(wrong)} customers drifted')
+        sys.exit(1)
+    print('OK: dues are exact')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Synthetic tenants for benchmarks and load tests.
+
+generate_tenant() fills a tenant with customers, the default products, custom
+rates for a share of customers, and N years of daily orders, payments and
+expenses. Output is deterministic for a given seed. Dues and the daily
+ledger match the generated history. Run standalone to seed a database that a
+separately started server will use:
+
+    BENCH_DATABASE_URL=sqlite:////tmp/dairy.db python -m bench.synth --tenants 2 --customers 300 --years 2
+"""
+import argparse
+import json
+import random
+import time
+import zlib
+from datetime import date, timedelta
+
+from sqlalchemy import bindparam
+
+from bench.common import load_app
+
+def generate_tenant(appmod, tid, customers=200, years=1.0, rate_share=0.2, seed=0, legacy_items=False, end=None, password='bench'):
+    """Creates tenant `tid` with admin user '<tid>_admin'. Returns row counts.
+
+    Every day up to `end` (default today) gets an order for ~90% of customers
+    with 1-3 items, all finalized except `end` itself, which stays a draft
+    sheet. Each customer pays weekly. legacy_items writes Order.items_json blobs
+    instead of order_item rows, for exercising the migration path.
+    """
+    from werkzeug.security import generate_password_hash
+    db, rng = appmod.db, random.Random(f'{seed}:{tid}')
+    end = end or date.today()
+    start = end - timedelta(days=int(365 * years))
+    products = [(f"{tid}_{p['code']}", p['name'], p['price']) for p in appmod.DEFAULT_PRODUCTS]
+    cids = [f'{tid}C{i + 1:05d}' for i in range(customers)]
+    counts = {'customers': customers, 'products': len(products), 'rates': 0, 'orders': 0, 'items': 0, 'payments': 0, 'expenses': 0}
+
+    with appmod.app.app_context():
+        db.session.add(appmod.DairyTenant(id=tid, name=f'Synthetic {tid}', location_code='SYN', location_seq=1))
+        db.session.add(appmod.DairyUser(username=f'{tid.lower()}_admin', password=generate_password_hash(password), role='admin', tenant_id=tid))
+        db.session.execute(appmod.Product.__table__.insert(), [{'id': pid, 'tenant_id': tid, 'name': name, 'price': price, 'unit': 'Unit', 'is_active': True} for pid, name, price in products])
+        db.session.execute(appmod.Customer.__table__.insert(), [{'id': cid, 'tenant_id': tid, 'name': f'Customer {i + 1}', 'phone': f'8{zlib.crc32(tid.encode()) % 100:02d}{i:07d}', 'address': f'{i % 40 + 1} Market Road',
+                                                                 'dues': 0.0, 'status': 'Active'} for i, cid in enumerate(cids)])
+
+        # Regulars: a few products each, some at a negotiated rate
+        basket, rates = {}, {}
+        for cid in cids:
+            basket[cid] = rng.sample(products, rng.randint(1, 3))
+            if rng.random() < rate_share:
+                pid, _, price = basket[cid][0]
+                rates[cid] = {pid: round(price * rng.uniform(0.85, 0.95), 2)}
+        rate_rows = [{'tenant_id': tid, 'customer_id': cid, 'product_id': pid, 'rate': rate} for cid, r in rates.items() for pid, rate in r.items()]
+        if rate_rows: db.session.execute(appmod.CustomerRate.__table__.insert(), rate_rows)
+        counts['rates'] = len(rate_rows)
+
+        dues = dict.fromkeys(cids, 0.0)
+        day = start
+        while day <= end:
+            ds, orders, items, payments = day.isoformat(), [], [], []
+            status = 'draft' if day == end else 'finalized'
+            for i, cid in enumerate(cids):
+                if rng.random() >= 0.9: continue
+                oid, lines = f'{tid}-{ds}-{cid}', []
+                for pos, (pid, name, price) in enumerate(basket[cid]):
+                    lines.append({'tenant_id': tid, 'order_id': oid, 'date': ds, 'product_id': pid, 'name': name, 'quantity': float(rng.randint(1, 3)),
+                                  'price': rates.get(cid, {}).get(pid, price), 'position': pos})
+                total = sum(line['quantity'] * line['price'] for line in lines)
+                order = {'id': oid, 'tenant_id': tid, 'customer_id': cid, 'customer_name': f'Customer {i + 1}', 'date': ds, 'status': status, 'total': total}
+                if legacy_items: order['items_json'] = json.dumps([{'productId': l['product_id'], 'name': l['name'], 'quantity': l['quantity'], 'price': l['price']} for l in lines])
+                else: items.extend(lines)
+                orders.append(order)
+                if status == 'finalized': dues[cid] += total
+            for i, cid in enumerate(cids):
+                if (day.toordinal() + i) % 7 == 0 and dues[cid] > 0:
+                    amount = round(dues[cid] * rng.uniform(0.6, 1.0), -1)
+                    payments.append({'id': f'{tid}-P-{ds}-{cid}', 'tenant_id': tid, 'customer_id': cid, 'amount': amount, 'date': ds, 'collected_by': rng.choice(['Ravi', 'Suresh', 'Office'])})
+                    dues[cid] -= amount
+            expenses = [{'id': f'{tid}-E-{ds}-{n}', 'tenant_id': tid, 'title': title, 'amount': float(rng.randint(2, 40) * 50), 'category': category, 'date': ds}
+                        for n, (title, category) in enumerate(rng.sample([('Fuel', 'Operational'), ('Packaging', 'Supplies'), ('Wages', 'Salary'), ('Repairs', 'Maintenance')], rng.randint(1, 3)))]
+            if orders: db.session.execute(appmod.Order.__table__.insert(), orders)
+            if items: db.session.execute(appmod.OrderItem.__table__.insert(), items)
+            if payments: db.session.execute(appmod.Payment.__table__.insert(), payments)
+            db.session.execute(appmod.Expense.__table__.insert(), expenses)
+            counts['orders'] += len(orders)
+            counts['items'] += len(items)
+            counts['payments'] += len(payments)
+            counts['expenses'] += len(expenses)
+            day += timedelta(days=1)
+
+        table = appmod.Customer.__table__
+        db.session.execute(table.update().where(table.c.id == bindparam('b_id')).values(dues=bindparam('b_dues')),
+                           [{'b_id': cid, 'b_dues': round(d, 2)} for cid, d in dues.items()])
+        appmod.rebuild_ledger(tid)
+        db.session.commit()
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tenants', type=int, default=1)
+    parser.add_argument('--prefix', default='SYN')
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--years', type=float, default=1.0)
+    parser.add_argument('--rate-share', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--legacy-items', action='store_true', help='Store order items as items_json blobs (pre-migration layout).')
+    args = parser.parse_args()
+
+    appmod = load_app()
+    for n in range(args.tenants):
+        tid = f'{args.prefix}{n + 1:02d}'
+        started = time.perf_counter()
+        counts = generate_tenant(appmod, tid, args.customers, args.years, args.rate_share, args.seed, args.legacy_items)
+        print(f"{tid} ({tid.lower()}_admin / bench) in {time.perf_counter() - started:.1f}s: " + ', '.join(f'{v} {k}' for k, v in counts.items()))
+    print(f"Database: {appmod.app.config['SQLALCHEMY_DATABASE_URI']}")
+
+if __name__ == '__main__':
+    main()
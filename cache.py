@@ -0,0 +1,145 @@
+"""Caches used by the app: TTLCache for in-process lookups and TenantCache
+for per-tenant reads behind a pluggable backend."""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """Thread-safe LRU map whose entries also expire `ttl` seconds after being set."""
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize, self.ttl = maxsize, ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None: return default
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize: self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock: self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock: self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# --- TENANT READ CACHE ---
+# Backends share one small interface: get/set/delete for values and incr for
+# the version counters that make invalidation a single write.
+
+class LocalBackend:
+    """Per-process backend. Versions live outside the LRU so they are never evicted."""
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key): return self.entries.get(key)
+
+    def set(self, key, value, ttl=None): self.entries.set(key, value, ttl)
+
+    def delete(self, key): self.entries.delete(key)
+
+    def version(self, key): return self.counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+class RedisBackend:
+    """Backend for any client with Redis get/set(ex=)/delete/incr semantics."""
+
+    def __init__(self, client, ttl=60.0, prefix='dm:'):
+        self.client, self.ttl, self.prefix = client, ttl, prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key, value, ttl=None): self.client.set(self.prefix + key, json.dumps(value), ex=int(ttl or self.ttl))
+
+    def delete(self, key): self.client.delete(self.prefix + key)
+
+    def version(self, key): return int(self.client.get(self.prefix + key) or 0)
+
+    def incr(self, key): return self.client.incr(self.prefix + key)
+
+class FakeRedis:
+    """In-memory stand-in for a Redis client (get/set/delete/incr) for local runs."""
+
+    def __init__(self):
+        self.data, self._lock = {}, threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires = self.data.get(key, (None, None))
+            if expires is not None and expires < time.monotonic():
+                del self.data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self._lock: self.data[key] = (value.encode() if isinstance(value, str) else value, time.monotonic() + ex if ex else None)
+        return True
+
+    def delete(self, key):
+        with self._lock: return 1 if self.data.pop(key, None) else 0
+
+    def incr(self, key):
+        with self._lock:
+            value, expires = self.data.get(key, (b'0', None))
+            value = int(value) + 1
+            self.data[key] = (str(value).encode(), expires)
+            return value
+
+def make_backend(url, maxsize=1024, ttl=60.0):
+    """memory:// (default), fakeredis:// or redis://... (needs the redis package)."""
+    if not url or url.startswith('memory://'): return LocalBackend(maxsize=maxsize, ttl=ttl)
+    if url.startswith('fakeredis://'): return RedisBackend(FakeRedis(), ttl=ttl)
+    if url.startswith(('redis://', 'rediss://')):
+        import redis
+        return RedisBackend(redis.Redis.from_url(url), ttl=ttl)
+    raise ValueError(f'Unsupported CACHE_URL: {url}')
+
+class TenantCache:
+    """Per-tenant read cache. Keys embed a namespace version, so invalidate()
+    is one counter bump and stale entries simply age out."""
+
+    def __init__(self, backend, ttl=60.0):
+        self.backend, self.ttl = backend, ttl
+        self.hits = self.misses = 0
+
+    def _key(self, tid, namespace, name):
+        return f'{tid}:{namespace}:{self.backend.version(f"v:{tid}:{namespace}")}:{name}'
+
+    def get_or_load(self, tid, namespace, name, loader):
+        key = self._key(tid, namespace, name)
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            value = loader()
+            self.backend.set(key, value, self.ttl)
+        else: self.hits += 1
+        return value
+
+    def invalidate(self, tid, *namespaces):
+        for namespace in namespaces: self.backend.incr(f'v:{tid}:{namespace}')
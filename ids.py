@@ -0,0 +1,83 @@
+"""Time-ordered record IDs.
+
+IDs are minted in process with no database round trip. They sort by creation
+time, so primary-key inserts land at the right edge of the B-tree.
+
+ID_GENERATOR=ulid (default)  26-char Crockford base32 ULID, monotonic per
+                             process. Needs no coordination between workers.
+ID_GENERATOR=snowflake       19-digit zero-padded id: 41-bit ms, 10-bit worker,
+                             12-bit sequence. WORKER_ID (0-1023) must be unique
+                             per process, e.g. set in a gunicorn post_fork hook.
+"""
+import os
+import threading
+import time
+
+CROCKFORD = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+class UlidGenerator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+        # A forked worker must not continue the parent's random sequence
+        if hasattr(os, 'register_at_fork'): os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._last_ms, self._rand = -1, 0
+
+    def __call__(self):
+        with self._lock:
+            ms = time.time_ns() // 1_000_000
+            if ms > self._last_ms:
+                self._last_ms, self._rand = ms, int.from_bytes(os.urandom(10), 'big')
+            else:
+                # Same millisecond (or the clock stepped back): increment to stay ordered
+                self._rand += 1
+                if self._rand >> 80: self._last_ms, self._rand = self._last_ms + 1, 0
+            value = (self._last_ms << 80) | self._rand
+        chars = []
+        for _ in range(26):
+            chars.append(CROCKFORD[value & 31])
+            value >>= 5
+        return ''.join(reversed(chars))
+
+class SnowflakeGenerator:
+    EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+
+    def __init__(self, worker_id):
+        if not 0 <= worker_id < 1024: raise ValueError('WORKER_ID must be between 0 and 1023')
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._last_ms, self._seq = -1, 0
+
+    def __call__(self):
+        with self._lock:
+            ms = max(time.time_ns() // 1_000_000 - self.EPOCH_MS, self._last_ms)
+            if ms == self._last_ms:
+                self._seq = (self._seq + 1) & 0xFFF
+                # Sequence exhausted: borrow the next millisecond rather than sleep
+                if self._seq == 0: ms += 1
+            else: self._seq = 0
+            self._last_ms = ms
+            value = (ms << 22) | (self.worker_id << 12) | self._seq
+        return f'{value:019d}'
+
+def make_generator(kind=None, worker_id=None):
+    kind = (kind or os.environ.get('ID_GENERATOR', 'ulid')).lower()
+    if kind == 'ulid': return UlidGenerator()
+    if kind == 'snowflake': return SnowflakeGenerator(int(worker_id if worker_id is not None else os.environ.get('WORKER_ID', 0)))
+    raise ValueError(f'Unknown ID_GENERATOR: {kind}')
+
+_generator = make_generator()
+
+def configure(kind=None, worker_id=None):
+    global _generator
+    _generator = make_generator(kind, worker_id)
+
+def new_id(prefix=''):
+    return prefix + _generator()
+
+def is_ulid(value, prefix=''):
+    # The shape of a client-minted ULID id: prefix + 26 Crockford base32 chars
+    body = value[len(prefix):] if isinstance(value, str) and value.startswith(prefix) else ''
+    return len(body) == 26 and body[0] in '01234567' and all(ch in CROCKFORD for ch in body)
@@ -0,0 +1,142 @@
+"""In-process counters behind /api/admin/metrics, plus Prometheus text output.
+
+Every gunicorn worker keeps its own numbers (and its own connection pool), so
+scrape each worker or multiply by the worker count when sizing the database.
+"""
+import threading
+from bisect import bisect_left
+
+class PoolStats:
+    """Time spent waiting for a pooled connection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = self.timeouts = 0
+        self.wait_total = self.wait_max = 0.0
+
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {"checkouts": self.checkouts, "timeouts": self.timeouts, "waitTotalMs": round(self.wait_total * 1000, 3),
+                    "waitAvgMs": round(self.wait_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0, "waitMaxMs": round(self.wait_max * 1000, 3)}
+
+class RouteStats:
+    """Requests, SQL statements and database time per route."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = {}
+
+    def record(self, route, queries, db_seconds):
+        with self._lock:
+            r = self.routes.setdefault(route, {"requests": 0, "queries": 0, "maxQueries": 0, "dbTime": 0.0})
+            r["requests"] += 1
+            r["queries"] += queries
+            r["maxQueries"] = max(r["maxQueries"], queries)
+            r["dbTime"] += db_seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {route: {"requests": r["requests"], "queries": r["queries"], "avgQueries": round(r["queries"] / r["requests"], 2), "maxQueries": r["maxQueries"],
+                            "dbTimeMs": round(r["dbTime"] * 1000, 3)} for route, r in sorted(self.routes.items())}
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total, out = 0, []
+        for le, n in zip(self.buckets + (float('inf'),), self.counts):
+            total += n
+            out.append((le, total))
+        return out
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+BYTES_BUCKETS = (1024, 10240, 102400, 1048576, 10485760)
+
+class RequestProfiler:
+    """Per-route histograms of wall time, DB time, statement count and response size."""
+
+    METRICS = (('request_duration_seconds', 'Wall time per request.', SECONDS_BUCKETS),
+               ('request_db_seconds', 'Time spent in SQL per request.', SECONDS_BUCKETS),
+               ('request_queries', 'SQL statements per request.', QUERY_BUCKETS),
+               ('response_size_bytes', 'Response body size (buffered responses only).', BYTES_BUCKETS))
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = {}
+        self.flagged = {}
+
+    def observe(self, route, wall, db_time, queries, size, flagged=False):
+        with self._lock:
+            if route not in self.routes: self.routes[route] = [Histogram(buckets) for _, _, buckets in self.METRICS]
+            hists = self.routes[route]
+            hists[0].observe(wall)
+            hists[1].observe(db_time)
+            hists[2].observe(queries)
+            if size is not None: hists[3].observe(size)
+            if flagged: self.flagged[route] = self.flagged.get(route, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            histograms = {route: [{"buckets": h.cumulative(), "sum": h.sum, "count": h.count} for h in hists] for route, hists in sorted(self.routes.items())}
+            return histograms, dict(sorted(self.flagged.items()))
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _num(value):
+    return '+Inf' if value == float('inf') else repr(float(value)) if isinstance(value, float) else str(value)
+
+def render_prometheus(pool_state, pool_stats, route_stats, profiler=None, prefix='dairy'):
+    """Text exposition format (version 0.0.4) for one worker's metrics."""
+    lines = []
+    def family(name, kind, help_text):
+        lines.append(f'# HELP {prefix}_{name} {help_text}')
+        lines.append(f'# TYPE {prefix}_{name} {kind}')
+
+    for key, help_text in (('checkedout', 'Connections in use.'), ('checkedin', 'Idle connections in the pool.'), ('overflow', 'Connections above pool_size.'), ('size', 'Configured pool size.')):
+        if key in pool_state:
+            family(f'pool_{key}', 'gauge', help_text)
+            lines.append(f'{prefix}_pool_{key} {pool_state[key]}')
+    waits = pool_stats.snapshot()
+    for name, help_text, value in (('pool_checkouts_total', 'Connection checkouts.', waits['checkouts']), ('pool_timeouts_total', 'Checkouts that hit pool_timeout.', waits['timeouts']),
+                                   ('pool_wait_seconds_total', 'Time spent waiting for a connection.', waits['waitTotalMs'] / 1000)):
+        family(name, 'counter', help_text)
+        lines.append(f'{prefix}_{name} {_num(value)}')
+
+    routes = route_stats.snapshot()
+    for name, help_text, value in (('route_requests_total', 'Requests per route.', lambda r: r['requests']), ('route_queries_total', 'SQL statements per route.', lambda r: r['queries']),
+                                   ('route_db_seconds_total', 'SQL time per route.', lambda r: r['dbTimeMs'] / 1000)):
+        family(name, 'counter', help_text)
+        for route, r in routes.items(): lines.append(f'{prefix}_{name}{{route="{_label(route)}"}} {_num(value(r))}')
+
+    if profiler:
+        histograms, flagged = profiler.snapshot()
+        for i, (name, help_text, _) in enumerate(profiler.METRICS):
+            family(name, 'histogram', help_text)
+            for route, hists in histograms.items():
+                h, label = hists[i], _label(route)
+                for le, count in h['buckets']: lines.append(f'{prefix}_{name}_bucket{{route="{label}",le="{_num(le)}"}} {count}')
+                lines.append(f'{prefix}_{name}_sum{{route="{label}"}} {_num(h["sum"])}')
+                lines.append(f'{prefix}_{name}_count{{route="{label}"}} {h["count"]}')
+        family('n_plus_one_total', 'counter', 'Requests whose statement count passed the N+1 threshold.')
+        for route, n in flagged.items(): lines.append(f'{prefix}_n_plus_one_total{{route="{_label(route)}"}} {n}')
+    return '\n'.join(lines) + '\n'